@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException, Depends
 from typing import Optional, Dict
 from utils.auth_utils import verify_admin_api_key
 from utils.suna_default_agent_service import SunaDefaultAgentService
+from services import run_dispatch, stream_buffer
 from utils.logger import logger
 from utils.config import config, EnvMode
 from dotenv import load_dotenv, set_key, find_dotenv, dotenv_values
@@ -31,6 +32,16 @@ async def admin_install_suna_for_user(
             detail=f"Failed to install Suna agent for user {account_id}"
         )
 
+@router.get("/run-dispatch/stats")
+async def admin_run_dispatch_stats(_: bool = Depends(verify_admin_api_key)):
+    """Queue depth and queue-wait metrics for each agent run dispatch lane."""
+    return await run_dispatch.lane_stats()
+
+@router.get("/run-stream/stats")
+async def admin_run_stream_stats(_: bool = Depends(verify_admin_api_key)):
+    """Buffered bytes of this API process's SSE clients and slow-client load shedding."""
+    return stream_buffer.stats()
+
 @router.get("/env-vars")
 def get_env_vars() -> Dict[str, str]:
     """Get environment variables (local mode only)."""
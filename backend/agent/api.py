@@ -10,23 +10,29 @@ import jwt
 from pydantic import BaseModel
 import tempfile
 import os
+import time
 
 from agentpress.thread_manager import ThreadManager
+from agentpress.stream_event import STORED_WIRE_VERSION, WIRE_VERSIONS, encode_event, transcode
 from services.supabase import DBConnection
-from services import redis
+from services import redis, run_registry, run_stream, run_dispatch, run_archive, run_limits
+from services.stream_buffer import ClientStreamBuffer
 from utils.auth_utils import get_current_user_id_from_jwt, get_user_id_from_stream_auth, verify_thread_access, verify_admin_api_key
 from utils.logger import logger, structlog
+from utils.pagination import apply_keyset, decode_cursor, encode_cursor, rewind_cursor
+from utils import access_cache
 from services.billing import check_billing_status, can_use_model
 from utils.config import config
 from sandbox.sandbox import create_sandbox, delete_sandbox, get_or_start_sandbox
 from services.llm import make_llm_api_call
-from run_agent_background import run_agent_background, _cleanup_redis_response_list, update_agent_run_status
+from run_agent_background import dispatch_agent_run, _cleanup_redis_response_list, update_agent_run_status
 from utils.constants import MODEL_NAME_ALIASES
 from flags.flags import is_enabled
 
 from .config_helper import extract_agent_config, build_unified_config, extract_tools_for_agent_run, get_mcp_configs
 from .utils import check_agent_run_limit
 from .versioning.version_service import get_version_service
+from .versioning import version_cache
 from .versioning.api import router as version_router, initialize as initialize_versioning
 
 # Helper for version service
@@ -39,6 +45,8 @@ router.include_router(version_router)
 
 db = None
 instance_id = None # Global instance ID for this backend instance
+# Workspace provisioning tasks in flight, referenced until done so they are not garbage collected
+_workspace_tasks = set()
 
 # TTL for Redis response lists (24 hours)
 REDIS_RESPONSE_LIST_TTL = 3600 * 24
@@ -208,17 +216,11 @@ async def cleanup():
     # Use the instance_id to find and clean up this instance's keys
     try:
         if instance_id: # Ensure instance_id is set
-            running_keys = await redis.keys(f"active_run:{instance_id}:*")
-            logger.info(f"Found {len(running_keys)} running agent runs for instance {instance_id} to clean up")
-
-            for key in running_keys:
-                # Key format: active_run:{instance_id}:{agent_run_id}
-                parts = key.split(":")
-                if len(parts) == 3:
-                    agent_run_id = parts[2]
-                    await stop_agent_run(agent_run_id, error_message=f"Instance {instance_id} shutting down")
-                else:
-                    logger.warning(f"Unexpected key format found: {key}")
+            running_run_ids = await run_registry.runs_for_instance(instance_id)
+            logger.info(f"Found {len(running_run_ids)} running agent runs for instance {instance_id} to clean up")
+
+            for agent_run_id in running_run_ids:
+                await stop_agent_run(agent_run_id, error_message=f"Instance {instance_id} shutting down")
         else:
             logger.warning("Instance ID not set, cannot clean up instance-specific agent runs.")
 
@@ -235,17 +237,6 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
     client = await db.client
     final_status = "failed" if error_message else "stopped"
 
-    # Attempt to fetch final responses from Redis
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    all_responses = []
-    try:
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
-        all_responses = [json.loads(r) for r in all_responses_json]
-        logger.info(f"Fetched {len(all_responses)} responses from Redis for DB update on stop/fail: {agent_run_id}")
-    except Exception as e:
-        logger.error(f"Failed to fetch responses from Redis for {agent_run_id} during stop/fail: {e}")
-        # Try fetching from DB as a fallback? Or proceed without responses? Proceeding without for now.
-
     # Update the agent run status in the database
     update_success = await update_agent_run_status(
         client, agent_run_id, final_status, error=error_message
@@ -265,22 +256,16 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
 
     # Find all instances handling this agent run and send STOP to instance-specific channels
     try:
-        instance_keys = await redis.keys(f"active_run:*:{agent_run_id}")
-        logger.debug(f"Found {len(instance_keys)} active instance keys for agent run {agent_run_id}")
-
-        for key in instance_keys:
-            # Key format: active_run:{instance_id}:{agent_run_id}
-            parts = key.split(":")
-            if len(parts) == 3:
-                instance_id_from_key = parts[1]
-                instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id_from_key}"
-                try:
-                    await redis.publish(instance_control_channel, "STOP")
-                    logger.debug(f"Published STOP signal to instance channel {instance_control_channel}")
-                except Exception as e:
-                    logger.warning(f"Failed to publish STOP signal to instance channel {instance_control_channel}: {str(e)}")
-            else:
-                 logger.warning(f"Unexpected key format found: {key}")
+        run_instance_ids = await run_registry.instances_for_run(agent_run_id)
+        logger.debug(f"Found {len(run_instance_ids)} active instances for agent run {agent_run_id}")
+
+        for instance_id_from_registry in run_instance_ids:
+            instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id_from_registry}"
+            try:
+                await redis.publish(instance_control_channel, "STOP")
+                logger.debug(f"Published STOP signal to instance channel {instance_control_channel}")
+            except Exception as e:
+                logger.warning(f"Failed to publish STOP signal to instance channel {instance_control_channel}: {str(e)}")
 
         # Clean up the response list immediately on stop/fail
         await _cleanup_redis_response_list(agent_run_id)
@@ -337,11 +322,10 @@ async def start_agent(
     client = await db.client
 
 
-    thread_result = await client.table('threads').select('project_id', 'account_id', 'metadata').eq('thread_id', thread_id).execute()
+    thread_data = await access_cache.get_thread(client, thread_id)
 
-    if not thread_result.data:
+    if not thread_data:
         raise HTTPException(status_code=404, detail="Thread not found")
-    thread_data = thread_result.data[0]
     project_id = thread_data.get('project_id')
     account_id = thread_data.get('account_id')
     thread_metadata = thread_data.get('metadata', {})
@@ -373,37 +357,22 @@ async def start_agent(
     if effective_agent_id:
         logger.info(f"[AGENT LOAD] Querying for agent: {effective_agent_id}")
         # Get agent
-        agent_result = await client.table('agents').select('*').eq('agent_id', effective_agent_id).eq('account_id', account_id).execute()
-        logger.info(f"[AGENT LOAD] Query result: found {len(agent_result.data) if agent_result.data else 0} agents")
+        agent_data = await access_cache.get_agent(client, effective_agent_id)
+        if agent_data and agent_data.get('account_id') != account_id:
+            agent_data = None
+        logger.info(f"[AGENT LOAD] Query result: found {1 if agent_data else 0} agents")
         
-        if not agent_result.data:
+        if not agent_data:
             if body.agent_id:
                 raise HTTPException(status_code=404, detail="Agent not found or access denied")
             else:
                 logger.warning(f"Stored agent_id {effective_agent_id} not found, falling back to default")
                 effective_agent_id = None
         else:
-            agent_data = agent_result.data[0]
-            version_data = None
-            if agent_data.get('current_version_id'):
-                try:
-                    version_service = await _get_version_service()
-                    version_obj = await version_service.get_version(
-                        agent_id=effective_agent_id,
-                        version_id=agent_data['current_version_id'],
-                        user_id=user_id
-                    )
-                    version_data = version_obj.to_dict()
-                    logger.info(f"[AGENT LOAD] Got version data from version manager: {version_data.get('version_name')}")
-                except Exception as e:
-                    logger.warning(f"[AGENT LOAD] Failed to get version data: {e}")
+            # Current version from the version cache, merged with the agent row
+            agent_config = await version_cache.resolve_agent_config(agent_data)
             
-            logger.info(f"[AGENT LOAD] About to call extract_agent_config with agent_data keys: {list(agent_data.keys())}")
-            logger.info(f"[AGENT LOAD] version_data type: {type(version_data)}, has data: {version_data is not None}")
-            
-            agent_config = extract_agent_config(agent_data, version_data)
-            
-            if version_data:
+            if agent_config.get('current_version_id'):
                 logger.info(f"Using agent {agent_config['name']} ({effective_agent_id}) version {agent_config.get('version_name', 'v1')}")
             else:
                 logger.info(f"Using agent {agent_config['name']} ({effective_agent_id}) - no version data")
@@ -419,26 +388,10 @@ async def start_agent(
         if default_agent_result.data:
             agent_data = default_agent_result.data[0]
             
-            # Use versioning system to get current version
-            version_data = None
-            if agent_data.get('current_version_id'):
-                try:
-                    version_service = await _get_version_service()
-                    version_obj = await version_service.get_version(
-                        agent_id=agent_data['agent_id'],
-                        version_id=agent_data['current_version_id'],
-                        user_id=user_id
-                    )
-                    version_data = version_obj.to_dict()
-                    logger.info(f"[AGENT LOAD] Got default agent version from version manager: {version_data.get('version_name')}")
-                except Exception as e:
-                    logger.warning(f"[AGENT LOAD] Failed to get default agent version data: {e}")
+            # Current version from the version cache, merged with the agent row
+            agent_config = await version_cache.resolve_agent_config(agent_data)
             
-            logger.info(f"[AGENT LOAD] About to call extract_agent_config for DEFAULT agent with version data: {version_data is not None}")
-            
-            agent_config = extract_agent_config(agent_data, version_data)
-            
-            if version_data:
+            if agent_config.get('current_version_id'):
                 logger.info(f"Using default agent: {agent_config['name']} ({agent_config['agent_id']}) version {agent_config.get('version_name', 'v1')}")
             else:
                 logger.info(f"Using default agent: {agent_config['name']} ({agent_config['agent_id']}) - no version data")
@@ -450,10 +403,11 @@ async def start_agent(
         logger.info(f"[AGENT LOAD] Agent config keys: {list(agent_config.keys())}")
         logger.info(f"Using agent {agent_config['agent_id']} for this agent run (thread remains agent-agnostic)")
 
-    # Run all checks concurrently
+    # Run all checks concurrently; the limit check takes the run's slot under the id it is inserted with
+    agent_run_id = str(uuid.uuid4())
     model_check_task = asyncio.create_task(can_use_model(client, account_id, model_name))
     billing_check_task = asyncio.create_task(check_billing_status(client, account_id))
-    limit_check_task = asyncio.create_task(check_agent_run_limit(client, account_id))
+    limit_check_task = asyncio.create_task(check_agent_run_limit(client, account_id, agent_run_id, thread_id))
 
     # Wait for all checks to complete
     (can_use, model_message, allowed_models), (can_run, message, subscription), limit_check = await asyncio.gather(
@@ -461,6 +415,9 @@ async def start_agent(
     )
 
     # Check results and raise appropriate errors
+    if (not can_use or not can_run) and limit_check['reserved']:
+        await run_limits.release(account_id, agent_run_id)
+
     if not can_use:
         raise HTTPException(status_code=403, detail={"message": model_message, "allowed_models": allowed_models})
 
@@ -486,7 +443,8 @@ async def start_agent(
     else:
         logger.info(f"Using default model: {effective_model}")
     
-    agent_run = await client.table('agent_runs').insert({
+    await client.table('agent_runs').insert({
+        "id": agent_run_id,
         "thread_id": thread_id,
         "status": "running",
         "started_at": datetime.now(timezone.utc).isoformat(),
@@ -501,27 +459,27 @@ async def start_agent(
         }
     }).execute()
 
-    agent_run_id = agent_run.data[0]['id']
     structlog.contextvars.bind_contextvars(
         agent_run_id=agent_run_id,
     )
     logger.info(f"Created new agent run: {agent_run_id}")
+    await run_limits.run_started(account_id, project_id, agent_run_id, thread_id)
 
-    instance_key = f"active_run:{instance_id}:{agent_run_id}"
     try:
-        await redis.set(instance_key, "running", ex=redis.REDIS_KEY_TTL)
+        await run_registry.claim_run(agent_run_id, instance_id)
     except Exception as e:
-        logger.warning(f"Failed to register agent run in Redis ({instance_key}): {str(e)}")
+        logger.warning(f"Failed to register agent run {agent_run_id} in Redis: {str(e)}")
 
     request_id = structlog.contextvars.get_contextvars().get('request_id')
 
-    run_agent_background.send(
+    await dispatch_agent_run(
+        run_dispatch.INTERACTIVE, account_id,
         agent_run_id=agent_run_id, thread_id=thread_id, instance_id=instance_id,
         project_id=project_id,
         model_name=model_name,  # Already resolved above
         enable_thinking=body.enable_thinking, reasoning_effort=body.reasoning_effort,
         stream=body.stream, enable_context_manager=body.enable_context_manager,
-        agent_config=agent_config,  # Pass agent configuration
+        agent_config=version_cache.config_ref(agent_config),  # Resolved again by the worker via the version cache
         is_agent_builder=is_agent_builder,
         target_agent_id=target_agent_id,
         request_id=request_id,
@@ -724,9 +682,25 @@ async def get_thread_agent(thread_id: str, user_id: str = Depends(get_current_us
 async def stream_agent_run(
     agent_run_id: str,
     token: Optional[str] = None,
+    last_event_id: Optional[str] = None,
+    wire_version: Optional[int] = None,
     request: Request = None
 ):
-    """Stream the responses of an agent run using Redis Lists and Pub/Sub."""
+    """Stream the responses of an agent run using Redis Lists and Pub/Sub.
+
+    Each frame's SSE id is the response's index in the run's Redis list. Clients
+    reconnecting with a Last-Event-ID header (or last_event_id query parameter)
+    only receive the responses stored after that index.
+
+    Clients choose the event format with the X-Stream-Wire-Version header or the
+    wire_version query parameter (1, the default, or 2; see agentpress/stream_event.py).
+    Frames already stored in that version are sent as stored. Version 0 sends
+    every frame as stored, for clients that read both versions.
+
+    Each client gets a bounded buffer between Redis and the response; clients
+    that fall behind have frames coalesced or dropped, or are told to reconnect
+    (see services/stream_buffer.py).
+    """
     logger.info(f"Starting stream for agent run: {agent_run_id}")
     client = await db.client
 
@@ -738,29 +712,40 @@ async def stream_agent_run(
         user_id=user_id,
     )
 
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    response_channel = f"agent_run:{agent_run_id}:new_response"
+    response_list_key = run_stream.response_list_key(agent_run_id)
+    response_channel = run_stream.response_channel(agent_run_id)
     control_channel = f"agent_run:{agent_run_id}:control" # Global control channel
+    header_event_id = request.headers.get("last-event-id") if request else None
+    resume_after = run_stream.parse_last_event_id(header_event_id or last_event_id)
+    header_wire_version = request.headers.get("x-stream-wire-version") if request else None
+    client_wire_version = int(header_wire_version) if header_wire_version and header_wire_version.isdigit() else wire_version
+    if client_wire_version not in WIRE_VERSIONS and client_wire_version != STORED_WIRE_VERSION:
+        client_wire_version = 1
 
     async def stream_generator(agent_run_data):
         logger.debug(f"Streaming responses for {agent_run_id} using Redis list {response_list_key} and channel {response_channel}")
-        last_processed_index = -1
+        last_processed_index = resume_after
         pubsub_response = None
         pubsub_control = None
         listener_task = None
+        reader_task = None
+        client_buffer = None
         terminate_stream = False
         initial_yield_complete = False
 
         try:
-            # 1. Fetch and yield initial responses from Redis list
-            initial_responses_json = await redis.lrange(response_list_key, 0, -1)
-            initial_responses = []
+            # 1. Fetch and yield stored responses the client has not seen yet, as stored
+            # (from the archive for finished runs whose responses were compacted)
+            first_index, initial_responses_json = await run_archive.read_responses(
+                agent_run_id, last_processed_index + 1,
+                allow_cold=agent_run_data.get('status') != 'running' if agent_run_data else False,
+            )
+            last_processed_index = first_index - 1
             if initial_responses_json:
-                initial_responses = [json.loads(r) for r in initial_responses_json]
-                logger.debug(f"Sending {len(initial_responses)} initial responses for {agent_run_id}")
-                for response in initial_responses:
-                    yield f"data: {json.dumps(response)}\n\n"
-                last_processed_index = len(initial_responses) - 1
+                logger.debug(f"Sending {len(initial_responses_json)} initial responses for {agent_run_id} (resuming after {resume_after})")
+                for raw_response in initial_responses_json:
+                    last_processed_index += 1
+                    yield run_stream.sse_frame(last_processed_index, transcode(raw_response, client_wire_version))
             initial_yield_complete = True
 
             # 2. Check run status
@@ -840,51 +825,61 @@ async def stream_agent_run(
 
             listener_task = asyncio.create_task(listen_messages())
 
-            # 4. Main loop to process messages from the queue
-            while not terminate_stream:
+            # 4. Read new responses as they are published into the client's bounded
+            # buffer, independently of how fast the client consumes the stream
+            client_buffer = ClientStreamBuffer(agent_run_id)
+
+            async def fill_client_buffer():
+                nonlocal last_processed_index
                 try:
-                    queue_item = await message_queue.get()
-
-                    if queue_item["type"] == "new_response":
-                        # Fetch new responses from Redis list starting after the last processed index
-                        new_start_index = last_processed_index + 1
-                        new_responses_json = await redis.lrange(response_list_key, new_start_index, -1)
-
-                        if new_responses_json:
-                            new_responses = [json.loads(r) for r in new_responses_json]
-                            num_new = len(new_responses)
-                            # logger.debug(f"Received {num_new} new responses for {agent_run_id} (index {new_start_index} onwards)")
-                            for response in new_responses:
-                                yield f"data: {json.dumps(response)}\n\n"
+                    while True:
+                        queue_item = await message_queue.get()
+
+                        if queue_item["type"] == "new_response":
+                            # Fetch new responses from Redis list starting after the last processed index
+                            first_index, new_responses_json = await run_archive.read_responses(agent_run_id, last_processed_index + 1)
+                            last_processed_index = first_index - 1
+                            for raw_response in new_responses_json:
+                                last_processed_index += 1
+                                if not client_buffer.push(last_processed_index, raw_response):
+                                    return  # Client was disconnected for falling behind
                                 # Check if this response signals completion
-                                if response.get('type') == 'status' and response.get('status') in ['completed', 'failed', 'stopped']:
-                                    logger.info(f"Detected run completion via status message in stream: {response.get('status')}")
-                                    terminate_stream = True
-                                    break # Stop processing further new responses
-                            last_processed_index += num_new
-                        if terminate_stream: break
-
-                    elif queue_item["type"] == "control":
-                        control_signal = queue_item["data"]
-                        terminate_stream = True # Stop the stream on any control signal
-                        yield f"data: {json.dumps({'type': 'status', 'status': control_signal})}\n\n"
-                        break
-
-                    elif queue_item["type"] == "error":
-                        logger.error(f"Listener error for {agent_run_id}: {queue_item['data']}")
-                        terminate_stream = True
-                        yield f"data: {json.dumps({'type': 'status', 'status': 'error'})}\n\n"
-                        break
+                                status = run_stream.terminal_status(raw_response)
+                                if status:
+                                    logger.info(f"Detected run completion via status message in stream: {status}")
+                                    client_buffer.finish()
+                                    return
+
+                        elif queue_item["type"] == "control":
+                            client_buffer.finish(json.dumps({'type': 'status', 'status': queue_item["data"]}))
+                            return
 
+                        elif queue_item["type"] == "error":
+                            logger.error(f"Listener error for {agent_run_id}: {queue_item['data']}")
+                            client_buffer.finish(json.dumps({'type': 'status', 'status': 'error'}))
+                            return
                 except asyncio.CancelledError:
-                     logger.info(f"Stream generator main loop cancelled for {agent_run_id}")
-                     terminate_stream = True
-                     break
+                    raise
                 except Exception as loop_err:
                     logger.error(f"Error in stream generator main loop for {agent_run_id}: {loop_err}", exc_info=True)
-                    terminate_stream = True
-                    yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': f'Stream failed: {loop_err}'})}\n\n"
+                    client_buffer.finish(json.dumps({'type': 'status', 'status': 'error', 'message': f'Stream failed: {loop_err}'}))
+
+            reader_task = asyncio.create_task(fill_client_buffer())
+
+            # 5. Send buffered frames at the client's pace
+            while True:
+                try:
+                    frame = await client_buffer.get()
+                except asyncio.CancelledError:
+                    logger.info(f"Stream generator main loop cancelled for {agent_run_id}")
                     break
+                if frame is None:
+                    break
+                index, raw_response = frame
+                if index is None:
+                    yield f"data: {raw_response}\n\n"
+                else:
+                    yield run_stream.sse_frame(index, transcode(raw_response, client_wire_version))
 
         except Exception as e:
             logger.error(f"Error setting up stream for agent run {agent_run_id}: {e}", exc_info=True)
@@ -893,6 +888,10 @@ async def stream_agent_run(
                  yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': f'Failed to start stream: {e}'})}\n\n"
         finally:
             terminate_stream = True
+            if reader_task:
+                reader_task.cancel()
+            if client_buffer:
+                client_buffer.close()
             # Graceful shutdown order: unsubscribe → close → cancel
             if pubsub_response: await pubsub_response.unsubscribe(response_channel)
             if pubsub_control: await pubsub_control.unsubscribe(control_channel)
@@ -914,7 +913,7 @@ async def stream_agent_run(
     return StreamingResponse(stream_generator(agent_run_data), media_type="text/event-stream", headers={
         "Cache-Control": "no-cache, no-transform", "Connection": "keep-alive",
         "X-Accel-Buffering": "no", "Content-Type": "text/event-stream",
-        "Access-Control-Allow-Origin": "*"
+        "Access-Control-Allow-Origin": "*", "X-Stream-Wire-Version": str(client_wire_version or config.RUN_STREAM_WIRE_VERSION)
     })
 
 async def generate_and_update_project_name(project_id: str, prompt: str):
@@ -959,6 +958,139 @@ async def generate_and_update_project_name(project_id: str, prompt: str):
         # No need to disconnect DBConnection singleton instance here
         logger.info(f"Finished background naming task for project: {project_id}")
 
+
+async def _create_project_sandbox(client, project_id: str):
+    """Create a sandbox for a project and store its access info on the project."""
+    sandbox_pass = str(uuid.uuid4())
+    sandbox = await create_sandbox(sandbox_pass, project_id)
+    sandbox_id = sandbox.id
+    logger.info(f"Created new sandbox {sandbox_id} for project {project_id}")
+    try:
+        # Get preview links
+        vnc_link, website_link = await asyncio.gather(sandbox.get_preview_link(6080), sandbox.get_preview_link(8080))
+        vnc_url = vnc_link.url if hasattr(vnc_link, 'url') else str(vnc_link).split("url='")[1].split("'")[0]
+        website_url = website_link.url if hasattr(website_link, 'url') else str(website_link).split("url='")[1].split("'")[0]
+        token = None
+        if hasattr(vnc_link, 'token'):
+            token = vnc_link.token
+        elif "token='" in str(vnc_link):
+            token = str(vnc_link).split("token='")[1].split("'")[0]
+
+        # Update project with sandbox info
+        update_result = await client.table('projects').update({
+            'sandbox': {
+                'id': sandbox_id, 'pass': sandbox_pass, 'vnc_preview': vnc_url,
+                'sandbox_url': website_url, 'token': token
+            }
+        }).eq('project_id', project_id).execute()
+        if not update_result.data:
+            raise Exception("Database update failed")
+    except Exception as e:
+        logger.error(f"Failed to update project {project_id} with new sandbox {sandbox_id}: {e}")
+        try: await delete_sandbox(sandbox_id)
+        except Exception as delete_error: logger.error(f"Error deleting sandbox: {str(delete_error)}")
+        raise
+    return sandbox
+
+
+async def _upload_files_to_sandbox(sandbox, uploads: List[tuple]) -> tuple:
+    """Upload (filename, content) pairs to /workspace in parallel and verify them with one listing.
+
+    Returns (uploaded paths, failed filenames).
+    """
+    semaphore = asyncio.Semaphore(max(config.INITIATE_UPLOAD_CONCURRENCY, 1))
+
+    async def upload(safe_filename: str, content: bytes) -> bool:
+        target_path = f"/workspace/{safe_filename}"
+        async with semaphore:
+            try:
+                await sandbox.fs.upload_file(content, target_path)
+                logger.debug(f"Uploaded {safe_filename} to {target_path} in sandbox {sandbox.id}")
+                return True
+            except Exception as upload_error:
+                logger.error(f"Error during sandbox upload call for {safe_filename}: {str(upload_error)}", exc_info=True)
+                return False
+
+    results = await asyncio.gather(*(upload(name, content) for name, content in uploads))
+    uploaded = {name for (name, _), ok in zip(uploads, results) if ok}
+
+    if uploaded:
+        try:
+            files_in_dir = {f.name for f in await sandbox.fs.list_files("/workspace")}
+            missing = uploaded - files_in_dir
+            if missing:
+                logger.error(f"Verification failed for {sorted(missing)}: not found in /workspace after upload")
+            uploaded -= missing
+        except Exception as verify_error:
+            logger.error(f"Error verifying uploads in sandbox {sandbox.id}: {str(verify_error)}", exc_info=True)
+            uploaded = set()
+
+    successful = [f"/workspace/{name}" for name, _ in uploads if name in uploaded]
+    failed = [name for name, _ in uploads if name not in uploaded]
+    return successful, failed
+
+
+async def _provision_workspace_and_dispatch(
+    account_id: str,
+    project_id: str,
+    message_id: str,
+    message_content: str,
+    uploads: List[tuple],
+    run_kwargs: Dict[str, Any],
+):
+    """Create the project's sandbox, upload the attachments and then start the run."""
+    agent_run_id = run_kwargs['agent_run_id']
+    structlog.contextvars.bind_contextvars(agent_run_id=agent_run_id, project_id=project_id)
+    client = await db.client
+    started = time.monotonic()
+    try:
+        sandbox = await _create_project_sandbox(client, project_id)
+        successful_uploads, failed_uploads = await _upload_files_to_sandbox(sandbox, uploads)
+        logger.info(
+            f"Workspace for agent run {agent_run_id} ready in {time.monotonic() - started:.1f}s: "
+            f"{len(successful_uploads)} files uploaded, {len(failed_uploads)} failed"
+        )
+
+        if failed_uploads:
+            for failed_file in failed_uploads:
+                message_content = message_content.replace(f"[Uploaded File: /workspace/{failed_file}]\n", "")
+            message_content += "\n\nThe following files failed to upload:\n"
+            for failed_file in failed_uploads: message_content += f"- {failed_file}\n"
+            await client.table('messages').update({
+                "content": json.dumps({"role": "user", "content": message_content})
+            }).eq('message_id', message_id).execute()
+
+        # The run may have been stopped (or failed as abandoned) while provisioning
+        run = await client.table('agent_runs').select('status').eq('id', agent_run_id).maybe_single().execute()
+        status = run.data.get('status') if run and run.data else None
+        if status != 'running':
+            logger.info(f"Agent run {agent_run_id} is {status} after provisioning, not dispatching it")
+            return
+        await dispatch_agent_run(run_dispatch.INTERACTIVE, account_id, **run_kwargs)
+    except Exception as e:
+        logger.error(f"Failed to prepare workspace for agent run {agent_run_id}: {str(e)}", exc_info=True)
+        await _fail_run(client, agent_run_id, f"Failed to prepare workspace: {str(e)}")
+    finally:
+        await run_limits.provisioning_finished(agent_run_id)
+
+
+async def _fail_run(client, agent_run_id: str, error_message: str) -> None:
+    await update_agent_run_status(client, agent_run_id, "failed", error=error_message)
+    # End any stream already open on the run
+    publisher = run_stream.RunStreamPublisher(agent_run_id)
+    publisher.start()
+    await publisher.publish(encode_event({"type": "status", "status": "failed", "message": error_message}))
+    await publisher.close()
+
+
+async def fail_abandoned_provisioning(agent_run_id: str) -> None:
+    """Fail a run whose API process died while provisioning its workspace, if it is still running."""
+    client = await db.client
+    run = await client.table('agent_runs').select('status').eq('id', agent_run_id).maybe_single().execute()
+    if run and run.data and run.data.get('status') == 'running':
+        await _fail_run(client, agent_run_id, "Workspace preparation was interrupted; please try again")
+
+
 @router.post("/agent/initiate", response_model=InitiateAgentResponse)
 async def initiate_agent_with_files(
     prompt: str = Form(...),
@@ -1019,27 +1151,10 @@ async def initiate_agent_with_files(
         
         agent_data = agent_result.data[0]
         
-        # Use versioning system to get current version
-        version_data = None
-        if agent_data.get('current_version_id'):
-            try:
-                version_service = await _get_version_service()
-                version_obj = await version_service.get_version(
-                    agent_id=agent_id,
-                    version_id=agent_data['current_version_id'],
-                    user_id=user_id
-                )
-                version_data = version_obj.to_dict()
-                logger.info(f"[AGENT INITIATE] Got version data from version manager: {version_data.get('version_name')}")
-                logger.info(f"[AGENT INITIATE] Version data: {version_data}")
-            except Exception as e:
-                logger.warning(f"[AGENT INITIATE] Failed to get version data: {e}")
-        
-        logger.info(f"[AGENT INITIATE] About to call extract_agent_config with version data: {version_data is not None}")
-        
-        agent_config = extract_agent_config(agent_data, version_data)
+        # Current version from the version cache, merged with the agent row
+        agent_config = await version_cache.resolve_agent_config(agent_data)
         
-        if version_data:
+        if agent_config.get('current_version_id'):
             logger.info(f"Using custom agent: {agent_config['name']} ({agent_id}) version {agent_config.get('version_name', 'v1')}")
         else:
             logger.info(f"Using custom agent: {agent_config['name']} ({agent_id}) - no version data")
@@ -1052,26 +1167,10 @@ async def initiate_agent_with_files(
         if default_agent_result.data:
             agent_data = default_agent_result.data[0]
             
-            # Use versioning system to get current version
-            version_data = None
-            if agent_data.get('current_version_id'):
-                try:
-                    version_service = await _get_version_service()
-                    version_obj = await version_service.get_version(
-                        agent_id=agent_data['agent_id'],
-                        version_id=agent_data['current_version_id'],
-                        user_id=user_id
-                    )
-                    version_data = version_obj.to_dict()
-                    logger.info(f"[AGENT INITIATE] Got default agent version from version manager: {version_data.get('version_name')}")
-                except Exception as e:
-                    logger.warning(f"[AGENT INITIATE] Failed to get default agent version data: {e}")
-            
-            logger.info(f"[AGENT INITIATE] About to call extract_agent_config for DEFAULT agent with version data: {version_data is not None}")
-            
-            agent_config = extract_agent_config(agent_data, version_data)
+            # Current version from the version cache, merged with the agent row
+            agent_config = await version_cache.resolve_agent_config(agent_data)
             
-            if version_data:
+            if agent_config.get('current_version_id'):
                 logger.info(f"Using default agent: {agent_config['name']} ({agent_config['agent_id']}) version {agent_config.get('version_name', 'v1')}")
             else:
                 logger.info(f"Using default agent: {agent_config['name']} ({agent_config['agent_id']}) - no version data")
@@ -1082,10 +1181,11 @@ async def initiate_agent_with_files(
     if agent_config:
         logger.info(f"[AGENT INITIATE] Agent config keys: {list(agent_config.keys())}")
 
-    # Run all checks concurrently
+    # Run all checks concurrently; the limit check takes the run's slot under the id it is inserted with
+    agent_run_id = str(uuid.uuid4())
     model_check_task = asyncio.create_task(can_use_model(client, account_id, model_name))
     billing_check_task = asyncio.create_task(check_billing_status(client, account_id))
-    limit_check_task = asyncio.create_task(check_agent_run_limit(client, account_id))
+    limit_check_task = asyncio.create_task(check_agent_run_limit(client, account_id, agent_run_id))
 
     # Wait for all checks to complete
     (can_use, model_message, allowed_models), (can_run, message, subscription), limit_check = await asyncio.gather(
@@ -1093,15 +1193,16 @@ async def initiate_agent_with_files(
     )
 
     # Check results and raise appropriate errors
+    if (not can_use or not can_run) and limit_check['reserved']:
+        await run_limits.release(account_id, agent_run_id)
+
     if not can_use:
         raise HTTPException(status_code=403, detail={"message": model_message, "allowed_models": allowed_models})
 
-    can_run, message, subscription = await check_billing_status(client, account_id)
     if not can_run:
         raise HTTPException(status_code=402, detail={"message": message, "subscription": subscription})
 
     # Check agent run limit (maximum parallel runs in past 24 hours)
-    limit_check = await check_agent_run_limit(client, account_id)
     if not limit_check['can_start']:
         error_detail = {
             "message": f"Maximum of {config.MAX_PARALLEL_AGENT_RUNS} parallel agent runs allowed within 24 hours. You currently have {limit_check['running_count']} running.",
@@ -1122,57 +1223,18 @@ async def initiate_agent_with_files(
         project_id = project.data[0]['project_id']
         logger.info(f"Created new project: {project_id}")
 
-        # 2. Create Sandbox (lazy): only create now if files were uploaded and need the
-        # sandbox immediately. Otherwise leave sandbox creation to `_ensure_sandbox()`
-        # which will create it lazily when tools require it.
-        sandbox_id = None
-        sandbox = None
-        sandbox_pass = None
-        vnc_url = None
-        website_url = None
-        token = None
-
-        if files:
-            # 3. Create Sandbox (lazy): only create now if files were uploaded and need the
-            try:
-                sandbox_pass = str(uuid.uuid4())
-                sandbox = await create_sandbox(sandbox_pass, project_id)
-                sandbox_id = sandbox.id
-                logger.info(f"Created new sandbox {sandbox_id} for project {project_id}")
-
-                # Get preview links
-                vnc_link = await sandbox.get_preview_link(6080)
-                website_link = await sandbox.get_preview_link(8080)
-                vnc_url = vnc_link.url if hasattr(vnc_link, 'url') else str(vnc_link).split("url='")[1].split("'")[0]
-                website_url = website_link.url if hasattr(website_link, 'url') else str(website_link).split("url='")[1].split("'")[0]
-                token = None
-                if hasattr(vnc_link, 'token'):
-                    token = vnc_link.token
-                elif "token='" in str(vnc_link):
-                    token = str(vnc_link).split("token='")[1].split("'")[0]
-
-                # Update project with sandbox info
-                update_result = await client.table('projects').update({
-                    'sandbox': {
-                        'id': sandbox_id, 'pass': sandbox_pass, 'vnc_preview': vnc_url,
-                        'sandbox_url': website_url, 'token': token
-                    }
-                }).eq('project_id', project_id).execute()
-
-                if not update_result.data:
-                    logger.error(f"Failed to update project {project_id} with new sandbox {sandbox_id}")
-                    if sandbox_id:
-                        try: await delete_sandbox(sandbox_id)
-                        except Exception as e: logger.error(f"Error deleting sandbox: {str(e)}")
-                    raise Exception("Database update failed")
-            except Exception as e:
-                logger.error(f"Error creating sandbox: {str(e)}")
-                await client.table('projects').delete().eq('project_id', project_id).execute()
-                if sandbox_id:
-                    try: await delete_sandbox(sandbox_id)
-                    except Exception:
-                        pass
-                raise Exception("Failed to create sandbox")
+        # 2. Read attachments now; the request's upload files are closed once we return.
+        # The sandbox is created and the files uploaded in the background (see
+        # _provision_workspace_and_dispatch); without files the sandbox is created
+        # lazily by `_ensure_sandbox()` when tools need it.
+        uploads = []
+        for file in files:
+            if file.filename:
+                try:
+                    safe_filename = file.filename.replace('/', '_').replace('\\', '_')
+                    uploads.append((safe_filename, await file.read()))
+                finally:
+                    await file.close()
 
         # 3. Create Thread
         thread_data = {
@@ -1214,58 +1276,11 @@ async def initiate_agent_with_files(
         # Trigger Background Naming Task
         asyncio.create_task(generate_and_update_project_name(project_id=project_id, prompt=prompt))
 
-        # 4. Upload Files to Sandbox (if any)
+        # 4. Reference the attachments in the prompt; failed uploads are noted once known
         message_content = prompt
-        if files:
-            successful_uploads = []
-            failed_uploads = []
-            for file in files:
-                if file.filename:
-                    try:
-                        safe_filename = file.filename.replace('/', '_').replace('\\', '_')
-                        target_path = f"/workspace/{safe_filename}"
-                        logger.info(f"Attempting to upload {safe_filename} to {target_path} in sandbox {sandbox_id}")
-                        content = await file.read()
-                        upload_successful = False
-                        try:
-                            if hasattr(sandbox, 'fs') and hasattr(sandbox.fs, 'upload_file'):
-                                await sandbox.fs.upload_file(content, target_path)
-                                logger.debug(f"Called sandbox.fs.upload_file for {target_path}")
-                                upload_successful = True
-                            else:
-                                raise NotImplementedError("Suitable upload method not found on sandbox object.")
-                        except Exception as upload_error:
-                            logger.error(f"Error during sandbox upload call for {safe_filename}: {str(upload_error)}", exc_info=True)
-
-                        if upload_successful:
-                            try:
-                                await asyncio.sleep(0.2)
-                                parent_dir = os.path.dirname(target_path)
-                                files_in_dir = await sandbox.fs.list_files(parent_dir)
-                                file_names_in_dir = [f.name for f in files_in_dir]
-                                if safe_filename in file_names_in_dir:
-                                    successful_uploads.append(target_path)
-                                    logger.info(f"Successfully uploaded and verified file {safe_filename} to sandbox path {target_path}")
-                                else:
-                                    logger.error(f"Verification failed for {safe_filename}: File not found in {parent_dir} after upload attempt.")
-                                    failed_uploads.append(safe_filename)
-                            except Exception as verify_error:
-                                logger.error(f"Error verifying file {safe_filename} after upload: {str(verify_error)}", exc_info=True)
-                                failed_uploads.append(safe_filename)
-                        else:
-                            failed_uploads.append(safe_filename)
-                    except Exception as file_error:
-                        logger.error(f"Error processing file {file.filename}: {str(file_error)}", exc_info=True)
-                        failed_uploads.append(file.filename)
-                    finally:
-                        await file.close()
-
-            if successful_uploads:
-                message_content += "\n\n" if message_content else ""
-                for file_path in successful_uploads: message_content += f"[Uploaded File: {file_path}]\n"
-            if failed_uploads:
-                message_content += "\n\nThe following files failed to upload:\n"
-                for failed_file in failed_uploads: message_content += f"- {failed_file}\n"
+        if uploads:
+            message_content += "\n\n" if message_content else ""
+            for safe_filename, _ in uploads: message_content += f"[Uploaded File: /workspace/{safe_filename}]\n"
 
         # 5. Add initial user message to thread
         message_id = str(uuid.uuid4())
@@ -1286,8 +1301,8 @@ async def initiate_agent_with_files(
         else:
             logger.info(f"Using default model: {effective_model}")
 
-        agent_run = await client.table('agent_runs').insert({
-            "thread_id": thread_id, "status": "running",
+        await client.table('agent_runs').insert({
+            "id": agent_run_id, "thread_id": thread_id, "status": "running",
             "started_at": datetime.now(timezone.utc).isoformat(),
             "agent_id": agent_config.get('agent_id') if agent_config else None,
             "agent_version_id": agent_config.get('current_version_id') if agent_config else None,
@@ -1299,38 +1314,50 @@ async def initiate_agent_with_files(
                 "enable_context_manager": enable_context_manager
             }
         }).execute()
-        agent_run_id = agent_run.data[0]['id']
         logger.info(f"Created new agent run: {agent_run_id}")
+        await run_limits.run_started(account_id, project_id, agent_run_id, thread_id)
         structlog.contextvars.bind_contextvars(
             agent_run_id=agent_run_id,
         )
 
         # Register run in Redis
-        instance_key = f"active_run:{instance_id}:{agent_run_id}"
         try:
-            await redis.set(instance_key, "running", ex=redis.REDIS_KEY_TTL)
+            await run_registry.claim_run(agent_run_id, instance_id)
         except Exception as e:
-            logger.warning(f"Failed to register agent run in Redis ({instance_key}): {str(e)}")
+            logger.warning(f"Failed to register agent run {agent_run_id} in Redis: {str(e)}")
 
         request_id = structlog.contextvars.get_contextvars().get('request_id')
 
-        # Run agent in background
-        run_agent_background.send(
+        run_kwargs = dict(
             agent_run_id=agent_run_id, thread_id=thread_id, instance_id=instance_id,
             project_id=project_id,
             model_name=model_name,  # Already resolved above
             enable_thinking=enable_thinking, reasoning_effort=reasoning_effort,
             stream=stream, enable_context_manager=enable_context_manager,
-            agent_config=agent_config,  # Pass agent configuration
+            agent_config=version_cache.config_ref(agent_config),  # Resolved again by the worker via the version cache
             is_agent_builder=is_agent_builder,
             target_agent_id=target_agent_id,
             request_id=request_id,
         )
 
+        if uploads:
+            # Return now; the run is dispatched once the workspace is ready
+            await run_limits.provisioning_started(agent_run_id)
+            task = asyncio.create_task(_provision_workspace_and_dispatch(
+                account_id, project_id, message_id, message_content, uploads, run_kwargs,
+            ))
+            _workspace_tasks.add(task)
+            task.add_done_callback(_workspace_tasks.discard)
+        else:
+            # Run agent in background
+            await dispatch_agent_run(run_dispatch.INTERACTIVE, account_id, **run_kwargs)
+
         return {"thread_id": thread_id, "agent_run_id": agent_run_id}
 
     except Exception as e:
         logger.error(f"Error in agent initiation: {str(e)}\n{traceback.format_exc()}")
+        if limit_check['reserved']:
+            await run_limits.release(account_id, agent_run_id)
         # TODO: Clean up created project/thread if initiation fails mid-way
         raise HTTPException(status_code=500, detail=f"Failed to initiate agent session: {str(e)}")
 
@@ -1370,23 +1397,27 @@ async def get_agents(
             search_term = f"%{search}%"
             query = query.or_(f"name.ilike.{search_term},description.ilike.{search_term}")
         
-        # Apply filters
+        # Apply filters; tool filters use the agent's denormalized tool index
+        # (see migration agent_tool_index)
         if has_default is not None:
             query = query.eq("is_default", has_default)
-        
-        # For MCP and AgentPress tools filtering, we'll need to do post-processing
-        # since Supabase doesn't have great JSON array/object filtering
+        if has_mcp_tools is not None:
+            query = query.eq("has_mcp_tools", has_mcp_tools)
+        if has_agentpress_tools is not None:
+            query = query.eq("has_agentpress_tools", has_agentpress_tools)
+        tools_filter = [tool.strip() for tool in tools.split(',') if tool.strip()] if tools else []
+        if tools_filter:
+            # Agents having any of the requested tools
+            quoted = ",".join('"' + tool.replace('\\', '\\\\').replace('"', '\\"') + '"' for tool in tools_filter)
+            query = query.filter("tool_names", "ov", f"{{{quoted}}}")
         
         # Apply sorting
-        if sort_by == "name":
-            query = query.order("name", desc=(sort_order == "desc"))
-        elif sort_by == "updated_at":
-            query = query.order("updated_at", desc=(sort_order == "desc"))
-        elif sort_by == "created_at":
-            query = query.order("created_at", desc=(sort_order == "desc"))
+        if sort_by in ("name", "updated_at", "created_at", "tools_count"):
+            query = query.order(sort_by, desc=(sort_order == "desc"))
         else:
             # Default to created_at
             query = query.order("created_at", desc=(sort_order == "desc"))
+        query = query.order("agent_id")
         
         # Get paginated data and total count in one request
         query = query.range(offset, offset + limit - 1)
@@ -1400,15 +1431,14 @@ async def get_agents(
                 "pagination": {
                     "page": page,
                     "limit": limit,
-                    "total": 0,
-                    "pages": 0
+                    "total": total_count,
+                    "pages": (total_count + limit - 1) // limit
                 }
             }
         
-        # Post-process for tool filtering and tools_count sorting
         agents_data = agents_result.data
         
-        # First, fetch version data for all agents to ensure we have correct tool info
+        # Fetch version data for the page's agents to ensure we have correct tool info
         # Do this in a single batched query instead of per-agent service calls
         agent_version_map = {}
         version_ids = list({agent['current_version_id'] for agent in agents_data if agent.get('current_version_id')})
@@ -1420,16 +1450,16 @@ async def get_agents(
 
                 for row in (versions_result.data or []):
                     config = row.get('config') or {}
-                    tools = config.get('tools') or {}
+                    version_tools = config.get('tools') or {}
                     version_dict = {
                         'version_id': row['version_id'],
                         'agent_id': row['agent_id'],
                         'version_number': row['version_number'],
                         'version_name': row['version_name'],
                         'system_prompt': config.get('system_prompt', ''),
-                        'configured_mcps': tools.get('mcp', []),
-                        'custom_mcps': tools.get('custom_mcp', []),
-                        'agentpress_tools': tools.get('agentpress', {}),
+                        'configured_mcps': version_tools.get('mcp', []),
+                        'custom_mcps': version_tools.get('custom_mcp', []),
+                        'agentpress_tools': version_tools.get('agentpress', {}),
                         'is_active': row.get('is_active', False),
                         'created_at': row.get('created_at'),
                         'updated_at': row.get('updated_at') or row.get('created_at'),
@@ -1439,98 +1469,6 @@ async def get_agents(
             except Exception as e:
                 logger.warning(f"Failed to batch load versions for agents: {e}")
         
-        # Apply tool-based filters using version data
-        if has_mcp_tools is not None or has_agentpress_tools is not None or tools:
-            filtered_agents = []
-            tools_filter = []
-            if tools:
-                # Handle case where tools might be passed as dict instead of string
-                if isinstance(tools, str):
-                    tools_filter = [tool.strip() for tool in tools.split(',') if tool.strip()]
-                elif isinstance(tools, dict):
-                    # If tools is a dict, log the issue and skip filtering
-                    logger.warning(f"Received tools parameter as dict instead of string: {tools}")
-                    tools_filter = []
-                elif isinstance(tools, list):
-                    # If tools is a list, use it directly
-                    tools_filter = [str(tool).strip() for tool in tools if str(tool).strip()]
-                else:
-                    logger.warning(f"Unexpected tools parameter type: {type(tools)}, value: {tools}")
-                    tools_filter = []
-            
-            for agent in agents_data:
-                # Get version data if available and extract configuration
-                version_data = agent_version_map.get(agent['agent_id'])
-                from agent.config_helper import extract_agent_config
-                agent_config = extract_agent_config(agent, version_data)
-                
-                configured_mcps = agent_config['configured_mcps']
-                agentpress_tools = agent_config['agentpress_tools']
-                
-                # Check MCP tools filter
-                if has_mcp_tools is not None:
-                    has_mcp = bool(configured_mcps and len(configured_mcps) > 0)
-                    if has_mcp_tools != has_mcp:
-                        continue
-                
-                # Check AgentPress tools filter
-                if has_agentpress_tools is not None:
-                    has_enabled_tools = any(
-                        tool_data and isinstance(tool_data, dict) and tool_data.get('enabled', False)
-                        for tool_data in agentpress_tools.values()
-                    )
-                    if has_agentpress_tools != has_enabled_tools:
-                        continue
-                
-                # Check specific tools filter
-                if tools_filter:
-                    agent_tools = set()
-                    # Add MCP tools
-                    for mcp in configured_mcps:
-                        if isinstance(mcp, dict) and 'name' in mcp:
-                            agent_tools.add(f"mcp:{mcp['name']}")
-                    
-                    # Add enabled AgentPress tools
-                    for tool_name, tool_data in agentpress_tools.items():
-                        if tool_data and isinstance(tool_data, dict) and tool_data.get('enabled', False):
-                            agent_tools.add(f"agentpress:{tool_name}")
-                    
-                    # Check if any of the requested tools are present
-                    if not any(tool in agent_tools for tool in tools_filter):
-                        continue
-                
-                filtered_agents.append(agent)
-            
-            agents_data = filtered_agents
-        
-        # Handle tools_count sorting (post-processing required)
-        if sort_by == "tools_count":
-            def get_tools_count(agent):
-                # Get version data if available
-                version_data = agent_version_map.get(agent['agent_id'])
-                
-                # Use version data for tools if available, otherwise fallback to agent data
-                if version_data:
-                    configured_mcps = version_data.get('configured_mcps', [])
-                    agentpress_tools = version_data.get('agentpress_tools', {})
-                else:
-                    configured_mcps = agent.get('configured_mcps', [])
-                    agentpress_tools = agent.get('agentpress_tools', {})
-                
-                mcp_count = len(configured_mcps)
-                agentpress_count = sum(
-                    1 for tool_data in agentpress_tools.values()
-                    if tool_data and isinstance(tool_data, dict) and tool_data.get('enabled', False)
-                )
-                return mcp_count + agentpress_count
-            
-            agents_data.sort(key=get_tools_count, reverse=(sort_order == "desc"))
-        
-        # Apply pagination to filtered results if we did post-processing
-        if has_mcp_tools is not None or has_agentpress_tools is not None or tools or sort_by == "tools_count":
-            total_count = len(agents_data)
-            agents_data = agents_data[offset:offset + limit]
-        
         # Format the response
         agent_list = []
         for agent in agents_data:
@@ -2946,53 +2884,50 @@ async def get_agent_tools(
     return {"agentpress_tools": agentpress_tools, "mcp_tools": mcp_tools}
 
 
+THREAD_LIST_COLUMNS = "thread_id, account_id, project_id, metadata, is_public, created_at, updated_at"
+PROJECT_LIST_COLUMNS = "project_id, name, description, account_id, sandbox, is_public, created_at, updated_at"
+
 
 @router.get("/threads")
 async def get_user_threads(
     user_id: str = Depends(get_current_user_id_from_jwt),
     page: Optional[int] = Query(1, ge=1, description="Page number (1-based)"),
-    limit: Optional[int] = Query(1000, ge=1, le=1000, description="Number of items per page (max 1000)")
+    limit: Optional[int] = Query(1000, ge=1, le=1000, description="Number of items per page (max 1000)"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page; takes precedence over page")
 ):
-    """Get all threads for the current user with associated project data."""
-    logger.info(f"Fetching threads with project data for user: {user_id} (page={page}, limit={limit})")
+    """Get the current user's threads, newest first, with associated project data.
+
+    Paging happens in the database on (created_at, thread_id). Pass the
+    returned next_cursor back as cursor to get the following page without an
+    offset scan. pagination.total is PostgREST's estimated count, exact for
+    small accounts and a planner estimate for large ones.
+    """
+    logger.info(f"Fetching threads with project data for user: {user_id} (page={page}, limit={limit}, cursor={cursor is not None})")
     client = await db.client
     try:
-        offset = (page - 1) * limit
-        
-        # First, get threads for the user
-        threads_result = await client.table('threads').select('*').eq('account_id', user_id).order('created_at', desc=True).execute()
-        
-        if not threads_result.data:
-            logger.info(f"No threads found for user: {user_id}")
-            return {
-                "threads": [],
-                "pagination": {
-                    "page": page,
-                    "limit": limit,
-                    "total": 0,
-                    "pages": 0
-                }
-            }
-        
-        total_count = len(threads_result.data)
-        
-        # Apply pagination to threads
-        paginated_threads = threads_result.data[offset:offset + limit]
+        query = client.table('threads').select(THREAD_LIST_COLUMNS, count='estimated').eq('account_id', user_id)
+        query = apply_keyset(query, 'created_at', 'thread_id', decode_cursor(cursor), newer=False)
+        if cursor:
+            query = query.limit(limit + 1)
+        else:
+            offset = (page - 1) * limit
+            query = query.range(offset, offset + limit)  # one extra row tells if there is more
+        threads_result = await query.execute()
+
+        threads = threads_result.data or []
+        has_more = len(threads) > limit
+        threads = threads[:limit]
+        total_count = threads_result.count or 0
         
         # Extract unique project IDs from threads that have them
-        project_ids = [
-            thread['project_id'] for thread in paginated_threads 
-            if thread.get('project_id')
-        ]
-        unique_project_ids = list(set(project_ids)) if project_ids else []
+        unique_project_ids = list({thread['project_id'] for thread in threads if thread.get('project_id')})
         
         # Fetch projects if we have project IDs
         projects_by_id = {}
         if unique_project_ids:
-            projects_result = await client.table('projects').select('*').in_('project_id', unique_project_ids).execute()
+            projects_result = await client.table('projects').select(PROJECT_LIST_COLUMNS).in_('project_id', unique_project_ids).execute()
             
             if projects_result.data:
-                logger.info(f"[API] Raw projects from DB: {len(projects_result.data)}")
                 # Create a lookup map of projects by ID
                 projects_by_id = {
                     project['project_id']: project 
@@ -3001,7 +2936,7 @@ async def get_user_threads(
         
         # Map threads with their associated projects
         mapped_threads = []
-        for thread in paginated_threads:
+        for thread in threads:
             project_data = None
             if thread.get('project_id') and thread['project_id'] in projects_by_id:
                 project = projects_by_id[thread['project_id']]
@@ -3039,9 +2974,13 @@ async def get_user_threads(
                 "limit": limit,
                 "total": total_count,
                 "pages": total_pages
-            }
+            },
+            "next_cursor": encode_cursor(threads[-1], 'created_at', 'thread_id') if has_more else None,
+            "has_more": has_more
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching threads for user {user_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch threads: {str(e)}")
@@ -3060,13 +2999,11 @@ async def get_thread(
         await verify_thread_access(client, thread_id, user_id)
         
         # Get the thread data
-        thread_result = await client.table('threads').select('*').eq('thread_id', thread_id).execute()
+        thread = await access_cache.get_thread(client, thread_id)
         
-        if not thread_result.data:
+        if not thread:
             raise HTTPException(status_code=404, detail="Thread not found")
         
-        thread = thread_result.data[0]
-        
         # Get associated project if thread has a project_id
         project_data = None
         if thread.get('project_id'):
@@ -3232,32 +3169,87 @@ async def create_thread(
         raise HTTPException(status_code=500, detail=f"Failed to create thread: {str(e)}")
 
 
+MESSAGE_LIST_COLUMNS = "message_id, thread_id, type, is_llm_message, content, created_at, updated_at, agent_id, agent_version_id"
+
+
 @router.get("/threads/{thread_id}/messages")
 async def get_thread_messages(
     thread_id: str,
     user_id: str = Depends(get_current_user_id_from_jwt),
-    order: str = Query("desc", description="Order by created_at: 'asc' or 'desc'")
+    order: str = Query("desc", description="Order by created_at: 'asc' or 'desc'"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size; omit to get every message"),
+    before: Optional[str] = Query(None, description="Cursor: only messages older than it"),
+    after: Optional[str] = Query(None, description="Cursor: only messages newer than it"),
+    since: Optional[str] = Query(None, description="Cursor: every message newer than it, oldest first, for live refresh"),
+    include_metadata: Optional[bool] = Query(None, description="Include message metadata; defaults to true only when fetching every message"),
 ):
-    """Get all messages for a thread, fetching in batches of 1000 from the DB to avoid large queries."""
-    logger.info(f"Fetching all messages for thread: {thread_id}, order={order}")
+    """Get the messages of a thread, keyset-paginated on (created_at, message_id).
+
+    Without limit or cursors every message is returned, as before. With limit,
+    a page in the requested order is returned together with next_cursor, which
+    passed back as before (order=desc) or after (order=asc) continues the
+    listing, and latest_cursor, the cursor of the thread's newest message, to
+    switch to polling with since.
+
+    since returns everything newer than a cursor, oldest first, plus the cursor
+    of the newest message, to poll a live thread incrementally. Because
+    messages are keyed by insert time rather than commit time, it also returns
+    the messages of the THREAD_MESSAGES_SINCE_OVERLAP_SECONDS before the
+    cursor; clients merge them by message_id.
+    """
+    logger.info(f"Fetching messages for thread: {thread_id}, order={order}, limit={limit}")
+    if sum(cursor is not None for cursor in (before, after, since)) > 1:
+        raise HTTPException(status_code=400, detail="Use only one of before, after and since")
     client = await db.client
     await verify_thread_access(client, thread_id, user_id)
+
+    paged = limit is not None or any((before, after, since))
+    columns = MESSAGE_LIST_COLUMNS
+    if include_metadata if include_metadata is not None else not paged:
+        columns += ", metadata"
+
+    async def fetch(cursor, newer: bool, page_size: int):
+        query = client.table('messages').select(columns).eq('thread_id', thread_id)
+        query = apply_keyset(query, 'created_at', 'message_id', cursor, newer=newer)
+        return (await query.limit(page_size).execute()).data or []
+
     try:
-        batch_size = 1000
-        offset = 0
-        all_messages = []
-        while True:
-            query = client.table('messages').select('*').eq('thread_id', thread_id)
-            query = query.order('created_at', desc=(order == "desc"))
-            query = query.range(offset, offset + batch_size - 1)
-            messages_result = await query.execute()
-            batch = messages_result.data or []
-            all_messages.extend(batch)
-            logger.debug(f"Fetched batch of {len(batch)} messages (offset {offset})")
-            if len(batch) < batch_size:
-                break
-            offset += batch_size
-        return {"messages": all_messages}
+        if since is not None or limit is None:
+            # Walk the whole range in keyset batches of 1000
+            newer = since is not None or order != "desc"
+            cursor = decode_cursor(since)
+            if cursor is not None:
+                cursor = rewind_cursor(cursor, config.THREAD_MESSAGES_SINCE_OVERLAP_SECONDS)
+            messages = []
+            while True:
+                batch = await fetch(cursor, newer, 1000)
+                messages.extend(batch)
+                logger.debug(f"Fetched batch of {len(batch)} messages")
+                if len(batch) < 1000:
+                    break
+                cursor = (batch[-1]['created_at'], batch[-1]['message_id'])
+            if since is None:
+                return {"messages": messages}
+            newest = encode_cursor(messages[-1], 'created_at', 'message_id') if messages else since
+            return {"messages": messages, "cursor": newest}
+
+        # One page, fetched walking away from the cursor; one extra row tells if there is more
+        newer = after is not None or (before is None and order == "asc")
+        page = await fetch(decode_cursor(after or before), newer, limit + 1)
+        has_more = len(page) > limit
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1], 'created_at', 'message_id') if has_more else None
+        if newer == (order == "desc"):
+            page.reverse()
+        if order == "desc" and before is None and after is None:
+            # The first page of a newest-first listing starts at the newest message
+            latest = page[:1]
+        else:
+            latest = await fetch(None, False, 1)
+        latest_cursor = encode_cursor(latest[0], 'created_at', 'message_id') if latest else None
+        return {"messages": page, "next_cursor": next_cursor, "has_more": has_more, "latest_cursor": latest_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching messages for thread {thread_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch messages: {str(e)}")
@@ -22,12 +22,14 @@ from agent.tools.expand_msg_tool import ExpandMessageTool
 from agent.prompt import get_system_prompt
 from agent.custom_prompt import render_prompt_template
 from utils.logger import logger
+from utils.model_registry import get_model_capabilities
 from utils.auth_utils import get_account_id_from_thread
+from utils.json_helpers import ensure_dict
 from services.billing import check_billing_status
 from agent.tools.sb_vision_tool import SandboxVisionTool
 from agent.tools.sb_image_edit_tool import SandboxImageEditTool
-from services.langfuse import langfuse
-from langfuse.client import StatefulTraceClient
+from services.tracing import tracer, TraceHandle
+from services.run_checkpoint import RunCheckpointer
 from agent.gemini_prompt import get_gemini_system_prompt
 from agent.tools.mcp_tool_wrapper import MCPToolWrapper
 from agent.tools.task_list_tool import TaskListTool
@@ -49,9 +51,11 @@ class AgentConfig:
     reasoning_effort: Optional[str] = 'low'
     enable_context_manager: bool = True
     agent_config: Optional[dict] = None
-    trace: Optional[StatefulTraceClient] = None
+    trace: Optional[TraceHandle] = None
     is_agent_builder: Optional[bool] = False
     target_agent_id: Optional[str] = None
+    checkpointer: Optional[RunCheckpointer] = None
+    resume_state: Optional[dict] = None
 
 
 class ToolManager:
@@ -305,7 +309,7 @@ class PromptManager:
 
 
 class MessageManager:
-    def __init__(self, client, thread_id: str, model_name: str, trace: Optional[StatefulTraceClient]):
+    def __init__(self, client, thread_id: str, model_name: str, trace: Optional[TraceHandle]):
         self.client = client
         self.thread_id = thread_id
         self.model_name = model_name
@@ -385,10 +389,12 @@ class MessageManager:
 class AgentRunner:
     def __init__(self, config: AgentConfig):
         self.config = config
+        self._owns_trace = False
     
     async def setup(self):
         if not self.config.trace:
-            self.config.trace = langfuse.trace(name="run_agent", session_id=self.config.thread_id, metadata={"project_id": self.config.project_id})
+            self._owns_trace = True
+            self.config.trace = tracer.trace(name="run_agent", session_id=self.config.thread_id, metadata={"project_id": self.config.project_id})
         
         self.thread_manager = ThreadManager(
             trace=self.config.trace, 
@@ -451,15 +457,7 @@ class AgentRunner:
         return await mcp_manager.register_mcp_tools(self.config.agent_config)
     
     def get_max_tokens(self) -> Optional[int]:
-        if "sonnet" in self.config.model_name.lower():
-            return 8192
-        elif "gpt-4" in self.config.model_name.lower():
-            return 4096
-        elif "gemini-2.5-pro" in self.config.model_name.lower():
-            return 64000
-        elif "kimi-k2" in self.config.model_name.lower():
-            return 8192
-        return None
+        return get_model_capabilities(self.config.model_name).default_max_tokens
     
     async def run(self) -> AsyncGenerator[Dict[str, Any], None]:
         await self.setup()
@@ -475,6 +473,20 @@ class AgentRunner:
         iteration_count = 0
         continue_execution = True
 
+        resume_state = self.config.resume_state
+        if resume_state:
+            # Re-enter the interrupted iteration; its completed steps are already in the thread
+            iteration_count = max(resume_state.get('iteration', 1) - 1, 0)
+            if resume_state.get('pending_tools'):
+                # Give the interrupted step's tool calls their results before calling the LLM again
+                saved = await self.thread_manager.response_processor.resolve_interrupted_tools(
+                    self.config.thread_id, resume_state['pending_tools'], "user_message"
+                )
+                logger.info(f"Saved {saved} tool results of the interrupted step for thread {self.config.thread_id}")
+                resume_state['pending_tools'] = None
+                if self.config.checkpointer:
+                    await self.config.checkpointer.save(pending_tools=None)
+
         latest_user_message = await self.client.table('messages').select('*').eq('thread_id', self.config.thread_id).eq('type', 'user').order('created_at', desc=True).limit(1).execute()
         if latest_user_message.data and len(latest_user_message.data) > 0:
             data = latest_user_message.data[0]['content']
@@ -498,6 +510,15 @@ class AgentRunner:
                 }
                 break
 
+            if self.config.checkpointer and not resume_state:
+                await self.config.checkpointer.save(
+                    iteration=iteration_count,
+                    auto_continue_count=0,
+                    continuous_state=None,
+                    llm_model=None,
+                    last_message_id=self.thread_manager.last_message_id,
+                )
+
             latest_message = await self.client.table('messages').select('*').eq('thread_id', self.config.thread_id).in_('type', ['assistant', 'tool', 'user']).order('created_at', desc=True).limit(1).execute()
             if latest_message.data and len(latest_message.data) > 0:
                 message_type = latest_message.data[0].get('type')
@@ -533,8 +554,11 @@ class AgentRunner:
                     enable_thinking=self.config.enable_thinking,
                     reasoning_effort=self.config.reasoning_effort,
                     enable_context_manager=self.config.enable_context_manager,
-                    generation=generation
+                    generation=generation,
+                    checkpointer=self.config.checkpointer,
+                    resume_state=resume_state,
                 )
+                resume_state = None
 
                 if isinstance(response, dict) and "status" in response and response["status"] == "error":
                     yield response
@@ -554,51 +578,26 @@ class AgentRunner:
                                 continue
                             
                             if chunk.get('type') == 'status':
-                                try:
-                                    metadata = chunk.get('metadata', {})
-                                    if isinstance(metadata, str):
-                                        metadata = json.loads(metadata)
-                                    
-                                    if metadata.get('agent_should_terminate'):
-                                        agent_should_terminate = True
-                                        
-                                        content = chunk.get('content', {})
-                                        if isinstance(content, str):
-                                            content = json.loads(content)
-                                        
-                                        if content.get('function_name'):
-                                            last_tool_call = content['function_name']
-                                        elif content.get('xml_tag_name'):
-                                            last_tool_call = content['xml_tag_name']
-                                            
-                                except Exception:
-                                    pass
-                            
+                                metadata = ensure_dict(chunk.get('metadata'))
+                                if metadata.get('agent_should_terminate'):
+                                    agent_should_terminate = True
+
+                                    content = ensure_dict(chunk.get('content'))
+                                    if content.get('function_name'):
+                                        last_tool_call = content['function_name']
+                                    elif content.get('xml_tag_name'):
+                                        last_tool_call = content['xml_tag_name']
+
                             if chunk.get('type') == 'assistant' and 'content' in chunk:
-                                try:
-                                    content = chunk.get('content', '{}')
-                                    if isinstance(content, str):
-                                        assistant_content_json = json.loads(content)
-                                    else:
-                                        assistant_content_json = content
-
-                                    assistant_text = assistant_content_json.get('content', '')
+                                assistant_text = ensure_dict(chunk.get('content')).get('content', '')
+                                if isinstance(assistant_text, str):
                                     full_response += assistant_text
-                                    if isinstance(assistant_text, str):
-                                        if '</ask>' in assistant_text or '</complete>' in assistant_text or '</web-browser-takeover>' in assistant_text:
-                                           if '</ask>' in assistant_text:
-                                               xml_tool = 'ask'
-                                           elif '</complete>' in assistant_text:
-                                               xml_tool = 'complete'
-                                           elif '</web-browser-takeover>' in assistant_text:
-                                               xml_tool = 'web-browser-takeover'
-
-                                           last_tool_call = xml_tool
-                                
-                                except json.JSONDecodeError:
-                                    pass
-                                except Exception:
-                                    pass
+                                    if '</ask>' in assistant_text:
+                                        last_tool_call = 'ask'
+                                    elif '</complete>' in assistant_text:
+                                        last_tool_call = 'complete'
+                                    elif '</web-browser-takeover>' in assistant_text:
+                                        last_tool_call = 'web-browser-takeover'
 
                             yield chunk
                     else:
@@ -637,7 +636,8 @@ class AgentRunner:
             if generation:
                 generation.end(output=full_response)
 
-        asyncio.create_task(asyncio.to_thread(lambda: langfuse.flush()))
+        if self._owns_trace:
+            self.config.trace.finish()
 
 
 async def run_agent(
@@ -652,9 +652,11 @@ async def run_agent(
     reasoning_effort: Optional[str] = 'low',
     enable_context_manager: bool = True,
     agent_config: Optional[dict] = None,    
-    trace: Optional[StatefulTraceClient] = None,
+    trace: Optional[TraceHandle] = None,
     is_agent_builder: Optional[bool] = False,
-    target_agent_id: Optional[str] = None
+    target_agent_id: Optional[str] = None,
+    checkpointer: Optional[RunCheckpointer] = None,
+    resume_state: Optional[dict] = None,
 ):
     effective_model = model_name
     if model_name == "anthropic/claude-sonnet-4-20250514" and agent_config and agent_config.get('model'):
@@ -678,7 +680,9 @@ async def run_agent(
         agent_config=agent_config,
         trace=trace,
         is_agent_builder=is_agent_builder,
-        target_agent_id=target_agent_id
+        target_agent_id=target_agent_id,
+        checkpointer=checkpointer,
+        resume_state=resume_state,
     )
     
     runner = AgentRunner(config)
@@ -139,12 +139,25 @@ class SunaAgentRepository:
                 'current_version_id': version_id
             }).eq('agent_id', agent_id).execute()
             
+            from agent.versioning.version_cache import invalidate_current_version
+            await invalidate_current_version(agent_id)
             return bool(result.data)
             
         except Exception as e:
             logger.error(f"Failed to update version pointer for agent {agent_id}: {e}")
             raise
     
+    async def sync_default_tool_index(self, agentpress_tools: Dict[str, Any]) -> int:
+        """Store the default AgentPress tools used for the Suna agents' tool index; returns agents reindexed."""
+        try:
+            client = await self.db.client
+            result = await client.rpc('set_suna_default_tools', {'p_agentpress': agentpress_tools}).execute()
+            return result.data or 0
+            
+        except Exception as e:
+            logger.error(f"Failed to sync Suna default tool index: {e}")
+            raise
+    
     async def get_agent_stats(self) -> Dict[str, Any]:
         try:
             client = await self.db.client
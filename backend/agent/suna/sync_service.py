@@ -3,6 +3,7 @@ from dataclasses import dataclass
 from datetime import datetime, timezone
 from utils.logger import logger
 
+from .config import SunaConfig
 from .config_manager import SunaConfigManager, SunaConfiguration
 from .repository import SunaAgentRepository, SunaAgentRecord
 
@@ -36,6 +37,12 @@ class SunaSyncService:
                 current_config.version_tag
             )
             
+            if not dry_run:
+                # Suna agents run with SunaConfig.DEFAULT_TOOLS, not their stored tools
+                reindexed = await self.repository.sync_default_tool_index(SunaConfig.DEFAULT_TOOLS)
+                if reindexed:
+                    logger.info(f"🔧 Reindexed tools of {reindexed} Suna agents")
+            
             if not agents_needing_sync:
                 logger.info("📋 All Suna agents already have current metadata")
                 return SyncResult(
@@ -4,6 +4,7 @@ import time
 import asyncio
 from uuid import uuid4
 from agentpress.tool import ToolResult, openapi_schema, usage_example
+from agentpress.cancellation import current_scope
 from sandbox.tool_base import SandboxToolsBase
 from agentpress.thread_manager import ThreadManager
 
@@ -149,6 +150,10 @@ class SandboxShellTool(SandboxToolsBase):
                 
                 # Send the command with completion marker
                 await self._execute_raw_command(f'tmux send-keys -t {session_name} "cd {cwd} && {wrapped_completion_command}" Enter')
+
+                # Kill the command if the agent run is stopped while we wait for it
+                scope = current_scope()
+                unregister_cleanup = scope.on_cancel(lambda: self._execute_raw_command(f"tmux kill-session -t {session_name}")) if scope else None
                 
                 start_time = time.time()
                 final_output = ""
@@ -177,6 +182,8 @@ class SandboxShellTool(SandboxToolsBase):
                 
                 # Kill the session after capture
                 await self._execute_raw_command(f"tmux kill-session -t {session_name}")
+                if unregister_cleanup:
+                    unregister_cleanup()
                 
                 return self.success_response({
                     "output": final_output,
@@ -1,10 +1,9 @@
-import json
 from typing import Optional, List, Dict, Any
 from datetime import datetime, timezone, timedelta
 from utils.cache import Cache
 from utils.logger import logger
 from utils.config import config
-from services import redis
+from services import redis, run_registry, run_limits
 from run_agent_background import update_agent_run_status
 
 
@@ -18,14 +17,12 @@ async def _cleanup_redis_response_list(agent_run_id: str):
 
 
 async def check_for_active_project_agent_run(client, project_id: str):
-    project_threads = await client.table('threads').select('thread_id').eq('project_id', project_id).execute()
-    project_thread_ids = [t['thread_id'] for t in project_threads.data]
-
-    if project_thread_ids:
-        active_runs = await client.table('agent_runs').select('id').in_('thread_id', project_thread_ids).eq('status', 'running').execute()
-        if active_runs.data and len(active_runs.data) > 0:
-            return active_runs.data[0]['id']
-    return None
+    try:
+        return await run_limits.project_running_run(project_id)
+    except Exception as e:
+        logger.warning(f"Run limit counters unavailable for project {project_id}, checking the database: {e}")
+    active_runs = await run_limits.running_runs_from_db(client, project_id=project_id)
+    return active_runs[0]['id'] if active_runs else None
 
 
 async def stop_agent_run(db, agent_run_id: str, error_message: Optional[str] = None):
@@ -33,17 +30,8 @@ async def stop_agent_run(db, agent_run_id: str, error_message: Optional[str] = N
     client = await db.client
     final_status = "failed" if error_message else "stopped"
 
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    all_responses = []
-    try:
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
-        all_responses = [json.loads(r) for r in all_responses_json]
-        logger.info(f"Fetched {len(all_responses)} responses from Redis for DB update on stop/fail: {agent_run_id}")
-    except Exception as e:
-        logger.error(f"Failed to fetch responses from Redis for {agent_run_id} during stop/fail: {e}")
-
     update_success = await update_agent_run_status(
-        client, agent_run_id, final_status, error=error_message, responses=all_responses
+        client, agent_run_id, final_status, error=error_message
     )
 
     if not update_success:
@@ -57,21 +45,16 @@ async def stop_agent_run(db, agent_run_id: str, error_message: Optional[str] = N
         logger.error(f"Failed to publish STOP signal to global channel {global_control_channel}: {str(e)}")
 
     try:
-        instance_keys = await redis.keys(f"active_run:*:{agent_run_id}")
-        logger.debug(f"Found {len(instance_keys)} active instance keys for agent run {agent_run_id}")
-
-        for key in instance_keys:
-            parts = key.split(":")
-            if len(parts) == 3:
-                instance_id_from_key = parts[1]
-                instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id_from_key}"
-                try:
-                    await redis.publish(instance_control_channel, "STOP")
-                    logger.debug(f"Published STOP signal to instance channel {instance_control_channel}")
-                except Exception as e:
-                    logger.warning(f"Failed to publish STOP signal to instance channel {instance_control_channel}: {str(e)}")
-            else:
-                logger.warning(f"Unexpected key format found: {key}")
+        run_instance_ids = await run_registry.instances_for_run(agent_run_id)
+        logger.debug(f"Found {len(run_instance_ids)} active instances for agent run {agent_run_id}")
+
+        for instance_id_from_registry in run_instance_ids:
+            instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id_from_registry}"
+            try:
+                await redis.publish(instance_control_channel, "STOP")
+                logger.debug(f"Published STOP signal to instance channel {instance_control_channel}")
+            except Exception as e:
+                logger.warning(f"Failed to publish STOP signal to instance channel {instance_control_channel}: {str(e)}")
 
         await _cleanup_redis_response_list(agent_run_id)
 
@@ -81,54 +64,42 @@ async def stop_agent_run(db, agent_run_id: str, error_message: Optional[str] = N
     logger.info(f"Successfully initiated stop process for agent run: {agent_run_id}")
 
 
-async def check_agent_run_limit(client, account_id: str) -> Dict[str, Any]:
+async def check_agent_run_limit(client, account_id: str, agent_run_id: Optional[str] = None, thread_id: Optional[str] = None) -> Dict[str, Any]:
     """
     Check if the account has reached the limit of 3 parallel agent runs within the past 24 hours.
+
+    Counts come from the Redis counters in services/run_limits.py in one round
+    trip; if Redis is unavailable they are counted in the database instead.
+    With agent_run_id, a run that can start also takes its slot in the same
+    round trip, so concurrent starts cannot exceed the limit; the run must be
+    inserted with that id, or the slot given back with run_limits.release.
     
     Returns:
-        Dict with 'can_start' (bool), 'running_count' (int), 'running_thread_ids' (list)
+        Dict with 'can_start' (bool), 'running_count' (int), 'running_thread_ids' (list), 'reserved' (bool)
     """
     try:
-        result = await Cache.get(f"agent_run_limit:{account_id}")
-        if result:
-            return result
+        reserved = False
+        try:
+            if agent_run_id:
+                reserved, running_thread_ids = await run_limits.reserve(
+                    account_id, agent_run_id, thread_id, config.MAX_PARALLEL_AGENT_RUNS
+                )
+            else:
+                running_thread_ids = await run_limits.running_thread_ids(account_id)
+        except Exception as e:
+            logger.warning(f"Run limit counters unavailable for account {account_id}, counting in the database: {e}")
+            running_runs = await run_limits.running_runs_from_db(client, account_id=account_id)
+            running_thread_ids = [run['thread_id'] for run in running_runs]
 
-        # Calculate 24 hours ago
-        twenty_four_hours_ago = datetime.now(timezone.utc) - timedelta(hours=24)
-        twenty_four_hours_ago_iso = twenty_four_hours_ago.isoformat()
-        
-        logger.debug(f"Checking agent run limit for account {account_id} since {twenty_four_hours_ago_iso}")
-        
-        # Get all threads for this account
-        threads_result = await client.table('threads').select('thread_id').eq('account_id', account_id).execute()
-        
-        if not threads_result.data:
-            logger.debug(f"No threads found for account {account_id}")
-            return {
-                'can_start': True,
-                'running_count': 0,
-                'running_thread_ids': []
-            }
-        
-        thread_ids = [thread['thread_id'] for thread in threads_result.data]
-        logger.debug(f"Found {len(thread_ids)} threads for account {account_id}")
-        
-        # Query for running agent runs within the past 24 hours for these threads
-        running_runs_result = await client.table('agent_runs').select('id', 'thread_id', 'started_at').in_('thread_id', thread_ids).eq('status', 'running').gte('started_at', twenty_four_hours_ago_iso).execute()
-        
-        running_runs = running_runs_result.data or []
-        running_count = len(running_runs)
-        running_thread_ids = [run['thread_id'] for run in running_runs]
-        
-        logger.info(f"Account {account_id} has {running_count} running agent runs in the past 24 hours")
-        
-        result = {
-            'can_start': running_count < config.MAX_PARALLEL_AGENT_RUNS,
+        running_count = len(running_thread_ids)
+        logger.debug(f"Account {account_id} has {running_count} running agent runs in the past 24 hours")
+
+        return {
+            'can_start': reserved or running_count < config.MAX_PARALLEL_AGENT_RUNS,
             'running_count': running_count,
-            'running_thread_ids': running_thread_ids
+            'running_thread_ids': running_thread_ids,
+            'reserved': reserved,
         }
-        await Cache.set(f"agent_run_limit:{account_id}", result)
-        return result
 
     except Exception as e:
         logger.error(f"Error checking agent run limit for account {account_id}: {str(e)}")
@@ -136,7 +107,8 @@ async def check_agent_run_limit(client, account_id: str) -> Dict[str, Any]:
         return {
             'can_start': True,
             'running_count': 0,
-            'running_thread_ids': []
+            'running_thread_ids': [],
+            'reserved': False,
         }
 
 
@@ -0,0 +1,168 @@
+"""
+Cache of agent versions and of each agent's current version.
+
+Agent versions are immutable once created, so a version row (system prompt,
+model, AgentPress tools, MCP definitions) is cached under its version_id for
+AGENT_VERSION_CACHE_TTL_SECONDS, in Redis and in a small per-process LRU.
+Resolving an agent's run configuration then only needs the agent row, which
+callers already have, merged with the cached version by extract_agent_config.
+
+Which version is current is mutable and cached separately under the agent id
+for AGENT_VERSION_POINTER_TTL_SECONDS; it is invalidated whenever the pointer
+moves (version creation, activation, rollback).
+
+Runs are dispatched to the worker with a reference to the resolved version
+(config_ref) instead of the full configuration; the worker resolves it again
+through the same cache (load_agent_config).
+
+Usage:
+    from agent.versioning import version_cache
+
+    agent_config = await version_cache.resolve_agent_config(agent_row)
+    version = await version_cache.get_version(version_id, agent_id)
+    version_id = await version_cache.get_current_version_id(agent_id)
+    await version_cache.invalidate_current_version(agent_id)
+"""
+
+import json
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from agent.config_helper import extract_agent_config
+from agent.versioning.version_service import AgentVersion, get_version_service
+from services import redis
+from services.supabase import DBConnection
+from utils.config import config
+from utils.logger import logger
+
+_LOCAL_MAX_VERSIONS = 512
+_local_versions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+
+def _version_key(version_id: str) -> str:
+    return f"agent_version:{version_id}"
+
+
+def _pointer_key(agent_id: str) -> str:
+    return f"agent_current_version:{agent_id}"
+
+
+def _remember(version_id: str, row: Dict[str, Any]) -> None:
+    _local_versions[version_id] = row
+    _local_versions.move_to_end(version_id)
+    while len(_local_versions) > _LOCAL_MAX_VERSIONS:
+        _local_versions.popitem(last=False)
+
+
+async def _load_version_row(version_id: str) -> Optional[Dict[str, Any]]:
+    row = _local_versions.get(version_id)
+    if row is not None:
+        _local_versions.move_to_end(version_id)
+        return row
+
+    try:
+        cached = await redis.get(_version_key(version_id))
+        if cached:
+            row = json.loads(cached)
+            _remember(version_id, row)
+            return row
+    except Exception as e:
+        logger.warning(f"Failed to read cached agent version {version_id}: {e}")
+
+    client = await DBConnection().client
+    result = await client.table('agent_versions').select('*').eq('version_id', version_id).execute()
+    if not result.data:
+        return None
+    row = result.data[0]
+    _remember(version_id, row)
+    try:
+        await redis.set(_version_key(version_id), json.dumps(row), ex=config.AGENT_VERSION_CACHE_TTL_SECONDS)
+    except Exception as e:
+        logger.warning(f"Failed to cache agent version {version_id}: {e}")
+    return row
+
+
+async def get_version(version_id: str, agent_id: Optional[str] = None) -> Optional[AgentVersion]:
+    """
+    Version version_id, optionally only if it belongs to agent_id.
+
+    No access check: callers must already have checked access to the agent.
+    """
+    row = await _load_version_row(version_id)
+    if not row or (agent_id and row['agent_id'] != agent_id):
+        return None
+    version_service = await get_version_service()
+    return version_service._version_from_db_row(row)
+
+
+async def get_current_version_id(agent_id: str) -> Optional[str]:
+    """The agent's current version id, cached for a short time."""
+    try:
+        cached = await redis.get(_pointer_key(agent_id))
+        if cached:
+            return cached
+    except Exception as e:
+        logger.warning(f"Failed to read current version pointer of agent {agent_id}: {e}")
+
+    client = await DBConnection().client
+    result = await client.table('agents').select('current_version_id').eq('agent_id', agent_id).execute()
+    version_id = result.data[0].get('current_version_id') if result.data else None
+    if version_id:
+        try:
+            await redis.set(_pointer_key(agent_id), version_id, ex=config.AGENT_VERSION_POINTER_TTL_SECONDS)
+        except Exception as e:
+            logger.warning(f"Failed to cache current version pointer of agent {agent_id}: {e}")
+    return version_id
+
+
+async def invalidate_current_version(agent_id: str) -> None:
+    try:
+        await redis.delete(_pointer_key(agent_id))
+    except Exception as e:
+        logger.warning(f"Failed to invalidate current version pointer of agent {agent_id}: {e}")
+
+
+async def resolve_agent_config(agent_data: Dict[str, Any], version_id: Optional[str] = None) -> Dict[str, Any]:
+    """Run configuration of an agent row at version_id (default: its current version)."""
+    version_id = version_id or agent_data.get('current_version_id')
+    version_data = None
+    if version_id:
+        try:
+            version = await get_version(version_id, agent_data['agent_id'])
+            if version:
+                version_data = version.to_dict()
+            else:
+                logger.warning(f"Version {version_id} of agent {agent_data['agent_id']} not found")
+        except Exception as e:
+            logger.warning(f"Failed to get version data for agent {agent_data['agent_id']}: {e}")
+    return extract_agent_config(agent_data, version_data)
+
+
+def config_ref(agent_config: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Compact stand-in for a resolved configuration to send to the worker.
+
+    Only configurations resolved from a version are replaced; anything else is
+    returned as is.
+    """
+    if not agent_config or not agent_config.get('current_version_id') or not agent_config.get('agent_id'):
+        return agent_config
+    return {
+        '$ref': 'agent_version',
+        'agent_id': agent_config['agent_id'],
+        'version_id': agent_config['current_version_id'],
+    }
+
+
+async def load_agent_config(agent_config: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Resolve a config_ref back to the full configuration; full configurations pass through."""
+    if not agent_config or agent_config.get('$ref') != 'agent_version':
+        return agent_config
+    client = await DBConnection().client
+    result = await client.table('agents').select('*').eq('agent_id', agent_config['agent_id']).execute()
+    if not result.data:
+        raise ValueError(f"Agent {agent_config['agent_id']} not found")
+    resolved = await resolve_agent_config(result.data[0], agent_config['version_id'])
+    # The run uses the version the API resolved, even if another was activated since
+    resolved['current_version_id'] = agent_config['version_id']
+    return resolved
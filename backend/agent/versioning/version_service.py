@@ -7,6 +7,7 @@ from enum import Enum
 
 from services.supabase import DBConnection
 from utils.logger import logger
+from utils import access_cache
 
 
 class VersionStatus(Enum):
@@ -84,19 +85,10 @@ class VersionService:
         if user_id == "system":
             return True, True
             
-        client = await self._get_client()
-        
-        owner_result = await client.table('agents').select('account_id').eq(
-            'agent_id', agent_id
-        ).eq('account_id', user_id).execute()
-        
-        is_owner = bool(owner_result.data)
+        agent_data = await access_cache.get_agent(await self._get_client(), agent_id)
         
-        public_result = await client.table('agents').select('is_public').eq(
-            'agent_id', agent_id
-        ).execute()
-        
-        is_public = bool(public_result.data and public_result.data[0].get('is_public', False))
+        is_owner = bool(agent_data and agent_data.get('account_id') == user_id)
+        is_public = bool(agent_data and agent_data.get('is_public', False))
         
         return is_owner, is_public
     
@@ -137,6 +129,9 @@ class VersionService:
         
         if not result.data:
             raise Exception("Failed to update agent current version")
+
+        from agent.versioning.version_cache import invalidate_current_version
+        await invalidate_current_version(agent_id)
     
     def _version_from_db_row(self, row: Dict[str, Any]) -> AgentVersion:
         config = row.get('config', {})
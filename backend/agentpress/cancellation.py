@@ -0,0 +1,100 @@
+"""
+Cancellation scopes for agent runs.
+
+A scope belongs to one agent run. The task driving the run is attached to it,
+and work started on the run's behalf (tool executions, blocking sandbox
+commands) registers with the scope found through `current_scope()`, which is
+inherited by every task created inside the run. Cancelling the scope cancels
+the run task, which interrupts whatever it is awaiting (the provider stream,
+an MCP call), cancels the tracked tool tasks and, once the run task has
+unwound, runs the registered cleanup callbacks.
+"""
+
+import asyncio
+import inspect
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Union
+
+from utils.logger import logger
+
+CleanupCallback = Callable[[], Union[None, Awaitable[Any]]]
+
+_current_scope: ContextVar[Optional["CancellationScope"]] = ContextVar("cancellation_scope", default=None)
+
+
+def current_scope() -> Optional["CancellationScope"]:
+    """Return the cancellation scope of the run executing the current task, if any."""
+    return _current_scope.get()
+
+
+class CancellationScope:
+    """Tracks the tasks and resources of one agent run so they can be aborted together."""
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self.cancelled = False
+        self.reason: Optional[str] = None
+        self.cancel_requested_at: Optional[float] = None
+        self._main_task: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._cleanups: Dict[int, CleanupCallback] = {}
+        self._next_cleanup_id = 0
+
+    def enter(self) -> None:
+        """Make this scope current for the running task and the tasks it creates."""
+        _current_scope.set(self)
+
+    def attach(self, task: asyncio.Task) -> None:
+        """Set the task that drives the run. A run stopped before this point is cancelled right away."""
+        self._main_task = task
+        if self.cancelled:
+            task.cancel()
+
+    def track(self, task: asyncio.Task) -> asyncio.Task:
+        """Cancel task together with the run; returns it for chaining."""
+        if self.cancelled:
+            task.cancel()
+            return task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def on_cancel(self, callback: CleanupCallback) -> Callable[[], None]:
+        """Register a cleanup to run if the run is cancelled. Returns an unregister function."""
+        cleanup_id = self._next_cleanup_id
+        self._next_cleanup_id += 1
+        self._cleanups[cleanup_id] = callback
+        return lambda: self._cleanups.pop(cleanup_id, None)
+
+    def cancel(self, reason: str = "stop requested") -> None:
+        """Abort the run. Safe to call from any callback on the run's event loop."""
+        if self.cancelled:
+            return
+        self.cancelled = True
+        self.reason = reason
+        self.cancel_requested_at = time.monotonic()
+        logger.info(f"Cancelling agent run {self.run_id}: {reason} ({len(self._tasks)} tracked tasks)")
+        for task in list(self._tasks):
+            task.cancel()
+        if self._main_task and not self._main_task.done():
+            self._main_task.cancel()
+
+    async def close(self) -> None:
+        """Run cleanup callbacks if the scope was cancelled, then forget tracked work."""
+        if self.cancelled:
+            for cleanup_id, callback in list(self._cleanups.items()):
+                try:
+                    result = callback()
+                    if inspect.isawaitable(result):
+                        await asyncio.wait_for(result, timeout=10.0)
+                except Exception as e:
+                    logger.warning(f"Cleanup {cleanup_id} failed for cancelled agent run {self.run_id}: {e}")
+        self._cleanups.clear()
+        self._tasks.clear()
+
+    def release_latency_ms(self) -> Optional[float]:
+        """Milliseconds since cancel() was requested, or None if it never was."""
+        if self.cancel_requested_at is None:
+            return None
+        return (time.monotonic() - self.cancel_requested_at) * 1000
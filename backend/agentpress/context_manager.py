@@ -11,6 +11,7 @@ from typing import List, Dict, Any, Optional, Union
 from litellm.utils import token_counter
 from services.supabase import DBConnection
 from utils.logger import logger
+from utils.model_registry import plan_context_budget
 
 DEFAULT_TOKEN_THRESHOLD = 120000
 
@@ -25,6 +26,8 @@ class ContextManager:
         """
         self.db = DBConnection()
         self.token_threshold = token_threshold
+        # Token count of the last compress_messages result, None if unknown
+        self.last_token_count: Optional[int] = None
 
     def is_tool_result_message(self, msg: Dict[str, Any]) -> bool:
         """Check if a message is a tool result message."""
@@ -207,33 +210,29 @@ class ContextManager:
                 result.append(msg)
         return result
 
-    def compress_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int] = 41000, token_threshold: int = 4096, max_iterations: int = 5) -> List[Dict[str, Any]]:
+    def compress_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int] = None, token_threshold: int = 4096, max_iterations: int = 5, max_output_tokens: Optional[int] = None) -> List[Dict[str, Any]]:
         """Compress the messages.
         
         Args:
             messages: List of messages to compress
             llm_model: Model name for token counting
-            max_tokens: Maximum allowed tokens
+            max_tokens: Maximum allowed tokens; planned from the model registry when None
             token_threshold: Token threshold for individual message compression (must be a power of 2)
             max_iterations: Maximum number of compression iterations
+            max_output_tokens: Completion limit the caller will request, reserved out of the context window
         """
-        # Set model-specific token limits
-        if 'sonnet' in llm_model.lower():
-            max_tokens = 200 * 1000 - 64000 - 28000
-        elif 'gpt' in llm_model.lower():
-            max_tokens = 128 * 1000 - 28000
-        elif 'gemini' in llm_model.lower():
-            max_tokens = 1000 * 1000 - 300000
-        elif 'deepseek' in llm_model.lower():
-            max_tokens = 128 * 1000 - 28000
-        else:
-            max_tokens = 41 * 1000 - 10000
+        if max_tokens is None:
+            max_tokens = plan_context_budget(llm_model, max_output_tokens).max_input_tokens
+        self.last_token_count = None
 
         result = messages
         result = self.remove_meta_messages(result)
 
         uncompressed_total_token_count = token_counter(model=llm_model, messages=result)
 
+        if uncompressed_total_token_count <= max_tokens:
+            return self._finalize_messages(result, uncompressed_total_token_count)
+
         result = self.compress_tool_result_messages(result, llm_model, max_tokens, token_threshold)
         result = self.compress_user_messages(result, llm_model, max_tokens, token_threshold)
         result = self.compress_assistant_messages(result, llm_model, max_tokens, token_threshold)
@@ -249,9 +248,15 @@ class ContextManager:
 
         if compressed_token_count > max_tokens:
             logger.warning(f"Further token compression is needed: {compressed_token_count} > {max_tokens}")
-            result = self.compress_messages(messages, llm_model, max_tokens, token_threshold // 2, max_iterations - 1)
+            return self.compress_messages(messages, llm_model, max_tokens, token_threshold // 2, max_iterations - 1)
+
+        return self._finalize_messages(result, compressed_token_count)
 
-        return self.middle_out_messages(result)
+    def _finalize_messages(self, messages: List[Dict[str, Any]], token_count: int) -> List[Dict[str, Any]]:
+        """Apply middle-out trimming and remember the prompt token count if it still holds."""
+        trimmed = self.middle_out_messages(messages)
+        self.last_token_count = token_count if trimmed is messages else None
+        return trimmed
     
     def compress_messages_by_omitting_messages(
             self, 
@@ -281,6 +286,7 @@ class ContextManager:
         max_allowed_tokens = max_tokens or (100 * 1000)
         
         if initial_token_count <= max_allowed_tokens:
+            self.last_token_count = initial_token_count
             return result
 
         # Separate system message (assumed to be first) from conversation messages
@@ -319,6 +325,7 @@ class ContextManager:
         # Prepare final result
         final_messages = ([system_message] + conversation_messages) if system_message else conversation_messages
         final_token_count = token_counter(model=llm_model, messages=final_messages)
+        self.last_token_count = final_token_count
         
         logger.info(f"compress_messages_by_omitting_messages: {initial_token_count} -> {final_token_count} tokens ({len(messages)} -> {len(final_messages)} messages)")
             
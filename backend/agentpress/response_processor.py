@@ -19,13 +19,15 @@ from utils.logger import logger
 from agentpress.tool import ToolResult
 from agentpress.tool_registry import ToolRegistry
 from agentpress.xml_tool_parser import XMLToolParser
-from langfuse.client import StatefulTraceClient
-from services.langfuse import langfuse
+from services.tracing import tracer, TraceHandle
 from utils.json_helpers import (
     ensure_dict, ensure_list, safe_json_parse, 
-    to_json_string, format_for_yield
+    to_json_string
 )
-from litellm.utils import token_counter
+from agentpress.stream_event import StreamEvent
+from agentpress.cancellation import current_scope
+from agentpress.usage_tracker import UsageTracker
+from services.run_checkpoint import RunCheckpointer
 
 # Type alias for XML result adding strategy
 XmlAddingStrategy = Literal["user_message", "assistant_message", "inline_edit"]
@@ -33,6 +35,9 @@ XmlAddingStrategy = Literal["user_message", "assistant_message", "inline_edit"]
 # Type alias for tool execution strategy
 ToolExecutionStrategy = Literal["sequential", "parallel"]
 
+# Result recorded on resume for a tool call whose run was interrupted mid-execution
+INTERRUPTED_TOOL_OUTPUT = "Tool execution was interrupted before it finished; it may or may not have taken effect."
+
 @dataclass
 class ToolExecutionContext:
     """Context for a tool execution including call details, result, and display info."""
@@ -86,7 +91,7 @@ class ProcessorConfig:
 class ResponseProcessor:
     """Processes LLM responses, extracting and executing tool calls."""
     
-    def __init__(self, tool_registry: ToolRegistry, add_message_callback: Callable, trace: Optional[StatefulTraceClient] = None, is_agent_builder: bool = False, target_agent_id: Optional[str] = None, agent_config: Optional[dict] = None):
+    def __init__(self, tool_registry: ToolRegistry, add_message_callback: Callable, trace: Optional[TraceHandle] = None, is_agent_builder: bool = False, target_agent_id: Optional[str] = None, agent_config: Optional[dict] = None):
         """Initialize the ResponseProcessor.
         
         Args:
@@ -97,7 +102,7 @@ class ResponseProcessor:
         """
         self.tool_registry = tool_registry
         self.add_message = add_message_callback
-        self.trace = trace or langfuse.trace(name="anonymous:response_processor")
+        self.trace = trace or tracer.trace(name="anonymous:response_processor")
         # Initialize the XML parser
         self.xml_parser = XMLToolParser()
         self.is_agent_builder = is_agent_builder
@@ -105,12 +110,9 @@ class ResponseProcessor:
         self.agent_config = agent_config
 
     async def _yield_message(self, message_obj: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
-        """Helper to yield a message with proper formatting.
-        
-        Ensures that content and metadata are JSON strings for client compatibility.
-        """
+        """Helper to wrap a saved message as a StreamEvent for yielding."""
         if message_obj:
-            return format_for_yield(message_obj)
+            return StreamEvent.from_message(message_obj)
         return None
 
     async def _add_message_with_agent_info(
@@ -149,6 +151,8 @@ class ResponseProcessor:
         can_auto_continue: bool = False,
         auto_continue_count: int = 0,
         continuous_state: Optional[Dict[str, Any]] = None,
+        prompt_tokens: Optional[int] = None,
+        checkpointer: Optional[RunCheckpointer] = None,
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """Process a streaming LLM response, handling tool calls and execution.
         
@@ -161,6 +165,8 @@ class ResponseProcessor:
             can_auto_continue: Whether auto-continue is enabled
             auto_continue_count: Number of auto-continue cycles
             continuous_state: Previous state of the conversation
+            prompt_tokens: Prompt token count from the pre-call context budget check
+            checkpointer: Records tool calls whose results are not saved yet, for resuming
             
         Yields:
             Complete message objects matching the DB schema, except for content chunks.
@@ -182,6 +188,7 @@ class ResponseProcessor:
         has_printed_thinking_prefix = False # Flag for printing thinking prefix only once
         agent_should_terminate = False # Flag to track if a terminating tool has been executed
         complete_native_tool_calls = [] # Initialize early for use in assistant_response_end
+        usage_tracker = UsageTracker(llm_model, prompt_tokens)
 
         # Collect metadata for reconstructing LiteLLM response object
         streaming_metadata = {
@@ -212,14 +219,14 @@ class ResponseProcessor:
                     thread_id=thread_id, type="status", content=start_content, 
                     is_llm_message=False, metadata={"thread_run_id": thread_run_id}
                 )
-                if start_msg_obj: yield format_for_yield(start_msg_obj)
+                if start_msg_obj: yield StreamEvent.from_message(start_msg_obj)
 
                 assist_start_content = {"status_type": "assistant_response_start"}
                 assist_start_msg_obj = await self.add_message(
                     thread_id=thread_id, type="status", content=assist_start_content, 
                     is_llm_message=False, metadata={"thread_run_id": thread_run_id}
                 )
-                if assist_start_msg_obj: yield format_for_yield(assist_start_msg_obj)
+                if assist_start_msg_obj: yield StreamEvent.from_message(assist_start_msg_obj)
             # --- End Start Events ---
 
             __sequence = continuous_state.get('sequence', 0)    # get the sequence from the previous auto-continue cycle
@@ -237,13 +244,7 @@ class ResponseProcessor:
                 if hasattr(chunk, 'model') and chunk.model:
                     streaming_metadata["model"] = chunk.model
                 if hasattr(chunk, 'usage') and chunk.usage:
-                    # Update usage information if available (including zero values)
-                    if hasattr(chunk.usage, 'prompt_tokens') and chunk.usage.prompt_tokens is not None:
-                        streaming_metadata["usage"]["prompt_tokens"] = chunk.usage.prompt_tokens
-                    if hasattr(chunk.usage, 'completion_tokens') and chunk.usage.completion_tokens is not None:
-                        streaming_metadata["usage"]["completion_tokens"] = chunk.usage.completion_tokens
-                    if hasattr(chunk.usage, 'total_tokens') and chunk.usage.total_tokens is not None:
-                        streaming_metadata["usage"]["total_tokens"] = chunk.usage.total_tokens
+                    usage_tracker.observe_provider_usage(chunk.usage)
 
                 if hasattr(chunk, 'choices') and chunk.choices and hasattr(chunk.choices[0], 'finish_reason') and chunk.choices[0].finish_reason:
                     finish_reason = chunk.choices[0].finish_reason
@@ -260,6 +261,7 @@ class ResponseProcessor:
                         # print(delta.reasoning_content, end='', flush=True)
                         # Append reasoning to main content to be saved in the final message
                         accumulated_content += delta.reasoning_content
+                        usage_tracker.add_completion_text(delta.reasoning_content)
 
                     # Process content chunk
                     if delta and hasattr(delta, 'content') and delta.content:
@@ -267,18 +269,19 @@ class ResponseProcessor:
                         # print(chunk_content, end='', flush=True)
                         accumulated_content += chunk_content
                         current_xml_content += chunk_content
+                        usage_tracker.add_completion_text(chunk_content)
 
                         if not (config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls):
                             # Yield ONLY content chunk (don't save)
                             now_chunk = datetime.now(timezone.utc).isoformat()
-                            yield {
+                            yield StreamEvent({
                                 "sequence": __sequence,
                                 "message_id": None, "thread_id": thread_id, "type": "assistant",
                                 "is_llm_message": True,
-                                "content": to_json_string({"role": "assistant", "content": chunk_content}),
-                                "metadata": to_json_string({"stream_status": "chunk", "thread_run_id": thread_run_id}),
+                                "content": {"role": "assistant", "content": chunk_content},
+                                "metadata": {"stream_status": "chunk", "thread_run_id": thread_run_id},
                                 "created_at": now_chunk, "updated_at": now_chunk
-                            }
+                            })
                             __sequence += 1
                         else:
                             logger.info("XML tool call limit reached - not yielding more content chunks")
@@ -302,10 +305,10 @@ class ResponseProcessor:
                                     if config.execute_tools and config.execute_on_stream:
                                         # Save and Yield tool_started status
                                         started_msg_obj = await self._yield_and_save_tool_started(context, thread_id, thread_run_id)
-                                        if started_msg_obj: yield format_for_yield(started_msg_obj)
+                                        if started_msg_obj: yield StreamEvent.from_message(started_msg_obj)
                                         yielded_tool_indices.add(tool_index) # Mark status as yielded
 
-                                        execution_task = asyncio.create_task(self._execute_tool(tool_call))
+                                        execution_task = self._create_tool_task(tool_call)
                                         pending_tool_executions.append({
                                             "task": execution_task, "tool_call": tool_call,
                                             "tool_index": tool_index, "context": context
@@ -333,14 +336,15 @@ class ResponseProcessor:
                                     if hasattr(tool_call_chunk.function, 'name'): tool_call_data_chunk['function']['name'] = tool_call_chunk.function.name
                                     if hasattr(tool_call_chunk.function, 'arguments'): tool_call_data_chunk['function']['arguments'] = tool_call_chunk.function.arguments if isinstance(tool_call_chunk.function.arguments, str) else to_json_string(tool_call_chunk.function.arguments)
 
+                            usage_tracker.add_completion_text((tool_call_data_chunk.get('function') or {}).get('arguments') or "")
 
                             now_tool_chunk = datetime.now(timezone.utc).isoformat()
-                            yield {
+                            yield StreamEvent({
                                 "message_id": None, "thread_id": thread_id, "type": "status", "is_llm_message": True,
-                                "content": to_json_string({"role": "assistant", "status_type": "tool_call_chunk", "tool_call_chunk": tool_call_data_chunk}),
-                                "metadata": to_json_string({"thread_run_id": thread_run_id}),
+                                "content": {"role": "assistant", "status_type": "tool_call_chunk", "tool_call_chunk": tool_call_data_chunk},
+                                "metadata": {"thread_run_id": thread_run_id},
                                 "created_at": now_tool_chunk, "updated_at": now_tool_chunk
-                            }
+                            })
 
                             # --- Buffer and Execute Complete Native Tool Calls ---
                             if not hasattr(tool_call_chunk, 'function'): continue
@@ -372,10 +376,10 @@ class ResponseProcessor:
 
                                 # Save and Yield tool_started status
                                 started_msg_obj = await self._yield_and_save_tool_started(context, thread_id, thread_run_id)
-                                if started_msg_obj: yield format_for_yield(started_msg_obj)
+                                if started_msg_obj: yield StreamEvent.from_message(started_msg_obj)
                                 yielded_tool_indices.add(tool_index) # Mark status as yielded
 
-                                execution_task = asyncio.create_task(self._execute_tool(tool_call_data))
+                                execution_task = self._create_tool_task(tool_call_data)
                                 pending_tool_executions.append({
                                     "task": execution_task, "tool_call": tool_call_data,
                                     "tool_index": tool_index, "context": context
@@ -391,37 +395,12 @@ class ResponseProcessor:
 
             # --- After Streaming Loop ---
             
-            if (
-                streaming_metadata["usage"]["total_tokens"] == 0
-            ):
-                logger.info("🔥 No usage data from provider, counting with litellm.token_counter")
-                
-                try:
-                    # prompt side
-                    prompt_tokens = token_counter(
-                        model=llm_model,
-                        messages=prompt_messages               # chat or plain; token_counter handles both
-                    )
-
-                    # completion side
-                    completion_tokens = token_counter(
-                        model=llm_model,
-                        text=accumulated_content or ""         # empty string safe
-                    )
-
-                    streaming_metadata["usage"]["prompt_tokens"]      = prompt_tokens
-                    streaming_metadata["usage"]["completion_tokens"]  = completion_tokens
-                    streaming_metadata["usage"]["total_tokens"]       = prompt_tokens + completion_tokens
-
-                    logger.info(
-                        f"🔥 Estimated tokens – prompt: {prompt_tokens}, "
-                        f"completion: {completion_tokens}, total: {prompt_tokens + completion_tokens}"
-                    )
-                    self.trace.event(name="usage_calculated_with_litellm_token_counter", level="DEFAULT", status_message=(f"Usage calculated with litellm.token_counter"))
-                except Exception as e:
-                    logger.warning(f"Failed to calculate usage: {str(e)}")
-                    self.trace.event(name="failed_to_calculate_usage", level="WARNING", status_message=(f"Failed to calculate usage: {str(e)}"))
-
+            # Provider-reported usage wins; otherwise use the pre-call prompt count and
+            # the completion tokens counted while streaming
+            streaming_metadata["usage"] = usage_tracker.finalize(prompt_messages)
+            if streaming_metadata["usage"]["source"] != "provider":
+                logger.info(f"Usage not fully reported by provider, using incremental estimate: {streaming_metadata['usage']}")
+                self.trace.event(name="usage_estimated_incrementally", level="DEFAULT", status_message=(f"Usage estimated incrementally ({streaming_metadata['usage']['source']})"))
 
             # Wait for pending tool executions from streaming phase
             tool_results_buffer = [] # Stores (tool_call, result, tool_index, context)
@@ -461,7 +440,7 @@ class ResponseProcessor:
                              context.error = e
                              # Save and Yield tool error status message (even if started was yielded)
                              error_msg_obj = await self._yield_and_save_tool_error(context, thread_id, thread_run_id)
-                             if error_msg_obj: yield format_for_yield(error_msg_obj)
+                             if error_msg_obj: yield StreamEvent.from_message(error_msg_obj)
                          continue # Skip further status yielding for this tool index
 
                     # If status wasn't yielded before (shouldn't happen with current logic), yield it now
@@ -481,7 +460,7 @@ class ResponseProcessor:
                             completed_msg_obj = await self._yield_and_save_tool_completed(
                                 context, None, thread_id, thread_run_id
                             )
-                            if completed_msg_obj: yield format_for_yield(completed_msg_obj)
+                            if completed_msg_obj: yield StreamEvent.from_message(completed_msg_obj)
                             yielded_tool_indices.add(tool_idx)
                     except Exception as e:
                         logger.error(f"Error getting result/yielding status for pending tool execution {tool_idx}: {str(e)}")
@@ -489,7 +468,7 @@ class ResponseProcessor:
                         context.error = e
                         # Save and Yield tool error status
                         error_msg_obj = await self._yield_and_save_tool_error(context, thread_id, thread_run_id)
-                        if error_msg_obj: yield format_for_yield(error_msg_obj)
+                        if error_msg_obj: yield StreamEvent.from_message(error_msg_obj)
                         yielded_tool_indices.add(tool_idx)
 
 
@@ -500,7 +479,7 @@ class ResponseProcessor:
                     thread_id=thread_id, type="status", content=finish_content, 
                     is_llm_message=False, metadata={"thread_run_id": thread_run_id}
                 )
-                if finish_msg_obj: yield format_for_yield(finish_msg_obj)
+                if finish_msg_obj: yield StreamEvent.from_message(finish_msg_obj)
                 logger.info(f"Stream finished with reason: xml_tool_limit_reached after {xml_tool_call_count} XML tool calls")
                 self.trace.event(name="stream_finished_with_reason_xml_tool_limit_reached_after_xml_tool_calls", level="DEFAULT", status_message=(f"Stream finished with reason: xml_tool_limit_reached after {xml_tool_call_count} XML tool calls"))
 
@@ -547,7 +526,7 @@ class ResponseProcessor:
                     # Format the message for yielding
                     yield_message = last_assistant_message_object.copy()
                     yield_message['metadata'] = yield_metadata
-                    yield format_for_yield(yield_message)
+                    yield StreamEvent.from_message(yield_message)
                 else:
                     logger.error(f"Failed to save final assistant message for thread {thread_id}")
                     self.trace.event(name="failed_to_save_final_assistant_message_for_thread", level="ERROR", status_message=(f"Failed to save final assistant message for thread {thread_id}"))
@@ -557,7 +536,7 @@ class ResponseProcessor:
                         thread_id=thread_id, type="status", content=err_content, 
                         is_llm_message=False, metadata={"thread_run_id": thread_run_id}
                     )
-                    if err_msg_obj: yield format_for_yield(err_msg_obj)
+                    if err_msg_obj: yield StreamEvent.from_message(err_msg_obj)
 
             # --- Process All Tool Results Now ---
             if config.execute_tools:
@@ -626,6 +605,10 @@ class ResponseProcessor:
                 elif final_tool_calls_to_process and not config.execute_on_stream:
                     logger.info(f"Executing {len(final_tool_calls_to_process)} tools ({config.tool_execution_strategy}) after stream")
                     self.trace.event(name="executing_tools_after_stream", level="DEFAULT", status_message=(f"Executing {len(final_tool_calls_to_process)} tools ({config.tool_execution_strategy}) after stream"))
+                    await self._checkpoint_pending_tools(
+                        checkpointer, last_assistant_message_object,
+                        [(data['tool_call'], data.get('parsing_details'), None) for _, data in sorted(all_tool_data_map.items())],
+                    )
                     results_list = await self._execute_tools(final_tool_calls_to_process, config.tool_execution_strategy)
                     current_tool_idx = 0
                     for tc, res in results_list:
@@ -648,7 +631,11 @@ class ResponseProcessor:
                 if tool_results_map:
                     logger.info(f"Saving and yielding {len(tool_results_map)} final tool result messages")
                     self.trace.event(name="saving_and_yielding_final_tool_result_messages", level="DEFAULT", status_message=(f"Saving and yielding {len(tool_results_map)} final tool result messages"))
-                    for tool_idx in sorted(tool_results_map.keys()):
+                    pending_tools = await self._checkpoint_pending_tools(
+                        checkpointer, last_assistant_message_object,
+                        [(tool_results_map[idx][0], tool_results_map[idx][2].parsing_details, tool_results_map[idx][1]) for idx in sorted(tool_results_map)],
+                    )
+                    for position, tool_idx in enumerate(sorted(tool_results_map.keys())):
                         tool_call, result, context = tool_results_map[tool_idx]
                         context.result = result
                         if not context.assistant_message_id and last_assistant_message_object:
@@ -657,7 +644,7 @@ class ResponseProcessor:
                         # Yield start status ONLY IF executing non-streamed (already yielded if streamed)
                         if not config.execute_on_stream and tool_idx not in yielded_tool_indices:
                             started_msg_obj = await self._yield_and_save_tool_started(context, thread_id, thread_run_id)
-                            if started_msg_obj: yield format_for_yield(started_msg_obj)
+                            if started_msg_obj: yield StreamEvent.from_message(started_msg_obj)
                             yielded_tool_indices.add(tool_idx) # Mark status yielded
 
                         # Save the tool result message to DB
@@ -672,17 +659,19 @@ class ResponseProcessor:
                             saved_tool_result_object['message_id'] if saved_tool_result_object else None,
                             thread_id, thread_run_id
                         )
-                        if completed_msg_obj: yield format_for_yield(completed_msg_obj)
+                        if completed_msg_obj: yield StreamEvent.from_message(completed_msg_obj)
                         # Don't add to yielded_tool_indices here, completion status is separate yield
 
                         # Yield the saved tool result object
                         if saved_tool_result_object:
+                            await self._checkpoint_tool_saved(checkpointer, pending_tools, position)
                             tool_result_message_objects[tool_idx] = saved_tool_result_object
-                            yield format_for_yield(saved_tool_result_object)
+                            yield StreamEvent.from_message(saved_tool_result_object)
                         else:
                              logger.error(f"Failed to save tool result for index {tool_idx}, not yielding result message.")
                              self.trace.event(name="failed_to_save_tool_result_for_index", level="ERROR", status_message=(f"Failed to save tool result for index {tool_idx}, not yielding result message."))
                              # Optionally yield error status for saving failure?
+                    await self._checkpoint_pending_tools(checkpointer, None, [])
 
             # --- Final Finish Status ---
             if finish_reason and finish_reason != "xml_tool_limit_reached":
@@ -691,7 +680,7 @@ class ResponseProcessor:
                     thread_id=thread_id, type="status", content=finish_content, 
                     is_llm_message=False, metadata={"thread_run_id": thread_run_id}
                 )
-                if finish_msg_obj: yield format_for_yield(finish_msg_obj)
+                if finish_msg_obj: yield StreamEvent.from_message(finish_msg_obj)
 
             # Check if agent should terminate after processing pending tools
             if agent_should_terminate:
@@ -707,7 +696,7 @@ class ResponseProcessor:
                     thread_id=thread_id, type="status", content=finish_content, 
                     is_llm_message=False, metadata={"thread_run_id": thread_run_id}
                 )
-                if finish_msg_obj: yield format_for_yield(finish_msg_obj)
+                if finish_msg_obj: yield StreamEvent.from_message(finish_msg_obj)
                 
                 # Save assistant_response_end BEFORE terminating
                 if last_assistant_message_object:
@@ -823,7 +812,7 @@ class ResponseProcessor:
                     thread_id=thread_id, type="status", content=err_content, 
                     is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
                 )
-                if err_msg_obj: yield format_for_yield(err_msg_obj) # Yield the saved error message
+                if err_msg_obj: yield StreamEvent.from_message(err_msg_obj) # Yield the saved error message
                 # Re-raise the same exception (not a new one) to ensure proper error propagation
                 logger.critical(f"Re-raising error to stop further processing: {str(e)}")
                 self.trace.event(name="re_raising_error_to_stop_further_processing", level="ERROR", status_message=(f"Re-raising error to stop further processing: {str(e)}"))
@@ -833,6 +822,10 @@ class ResponseProcessor:
             raise # Use bare 'raise' to preserve the original exception with its traceback
 
         finally:
+            scope = current_scope()
+            if scope and scope.cancelled:
+                await self._close_llm_stream(llm_response)
+
             # Update continuous state for potential auto-continue
             if should_auto_continue:
                 continuous_state['accumulated_content'] = accumulated_content
@@ -847,7 +840,7 @@ class ResponseProcessor:
                         thread_id=thread_id, type="status", content=end_content, 
                         is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
                     )
-                    if end_msg_obj: yield format_for_yield(end_msg_obj)
+                    if end_msg_obj: yield StreamEvent.from_message(end_msg_obj)
                 except Exception as final_e:
                     logger.error(f"Error in finally block: {str(final_e)}", exc_info=True)
                     self.trace.event(name="error_in_finally_block", level="ERROR", status_message=(f"Error in finally block: {str(final_e)}"))
@@ -859,6 +852,7 @@ class ResponseProcessor:
         prompt_messages: List[Dict[str, Any]],
         llm_model: str,
         config: ProcessorConfig = ProcessorConfig(),
+        checkpointer: Optional[RunCheckpointer] = None,
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """Process a non-streaming LLM response, handling tool calls and execution.
         
@@ -868,6 +862,7 @@ class ResponseProcessor:
             prompt_messages: List of messages sent to the LLM (the prompt)
             llm_model: The name of the LLM model used
             config: Configuration for parsing and execution
+            checkpointer: Records tool calls whose results are not saved yet, for resuming
             
         Yields:
             Complete message objects matching the DB schema.
@@ -888,7 +883,7 @@ class ResponseProcessor:
                 thread_id=thread_id, type="status", content=start_content,
                 is_llm_message=False, metadata={"thread_run_id": thread_run_id}
             )
-            if start_msg_obj: yield format_for_yield(start_msg_obj)
+            if start_msg_obj: yield StreamEvent.from_message(start_msg_obj)
 
             # Extract finish_reason, content, tool calls
             if hasattr(llm_response, 'choices') and llm_response.choices:
@@ -949,14 +944,20 @@ class ResponseProcessor:
                      thread_id=thread_id, type="status", content=err_content, 
                      is_llm_message=False, metadata={"thread_run_id": thread_run_id}
                  )
-                 if err_msg_obj: yield format_for_yield(err_msg_obj)
+                 if err_msg_obj: yield StreamEvent.from_message(err_msg_obj)
 
        # --- Execute Tools and Yield Results ---
             tool_calls_to_execute = [item['tool_call'] for item in all_tool_data]
             if config.execute_tools and tool_calls_to_execute:
                 logger.info(f"Executing {len(tool_calls_to_execute)} tools with strategy: {config.tool_execution_strategy}")
                 self.trace.event(name="executing_tools_with_strategy", level="DEFAULT", status_message=(f"Executing {len(tool_calls_to_execute)} tools with strategy: {config.tool_execution_strategy}"))
+                tool_data = [(item['tool_call'], item['parsing_details'], None) for item in all_tool_data]
+                await self._checkpoint_pending_tools(checkpointer, assistant_message_object, tool_data)
                 tool_results = await self._execute_tools(tool_calls_to_execute, config.tool_execution_strategy)
+                pending_tools = await self._checkpoint_pending_tools(
+                    checkpointer, assistant_message_object,
+                    [(tool_call, parsing_details, result) for (tool_call, parsing_details, _), (_, result) in zip(tool_data, tool_results)],
+                )
 
                 for i, (returned_tool_call, result) in enumerate(tool_results):
                     original_data = all_tool_data[i]
@@ -971,7 +972,7 @@ class ResponseProcessor:
 
                     # Save and Yield start status
                     started_msg_obj = await self._yield_and_save_tool_started(context, thread_id, thread_run_id)
-                    if started_msg_obj: yield format_for_yield(started_msg_obj)
+                    if started_msg_obj: yield StreamEvent.from_message(started_msg_obj)
 
                     # Save tool result
                     saved_tool_result_object = await self._add_tool_result(
@@ -985,17 +986,19 @@ class ResponseProcessor:
                         saved_tool_result_object['message_id'] if saved_tool_result_object else None,
                         thread_id, thread_run_id
                     )
-                    if completed_msg_obj: yield format_for_yield(completed_msg_obj)
+                    if completed_msg_obj: yield StreamEvent.from_message(completed_msg_obj)
 
                     # Yield the saved tool result object
                     if saved_tool_result_object:
+                        await self._checkpoint_tool_saved(checkpointer, pending_tools, i)
                         tool_result_message_objects[tool_index] = saved_tool_result_object
-                        yield format_for_yield(saved_tool_result_object)
+                        yield StreamEvent.from_message(saved_tool_result_object)
                     else:
                          logger.error(f"Failed to save tool result for index {tool_index}")
                          self.trace.event(name="failed_to_save_tool_result_for_index", level="ERROR", status_message=(f"Failed to save tool result for index {tool_index}"))
 
                     tool_index += 1
+                await self._checkpoint_pending_tools(checkpointer, None, [])
 
             # --- Save and Yield Final Status ---
             if finish_reason:
@@ -1004,7 +1007,7 @@ class ResponseProcessor:
                     thread_id=thread_id, type="status", content=finish_content, 
                     is_llm_message=False, metadata={"thread_run_id": thread_run_id}
                 )
-                if finish_msg_obj: yield format_for_yield(finish_msg_obj)
+                if finish_msg_obj: yield StreamEvent.from_message(finish_msg_obj)
 
             # --- Save and Yield assistant_response_end ---
             if assistant_message_object: # Only save if assistant message was saved
@@ -1031,7 +1034,7 @@ class ResponseProcessor:
                  thread_id=thread_id, type="status", content=err_content, 
                  is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
              )
-             if err_msg_obj: yield format_for_yield(err_msg_obj)
+             if err_msg_obj: yield StreamEvent.from_message(err_msg_obj)
              
              # Re-raise the same exception (not a new one) to ensure proper error propagation
              logger.critical(f"Re-raising error to stop further processing: {str(e)}")
@@ -1045,7 +1048,7 @@ class ResponseProcessor:
                 thread_id=thread_id, type="status", content=end_content, 
                 is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
             )
-            if end_msg_obj: yield format_for_yield(end_msg_obj)
+            if end_msg_obj: yield StreamEvent.from_message(end_msg_obj)
 
 
     def _extract_xml_chunks(self, content: str) -> List[str]:
@@ -1216,6 +1219,25 @@ class ResponseProcessor:
         return parsed_data
 
     # Tool execution methods
+    def _create_tool_task(self, tool_call: Dict[str, Any]) -> asyncio.Task:
+        """Start a tool execution as a task that is cancelled with the run."""
+        task = asyncio.create_task(self._execute_tool(tool_call))
+        scope = current_scope()
+        if scope:
+            scope.track(task)
+        return task
+
+    async def _close_llm_stream(self, llm_response: Any) -> None:
+        """Close an interrupted provider stream so its connection is released right away."""
+        for stream in (llm_response, getattr(llm_response, "completion_stream", None)):
+            close = getattr(stream, "aclose", None)
+            if close:
+                try:
+                    await close()
+                except Exception as e:
+                    logger.debug(f"Error closing cancelled LLM stream: {e}")
+                return
+
     async def _execute_tool(self, tool_call: Dict[str, Any]) -> ToolResult:
         """Execute a single tool call and return the result."""
         span = self.trace.span(name=f"execute_tool.{tool_call['function_name']}", input=tool_call["arguments"])            
@@ -1390,6 +1412,67 @@ class ResponseProcessor:
             return [(tool_call, ToolResult(success=False, output=f"Execution error: {str(e)}")) 
                     for tool_call in tool_calls]
 
+    async def _checkpoint_pending_tools(
+        self,
+        checkpointer: Optional[RunCheckpointer],
+        assistant_message: Optional[Dict[str, Any]],
+        tools: List[Tuple[Dict[str, Any], Optional[Dict[str, Any]], Optional[ToolResult]]],
+    ) -> Optional[Dict[str, Any]]:
+        """Record the step's tool calls (and results, once known) until their results are saved; [] clears them.
+
+        A run resumed from the checkpoint saves the recorded results, or an
+        interrupted result for calls that had none, so every tool call in the
+        thread has a result. Nothing is recorded if the assistant message that
+        made the calls was not saved.
+        """
+        if not checkpointer:
+            return None
+        pending_tools = None
+        if tools and assistant_message:
+            pending_tools = {
+                "assistant_message_id": assistant_message['message_id'],
+                "tools": [
+                    {
+                        "tool_call": tool_call,
+                        "parsing_details": parsing_details,
+                        "result": None if result is None else {
+                            "success": result.success,
+                            "output": result.output if isinstance(result.output, str) else to_json_string(result.output),
+                        },
+                        "saved": False,
+                    }
+                    for tool_call, parsing_details, result in tools
+                ],
+            }
+        await checkpointer.save(pending_tools=pending_tools)
+        return pending_tools
+
+    async def _checkpoint_tool_saved(self, checkpointer: Optional[RunCheckpointer], pending_tools: Optional[Dict[str, Any]], position: int) -> None:
+        if checkpointer and pending_tools and position < len(pending_tools["tools"]):
+            pending_tools["tools"][position]["saved"] = True
+            await checkpointer.save(pending_tools=pending_tools)
+
+    async def resolve_interrupted_tools(self, thread_id: str, pending_tools: Dict[str, Any], strategy: Union[XmlAddingStrategy, str]) -> int:
+        """Save a result for each checkpointed tool call that has none in the thread. Returns how many were saved.
+
+        Results that were computed before the interruption are saved as they
+        were; calls still executing get INTERRUPTED_TOOL_OUTPUT as a failed result.
+        """
+        saved = 0
+        for entry in pending_tools.get("tools") or []:
+            if entry.get("saved"):
+                continue
+            if entry.get("result"):
+                result = ToolResult(success=entry["result"]["success"], output=entry["result"]["output"])
+            else:
+                result = ToolResult(success=False, output=INTERRUPTED_TOOL_OUTPUT)
+            if await self._add_tool_result(
+                thread_id, entry["tool_call"], result, strategy,
+                pending_tools.get("assistant_message_id"), entry.get("parsing_details"),
+            ):
+                saved += 1
+        return saved
+
     async def _add_tool_result(
         self, 
         thread_id: str, 
@@ -0,0 +1,133 @@
+"""
+In-process representation of streamed agent events.
+
+Events produced by the ResponseProcessor travel through ThreadManager,
+AgentRunner and the background worker as StreamEvent objects whose content and
+metadata stay Python objects. They are serialized once, at the transport
+boundary, and the encoded bytes are cached on the event.
+
+Wire versions:
+    1  content and metadata embedded as JSON strings (what the web app parses)
+    2  one JSON document with content and metadata as nested objects, tagged
+       with a leading "v": 2 so readers can tell the versions apart cheaply
+
+The worker stores events in RUN_STREAM_WIRE_VERSION. Clients that ask for the
+stored version get the stored bytes as they are; others get `transcode`d frames.
+Clients that read both versions (the SDK) ask for STORED_WIRE_VERSION and are
+never transcoded.
+"""
+
+import json
+from typing import Any, Dict, Optional, Union
+
+from utils.config import config
+from utils.json_helpers import ensure_dict
+
+WIRE_VERSIONS = (1, 2)
+STORED_WIRE_VERSION = 0  # whatever version each event was stored in
+_V2_PREFIX = '{"v": 2'
+
+
+def _invalidating(method):
+    """Wrap a dict mutator so it drops the event's cached encoding."""
+    def mutator(self, *args, **kwargs):
+        self._encoded = None
+        return method(self, *args, **kwargs)
+    mutator.__name__ = method.__name__
+    return mutator
+
+
+class StreamEvent(dict):
+    """A streamed event dict with lazily encoded, cached wire bytes.
+
+    Consumers can keep using dict access; `content` and `metadata` hold parsed
+    objects rather than JSON strings. Every mutation drops the cached encoding.
+    """
+
+    __slots__ = ("_encoded", "_encoded_version")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._encoded: Optional[bytes] = None
+        self._encoded_version: Optional[int] = None
+
+    @classmethod
+    def from_message(cls, message_object: Optional[Dict[str, Any]]) -> Optional["StreamEvent"]:
+        """Wrap a saved message object for streaming (replaces format_for_yield)."""
+        if not message_object:
+            return message_object
+        return cls(message_object)
+
+    __setitem__ = _invalidating(dict.__setitem__)
+    __delitem__ = _invalidating(dict.__delitem__)
+    __ior__ = _invalidating(dict.__ior__)
+    update = _invalidating(dict.update)
+    pop = _invalidating(dict.pop)
+    popitem = _invalidating(dict.popitem)
+    setdefault = _invalidating(dict.setdefault)
+    clear = _invalidating(dict.clear)
+
+    @property
+    def content_dict(self) -> Dict[str, Any]:
+        return ensure_dict(self.get("content"))
+
+    @property
+    def metadata_dict(self) -> Dict[str, Any]:
+        return ensure_dict(self.get("metadata"))
+
+    def to_wire(self, version: int = 1) -> Dict[str, Any]:
+        """Return the client-facing dict for the given wire version."""
+        return _to_wire(self, version)
+
+    def encode(self, version: Optional[int] = None) -> bytes:
+        """Serialize the event for transport, caching the result."""
+        version = version or config.RUN_STREAM_WIRE_VERSION
+        if self._encoded is None or self._encoded_version != version:
+            self._encoded = json.dumps(self.to_wire(version)).encode("utf-8")
+            self._encoded_version = version
+        return self._encoded
+
+
+def _to_wire(event: Dict[str, Any], version: int) -> Dict[str, Any]:
+    if version == 2:
+        # "v" goes first so stored_version can check the prefix
+        wire = {"v": 2}
+        wire.update((key, value) for key, value in event.items() if key != "v")
+        for key in ("content", "metadata"):
+            value = wire.get(key)
+            if isinstance(value, str):
+                try:
+                    wire[key] = json.loads(value)
+                except (json.JSONDecodeError, TypeError):
+                    pass
+        return wire
+    wire = dict(event)
+    wire.pop("v", None)
+    for key in ("content", "metadata"):
+        if key in wire and not isinstance(wire[key], str):
+            wire[key] = json.dumps(wire[key])
+    return wire
+
+
+def encode_event(event: Union[StreamEvent, Dict[str, Any]], version: Optional[int] = None) -> bytes:
+    """Serialize any event yielded by the agent for Redis/SSE transport."""
+    if isinstance(event, StreamEvent):
+        return event.encode(version)
+    return json.dumps(_to_wire(event, version or config.RUN_STREAM_WIRE_VERSION)).encode("utf-8")
+
+
+def stored_version(raw: str) -> int:
+    return 2 if raw.startswith(_V2_PREFIX) else 1
+
+
+def transcode(raw: str, version: int) -> str:
+    """Convert a stored event to the wire version a client asked for."""
+    if version == STORED_WIRE_VERSION or stored_version(raw) == version:
+        return raw
+    try:
+        event = json.loads(raw)
+    except (json.JSONDecodeError, TypeError):
+        return raw
+    if not isinstance(event, dict):
+        return raw
+    return json.dumps(_to_wire(event, version))
@@ -21,11 +21,13 @@ from agentpress.response_processor import (
     ProcessorConfig
 )
 from services.supabase import DBConnection
+from services import postgres
 from utils.logger import logger
-from langfuse.client import StatefulGenerationClient, StatefulTraceClient
-from services.langfuse import langfuse
+from utils.model_registry import plan_context_budget
+from utils.json_helpers import ensure_dict
+from services.tracing import tracer, TraceHandle, ObservationHandle
+from services.run_checkpoint import RunCheckpointer
 import datetime
-from litellm.utils import token_counter
 
 # Type alias for tool choice
 ToolChoice = Literal["auto", "required", "none"]
@@ -38,7 +40,7 @@ class ThreadManager:
     XML-based tool execution patterns.
     """
 
-    def __init__(self, trace: Optional[StatefulTraceClient] = None, is_agent_builder: bool = False, target_agent_id: Optional[str] = None, agent_config: Optional[dict] = None):
+    def __init__(self, trace: Optional[TraceHandle] = None, is_agent_builder: bool = False, target_agent_id: Optional[str] = None, agent_config: Optional[dict] = None):
         """Initialize ThreadManager.
 
         Args:
@@ -54,7 +56,7 @@ class ThreadManager:
         self.target_agent_id = target_agent_id
         self.agent_config = agent_config
         if not self.trace:
-            self.trace = langfuse.trace(name="anonymous:thread_manager")
+            self.trace = tracer.trace(name="anonymous:thread_manager")
         self.response_processor = ResponseProcessor(
             tool_registry=self.tool_registry,
             add_message_callback=self.add_message,
@@ -64,6 +66,7 @@ class ThreadManager:
             agent_config=self.agent_config
         )
         self.context_manager = ContextManager()
+        self.last_message_id: Optional[str] = None
 
     def add_tool(self, tool_class: Type[Tool], function_names: Optional[List[str]] = None, **kwargs):
         """Add a tool to the ThreadManager."""
@@ -165,13 +168,14 @@ class ThreadManager:
 
         try:
             # Insert the message and get the inserted row data including the id
-            result = await client.table('messages').insert(data_to_insert).execute()
+            row = await postgres.insert_message(client, data_to_insert)
             logger.info(f"Successfully added message to thread {thread_id}")
 
-            if result.data and len(result.data) > 0 and isinstance(result.data[0], dict) and 'message_id' in result.data[0]:
-                return result.data[0]
+            if isinstance(row, dict) and 'message_id' in row:
+                self.last_message_id = row['message_id']
+                return row
             else:
-                logger.error(f"Insert operation failed or did not return expected data structure for thread {thread_id}. Result data: {result.data}")
+                logger.error(f"Insert operation failed or did not return expected data structure for thread {thread_id}. Result data: {row}")
                 return None
         except Exception as e:
             logger.error(f"Failed to add message to thread {thread_id}: {str(e)}", exc_info=True)
@@ -194,28 +198,7 @@ class ThreadManager:
 
         try:
             # result = await client.rpc('get_llm_formatted_messages', {'p_thread_id': thread_id}).execute()
-            
-            # Fetch messages in batches of 1000 to avoid overloading the database
-            all_messages = []
-            batch_size = 1000
-            offset = 0
-            
-            while True:
-                result = await client.table('messages').select('message_id, content').eq('thread_id', thread_id).eq('is_llm_message', True).order('created_at').range(offset, offset + batch_size - 1).execute()
-                
-                if not result.data or len(result.data) == 0:
-                    break
-                    
-                all_messages.extend(result.data)
-                
-                # If we got fewer than batch_size records, we've reached the end
-                if len(result.data) < batch_size:
-                    break
-                    
-                offset += batch_size
-            
-            # Use all_messages instead of result.data in the rest of the method
-            result_data = all_messages
+            result_data = await postgres.get_llm_message_rows(client, thread_id)
 
             # Parse the returned data which might be stringified JSON
             if not result_data:
@@ -260,7 +243,9 @@ class ThreadManager:
         enable_thinking: Optional[bool] = False,
         reasoning_effort: Optional[str] = 'low',
         enable_context_manager: bool = True,
-        generation: Optional[StatefulGenerationClient] = None,
+        generation: Optional[ObservationHandle] = None,
+        checkpointer: Optional[RunCheckpointer] = None,
+        resume_state: Optional[Dict[str, Any]] = None,
     ) -> Union[Dict[str, Any], AsyncGenerator]:
         """Run a conversation thread with LLM integration and tool execution.
 
@@ -281,6 +266,9 @@ class ThreadManager:
             enable_thinking: Whether to enable thinking before making a decision
             reasoning_effort: The effort level for reasoning
             enable_context_manager: Whether to enable automatic context summarization.
+            generation: Optional observation to record the LLM call on
+            checkpointer: Saves the auto-continue position after every completed step
+            resume_state: Checkpointed auto-continue position to continue from
 
         Returns:
             An async generator yielding response chunks or error dict
@@ -383,6 +371,13 @@ When using the tools:
             'thread_run_id': None
         }
 
+        # Pick up where an interrupted run left off; its completed steps are already in the thread
+        if resume_state and resume_state.get('auto_continue_count'):
+            auto_continue_count = resume_state['auto_continue_count']
+            continuous_state.update(resume_state.get('continuous_state') or {})
+            llm_model = resume_state.get('llm_model') or llm_model
+            logger.info(f"Resuming thread {thread_id} at auto-continue {auto_continue_count}")
+
         # Define inner function to handle a single run
         async def _run_once(temp_msg=None):
             try:
@@ -393,18 +388,7 @@ When using the tools:
                 # 1. Get messages from thread for LLM call
                 messages = await self.get_llm_messages(thread_id)
 
-                # 2. Check token count before proceeding
-                token_count = 0
-                try:
-                    # Use the potentially modified working_system_prompt for token counting
-                    token_count = token_counter(model=llm_model, messages=[working_system_prompt] + messages)
-                    token_threshold = self.context_manager.token_threshold
-                    logger.info(f"Thread {thread_id} token count: {token_count}/{token_threshold} ({(token_count/token_threshold)*100:.1f}%)")
-
-                except Exception as e:
-                    logger.error(f"Error counting tokens or summarizing: {str(e)}")
-
-                # 3. Prepare messages for LLM call + add temporary message if it exists
+                # 2. Prepare messages for LLM call + add temporary message if it exists
                 # Use the working_system_prompt which may contain the XML examples
                 prepared_messages = [working_system_prompt]
 
@@ -439,7 +423,7 @@ When using the tools:
                     prepared_messages.append(temporary_assistant_message)
                     logger.info(f"Added temporary assistant message with {len(partial_content)} chars for auto-continue context")
 
-                # 4. Prepare tools for LLM call
+                # 3. Prepare tools for LLM call
                 openapi_tool_schemas = None
                 if config.native_tool_calling:
                     openapi_tool_schemas = self.tool_registry.get_openapi_schemas()
@@ -447,7 +431,13 @@ When using the tools:
 
                 # print(f"\n\n\n\n prepared_messages: {prepared_messages}\n\n\n\n")
 
-                prepared_messages = self.context_manager.compress_messages(prepared_messages, llm_model)
+                # 4. Fit the prompt into the context budget; the token count computed here is
+                # reused for usage accounting instead of re-tokenizing after the call
+                prepared_messages = self.context_manager.compress_messages(prepared_messages, llm_model, max_output_tokens=llm_max_tokens)
+                prompt_token_count = self.context_manager.last_token_count
+                if prompt_token_count is not None:
+                    token_threshold = plan_context_budget(llm_model, llm_max_tokens).max_input_tokens
+                    logger.info(f"Thread {thread_id} token count: {prompt_token_count}/{token_threshold} ({(prompt_token_count/token_threshold)*100:.1f}%)")
 
                 # 5. Make LLM API call
                 logger.debug("Making LLM API call")
@@ -497,7 +487,9 @@ When using the tools:
                             llm_model=llm_model,
                             can_auto_continue=(native_max_auto_continues > 0),
                             auto_continue_count=auto_continue_count,
-                            continuous_state=continuous_state
+                            continuous_state=continuous_state,
+                            prompt_tokens=prompt_token_count,
+                            checkpointer=checkpointer,
                         )
                     else:
                         # Fallback to non-streaming if response is not iterable
@@ -507,6 +499,7 @@ When using the tools:
                             config=config,
                             prompt_messages=prepared_messages,
                             llm_model=llm_model,
+                            checkpointer=checkpointer,
                         )
 
                     return response_generator
@@ -519,6 +512,7 @@ When using the tools:
                         config=config,
                         prompt_messages=prepared_messages,
                         llm_model=llm_model,
+                        checkpointer=checkpointer,
                     )
                     return response_generator # Return the generator
 
@@ -533,12 +527,21 @@ When using the tools:
 
         # Define a wrapper generator that handles auto-continue logic
         async def auto_continue_wrapper():
-            nonlocal auto_continue, auto_continue_count
+            nonlocal auto_continue, auto_continue_count, llm_model
 
             while auto_continue and (native_max_auto_continues == 0 or auto_continue_count < native_max_auto_continues):
                 # Reset auto_continue for this iteration
                 auto_continue = False
 
+                # The previous step's messages and tool results are persisted by now
+                if checkpointer and auto_continue_count > 0:
+                    await checkpointer.save(
+                        auto_continue_count=auto_continue_count,
+                        continuous_state=continuous_state,
+                        llm_model=llm_model,
+                        last_message_id=self.last_message_id,
+                    )
+
                 # Run the thread once, passing the potentially modified system prompt
                 # Pass temp_msg only on the first iteration
                 try:
@@ -572,7 +575,7 @@ When using the tools:
 
                                 elif chunk.get('type') == 'status':
                                     # if the finish reason is length, auto-continue
-                                    content = json.loads(chunk.get('content'))
+                                    content = ensure_dict(chunk.get('content'))
                                     if content.get('finish_reason') == 'length':
                                         logger.info(f"Detected finish_reason='length', auto-continuing ({auto_continue_count + 1}/{native_max_auto_continues})")
                                         auto_continue = True
@@ -590,7 +593,6 @@ When using the tools:
                     except Exception as e:
                         if ("AnthropicException - Overloaded" in str(e)):
                             logger.error(f"AnthropicException - Overloaded detected - Falling back to OpenRouter: {str(e)}", exc_info=True)
-                            nonlocal llm_model
                             # Remove "-20250514" from the model name if present
                             model_name_cleaned = llm_model.replace("-20250514", "")
                             llm_model = f"openrouter/{model_name_cleaned}"
@@ -0,0 +1,120 @@
+"""
+Token usage accounting for a single LLM call.
+
+The tracker starts from the prompt token count already computed for the
+pre-call context budget, counts completion tokens incrementally while deltas
+stream in, and defers to provider-reported usage whenever the provider sends
+it. The result is a single usage record for assistant_response_end without
+re-tokenizing the full prompt or completion after the stream ends.
+"""
+
+from typing import Any, Dict, List, Optional
+
+from litellm.utils import token_counter
+from utils.logger import logger
+
+# Pending completion text is tokenized once it grows past this many characters,
+# cut at the last whitespace so words are not split across batches.
+FLUSH_THRESHOLD_CHARS = 512
+
+
+class UsageTracker:
+    """Accumulates prompt/completion token counts for one streamed response."""
+
+    def __init__(self, llm_model: str, prompt_tokens: Optional[int] = None):
+        """Initialize the tracker.
+
+        Args:
+            llm_model: Model used for tokenization
+            prompt_tokens: Prompt token count from the pre-call budget check, if known
+        """
+        self.llm_model = llm_model
+        self.estimated_prompt_tokens = prompt_tokens
+        self.estimated_completion_tokens = 0
+        self.provider_usage: Dict[str, int] = {}
+        self._pending: List[str] = []
+        self._pending_chars = 0
+
+    def add_completion_text(self, text: str) -> None:
+        """Record a streamed completion delta."""
+        if not text:
+            return
+        self._pending.append(text)
+        self._pending_chars += len(text)
+        if self._pending_chars >= FLUSH_THRESHOLD_CHARS:
+            self._flush(final=False)
+
+    def observe_provider_usage(self, usage: Any) -> None:
+        """Record usage reported by the provider on a chunk (usually the last one)."""
+        if not usage:
+            return
+        for field in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            value = usage.get(field) if isinstance(usage, dict) else getattr(usage, field, None)
+            if value is not None:
+                self.provider_usage[field] = value
+
+    def _count(self, text: str) -> int:
+        try:
+            return token_counter(model=self.llm_model, text=text)
+        except Exception as e:
+            logger.warning(f"Token counting failed, estimating from length: {str(e)}")
+            return len(text) // 4
+
+    def _flush(self, final: bool) -> None:
+        if not self._pending:
+            return
+        text = "".join(self._pending)
+        remainder = ""
+        if not final:
+            cut = max(text.rfind(" "), text.rfind("\n"))
+            if cut > 0:
+                text, remainder = text[:cut], text[cut:]
+        self.estimated_completion_tokens += self._count(text)
+        self._pending = [remainder] if remainder else []
+        self._pending_chars = len(remainder)
+
+    def finalize(self, prompt_messages: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """Reconcile provider usage with local estimates.
+
+        Args:
+            prompt_messages: Only tokenized when neither the provider nor the
+                pre-call check supplied a prompt count
+
+        Returns:
+            Usage dict with prompt_tokens, completion_tokens, total_tokens and
+            the source of the numbers ("provider", "estimated" or "mixed")
+        """
+        has_provider_prompt = self.provider_usage.get("prompt_tokens", 0) > 0
+        has_provider_completion = self.provider_usage.get("completion_tokens", 0) > 0
+
+        if has_provider_prompt:
+            prompt_tokens = self.provider_usage["prompt_tokens"]
+        else:
+            if self.estimated_prompt_tokens is None and prompt_messages:
+                try:
+                    self.estimated_prompt_tokens = token_counter(model=self.llm_model, messages=prompt_messages)
+                except Exception as e:
+                    logger.warning(f"Failed to count prompt tokens: {str(e)}")
+            prompt_tokens = self.estimated_prompt_tokens or 0
+
+        if has_provider_completion:
+            completion_tokens = self.provider_usage["completion_tokens"]
+            self._pending = []
+            self._pending_chars = 0
+        else:
+            self._flush(final=True)
+            completion_tokens = self.estimated_completion_tokens
+
+        if has_provider_prompt and has_provider_completion:
+            source = "provider"
+        elif has_provider_prompt or has_provider_completion:
+            source = "mixed"
+        else:
+            source = "estimated"
+
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "source": source,
+        }
@@ -4,7 +4,12 @@ load_dotenv()
 from fastapi import FastAPI, Request, HTTPException, Response, Depends, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, StreamingResponse
-from services import redis
+from services import redis, run_registry, run_limits, run_checkpoint, run_dispatch
+from services.llm_transport import llm_http_pool
+from services.postgres import pg_pool
+from utils import access_cache
+from utils.access_cache import request_scope
+from services.tracing import tracer
 import sentry
 from contextlib import asynccontextmanager
 from agentpress.thread_manager import ThreadManager
@@ -20,6 +25,7 @@ from pydantic import BaseModel
 import uuid
 
 from agent import api as agent_api
+from run_agent_background import resume_agent_run, send_dispatch
 
 from sandbox import api as sandbox_api
 from services import billing as billing_api
@@ -57,7 +63,6 @@ async def lifespan(app: FastAPI):
         sandbox_api.initialize(db)
         
         # Initialize Redis connection
-        from services import redis
         try:
             await redis.initialize_async()
             logger.info("Redis connection initialized successfully")
@@ -65,6 +70,25 @@ async def lifespan(app: FastAPI):
             logger.error(f"Failed to initialize Redis connection: {e}")
             # Continue without Redis - the application will handle Redis failures gracefully
         
+        await llm_http_pool.start()
+        await pg_pool.start()
+        await access_cache.start_invalidation_listener()
+        
+        # Drop run registry entries left behind by workers that died mid-run
+        registry_reconciler = asyncio.create_task(run_registry.run_reconciler())
+
+        # Keep the running-run counters used by the run limits in line with agent_runs,
+        # and fail runs whose API process died before dispatching them
+        run_limits_reconciler = asyncio.create_task(
+            run_limits.run_reconciler(db, fail_abandoned=agent_api.fail_abandoned_provisioning)
+        )
+
+        # Resume checkpointed runs whose worker died without handing them off
+        checkpoint_sweeper = asyncio.create_task(run_checkpoint.run_sweeper(resume_agent_run))
+
+        # Requeue dispatched runs whose worker died before claiming them
+        dispatch_requeuer = asyncio.create_task(run_dispatch.run_requeuer(send_dispatch))
+        
         # Start background tasks
         # asyncio.create_task(agent_api.restore_running_agent_runs())
         
@@ -76,10 +100,21 @@ async def lifespan(app: FastAPI):
         
         yield
         
+        registry_reconciler.cancel()
+        run_limits_reconciler.cancel()
+        checkpoint_sweeper.cancel()
+        dispatch_requeuer.cancel()
+        
         # Clean up agent resources
         logger.info("Cleaning up agent resources")
         await agent_api.cleanup()
         
+        await llm_http_pool.close()
+        await pg_pool.close()
+        
+        # Let the trace exporter drain and flush on its own thread
+        tracer.shutdown()
+        
         # Clean up Redis connection
         try:
             logger.info("Closing Redis connection")
@@ -120,7 +155,8 @@ async def log_requests_middleware(request: Request, call_next):
     logger.info(f"Request started: {method} {path} from {client_ip} | Query: {query_params}")
     
     try:
-        response = await call_next(request)
+        with request_scope():
+            response = await call_next(request)
         process_time = time.time() - start_time
         logger.debug(f"Request completed: {method} {path} | Status: {response.status_code} | Time: {process_time:.2f}s")
         return response
@@ -159,7 +195,8 @@ app.add_middleware(
     allow_origin_regex=allow_origin_regex,
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization", "X-Project-Id", "X-MCP-URL", "X-MCP-Type", "X-MCP-Headers", "X-Refresh-Token", "X-API-Key"],
+    allow_headers=["Content-Type", "Authorization", "X-Project-Id", "X-MCP-URL", "X-MCP-Type", "X-MCP-Headers", "X-Refresh-Token", "X-API-Key", "Last-Event-ID", "X-Stream-Wire-Version", "Range", "If-Range", "If-None-Match"],
+    expose_headers=["X-Stream-Wire-Version", "ETag", "Content-Range", "Accept-Ranges"],
 )
 
 # Create a main API router
@@ -13,19 +13,64 @@ from utils.logger import logger, structlog
 import dramatiq
 import uuid
 from agentpress.thread_manager import ThreadManager
+from agentpress.stream_event import encode_event
 from services.supabase import DBConnection
 from services import redis
 from dramatiq.brokers.redis import RedisBroker
 import os
-from services.langfuse import langfuse
+import time
+from dramatiq.asyncio import get_event_loop_thread
+from services.tracing import tracer
+from services.llm_transport import llm_http_pool
+from services.run_stream import RunStreamPublisher
+from services.run_control import run_control
+from services.run_admission import RunSlot, run_admission
+from services import run_registry, run_dispatch, run_archive, run_limits, postgres
+from services.postgres import pg_pool
+from services.run_checkpoint import RunCheckpointer, run_lock_key
+from agent.versioning import version_cache
+from agentpress.cancellation import CancellationScope
 from utils.retry import retry
+from utils.config import config
 
 import sentry_sdk
 from typing import Dict, Any
 
 redis_host = os.getenv('REDIS_HOST', 'redis')
 redis_port = int(os.getenv('REDIS_PORT', 6379))
-redis_broker = RedisBroker(host=redis_host, port=redis_port, middleware=[dramatiq.middleware.AsyncIO()])
+
+
+# Cancellation reason for runs interrupted so another worker can resume them
+HANDOFF_REASON = "worker draining"
+
+
+class DrainRunsMiddleware(dramatiq.Middleware):
+    """Let active agent runs finish, or hand them to another worker, before the worker stops."""
+
+    def before_worker_shutdown(self, broker, worker):
+        try:
+            get_event_loop_thread().run_coroutine(_drain_runs(config.WORKER_DRAIN_TIMEOUT_SECONDS))
+        except Exception as e:
+            logger.error(f"Failed to drain active agent runs: {e}")
+
+
+async def _drain_runs(timeout: int):
+    deadline = time.monotonic() + timeout
+    while run_control.active_runs() and time.monotonic() < deadline:
+        await asyncio.sleep(1)
+    # Runs still going are checkpointed after every step; stop them and re-send their messages
+    handed_off = run_control.cancel_all(HANDOFF_REASON)
+    if handed_off:
+        logger.info(f"Handing {handed_off} active agent runs to another worker")
+    deadline = time.monotonic() + 30
+    while run_control.active_runs() and time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+    if run_control.active_runs():
+        logger.warning(f"Worker shutting down with {run_control.active_runs()} agent runs still active")
+
+
+# DrainRunsMiddleware must come first so it runs before AsyncIO stops the event loop
+redis_broker = RedisBroker(host=redis_host, port=redis_port, middleware=[DrainRunsMiddleware(), dramatiq.middleware.AsyncIO()])
 
 dramatiq.set_broker(redis_broker)
 
@@ -33,6 +78,8 @@ dramatiq.set_broker(redis_broker)
 _initialized = False
 db = DBConnection()
 instance_id = "single"
+# Dispatch lanes whose runs were left queued for lack of a free slot
+_deferred_lanes = set()
 
 async def initialize():
     """Initialize the agent API with resources from the main API."""
@@ -42,6 +89,8 @@ async def initialize():
         instance_id = str(uuid.uuid4())[:8]
     await retry(lambda: redis.initialize_async())
     await db.initialize()
+    await llm_http_pool.start()
+    await pg_pool.start()
 
     _initialized = True
     logger.info(f"Initialized agent API with instance ID: {instance_id}")
@@ -82,23 +131,159 @@ async def run_agent_background(
         logger.critical(f"Failed to initialize Redis connection: {e}")
         raise e
 
-    # Idempotency check: prevent duplicate runs
-    run_lock_key = f"agent_run_lock:{agent_run_id}"
+    await _start_run(
+        run_dispatch.INTERACTIVE,
+        agent_run_id=agent_run_id, thread_id=thread_id, instance_id=instance_id,
+        project_id=project_id, model_name=model_name,
+        enable_thinking=enable_thinking, reasoning_effort=reasoning_effort,
+        stream=stream, enable_context_manager=enable_context_manager,
+        agent_config=agent_config, is_agent_builder=is_agent_builder,
+        target_agent_id=target_agent_id,
+    )
+
+@dramatiq.actor(queue_name="agent_runs_interactive", priority=0)
+async def dispatch_interactive_run():
+    """Start the next queued agent run, interactive lane first."""
+    await _dispatch_next()
+
+@dramatiq.actor(queue_name="agent_runs_background", priority=100)
+async def dispatch_background_run():
+    """Start the next queued agent run, interactive lane first."""
+    await _dispatch_next()
+
+def send_dispatch(lane: str):
+    """Signal the worker that a run is queued on lane."""
+    actor = dispatch_interactive_run if lane == run_dispatch.INTERACTIVE else dispatch_background_run
+    actor.send()
+
+async def dispatch_agent_run(lane: str, account_id: str, weight: int = 1, **run_kwargs):
+    """Queue an agent run on a priority lane and signal the worker to dispatch it."""
+    await run_dispatch.enqueue(lane, account_id, run_kwargs, weight=weight)
+    send_dispatch(lane)
+
+async def _dispatch_next():
+    structlog.contextvars.clear_contextvars()
+    try:
+        await initialize()
+    except Exception as e:
+        logger.critical(f"Failed to initialize Redis connection: {e}")
+        raise e
+
+    if not config.WORKER_ASYNC_RUNS_ENABLED:
+        job = await run_dispatch.pop_next()
+        if job is None:
+            logger.debug("No agent run queued")
+            return
+        await _start_dispatched_run(job)
+        return
+
+    # Take a slot before taking a job, so a run is only popped once it can
+    # start: a job waiting for capacity stays queued (and out of the requeuer's
+    # reach) instead of holding this thread. A lane without capacity is
+    # dispatched again when one of this process's runs frees a slot.
+    for lane in run_dispatch.LANES:
+        slot = run_admission.try_admit(f"dispatch:{uuid.uuid4()}", reserved_slots=_reserved_slots(lane))
+        if slot is None:
+            logger.debug(f"No capacity for the {lane} lane; leaving its runs queued")
+            _deferred_lanes.add(lane)
+            return
+        job = await run_dispatch.pop(lane)
+        if job is None:
+            await run_admission.unreserve(slot)
+            continue
+        run_admission.rekey(slot, job.run_kwargs["agent_run_id"], job.wait_ms / 1000)
+        await _start_dispatched_run(job, slot=slot)
+        return
+    logger.debug("No agent run queued")
+
+async def _start_dispatched_run(job: run_dispatch.DispatchJob, slot: Optional[RunSlot] = None):
+    run_kwargs = dict(job.run_kwargs)
+    request_id = run_kwargs.pop("request_id", None)
+    structlog.contextvars.bind_contextvars(
+        agent_run_id=run_kwargs.get("agent_run_id"),
+        thread_id=run_kwargs.get("thread_id"),
+        request_id=request_id,
+    )
+    logger.info(f"Dispatching agent run {run_kwargs.get('agent_run_id')} from the {job.lane} lane after {job.wait_ms}ms in queue")
+    await _start_run(job.lane, slot=slot, dispatch_job=job, **run_kwargs)
+
+def _reserved_slots(lane: str) -> int:
+    """Background runs leave some slots free so interactive runs are not queued behind a batch."""
+    return 0 if lane == run_dispatch.INTERACTIVE else config.WORKER_INTERACTIVE_RESERVED_RUNS
+
+def _redispatch_deferred(_task: asyncio.Task):
+    """Signal the lanes that were left queued for lack of capacity now that a slot is free."""
+    while _deferred_lanes:
+        send_dispatch(_deferred_lanes.pop())
+
+async def _start_run(lane: str, slot: Optional[RunSlot] = None, **run_kwargs):
+    if not config.WORKER_ASYNC_RUNS_ENABLED:
+        await _run_agent_background(**run_kwargs)
+        return
+
+    # Hand the run to the event loop once admitted. The message is acked only
+    # after the run has claimed its lock, registered and saved a first
+    # checkpoint: a worker lost before that gets the message redelivered, one
+    # lost after it leaves a checkpoint for the sweeper to resume.
+    claimed = asyncio.get_running_loop().create_future()
+    run = _run_agent_background(**run_kwargs, claimed=claimed)
+    if slot is None:
+        try:
+            slot = await run_admission.admit(run_kwargs["agent_run_id"], reserved_slots=_reserved_slots(lane))
+        except BaseException:
+            run.close()
+            raise
+    task = run_admission.spawn(slot, run)
+    task.add_done_callback(_redispatch_deferred)
+    await asyncio.wait({task, claimed}, return_when=asyncio.FIRST_COMPLETED)
+
+async def _run_agent_background(
+    agent_run_id: str,
+    thread_id: str,
+    instance_id: str,
+    project_id: str,
+    model_name: str,
+    enable_thinking: Optional[bool],
+    reasoning_effort: Optional[str],
+    stream: bool,
+    enable_context_manager: bool,
+    agent_config: Optional[dict] = None,
+    is_agent_builder: Optional[bool] = False,
+    target_agent_id: Optional[str] = None,
+    dispatch_job: Optional[run_dispatch.DispatchJob] = None,
+    claimed: Optional[asyncio.Future] = None,
+):
+    run_kwargs = dict(
+        agent_run_id=agent_run_id, thread_id=thread_id, instance_id=instance_id,
+        project_id=project_id, model_name=model_name,
+        enable_thinking=enable_thinking, reasoning_effort=reasoning_effort,
+        stream=stream, enable_context_manager=enable_context_manager,
+        agent_config=agent_config, is_agent_builder=is_agent_builder,
+        target_agent_id=target_agent_id,
+    )
+
+    # Idempotency check: prevent duplicate runs. The lock is refreshed while the run
+    # is alive, so it expires soon after a worker dies and the run can be resumed.
+    lock_key = run_lock_key(agent_run_id)
     
     # Try to acquire a lock for this agent run
-    lock_acquired = await redis.set(run_lock_key, instance_id, nx=True, ex=redis.REDIS_KEY_TTL)
+    lock_acquired = await redis.set(lock_key, instance_id, nx=True, ex=config.RUN_LOCK_TTL_SECONDS)
     
     if not lock_acquired:
         # Check if the run is already being handled by another instance
-        existing_instance = await redis.get(run_lock_key)
+        existing_instance = await redis.get(lock_key)
         if existing_instance:
             logger.info(f"Agent run {agent_run_id} is already being processed by instance {existing_instance.decode() if isinstance(existing_instance, bytes) else existing_instance}. Skipping duplicate execution.")
+            await _ack_dispatch(dispatch_job)
+            _signal_claimed(claimed)
             return
         else:
             # Lock exists but no value, try to acquire again
-            lock_acquired = await redis.set(run_lock_key, instance_id, nx=True, ex=redis.REDIS_KEY_TTL)
+            lock_acquired = await redis.set(lock_key, instance_id, nx=True, ex=config.RUN_LOCK_TTL_SECONDS)
             if not lock_acquired:
                 logger.info(f"Agent run {agent_run_id} is already being processed by another instance. Skipping duplicate execution.")
+                await _ack_dispatch(dispatch_job)
+                _signal_claimed(claimed)
                 return
 
     sentry.sentry.set_tag("thread_id", thread_id)
@@ -115,79 +300,94 @@ async def run_agent_background(
         "target_agent_id": target_agent_id,
     })
     
-    effective_model = model_name
-    if model_name == "anthropic/claude-sonnet-4-20250514" and agent_config and agent_config.get('model'):
-        agent_model = agent_config['model']
-        from utils.constants import MODEL_NAME_ALIASES
-        resolved_agent_model = MODEL_NAME_ALIASES.get(agent_model, agent_model)
-        effective_model = resolved_agent_model
-        logger.info(f"Using model from agent config: {agent_model} -> {effective_model} (no user selection)")
-    else:
-        from utils.constants import MODEL_NAME_ALIASES
-        effective_model = MODEL_NAME_ALIASES.get(model_name, model_name)
-        if model_name != "anthropic/claude-sonnet-4-20250514":
-            logger.info(f"Using user-selected model: {model_name} -> {effective_model}")
-        else:
-            logger.info(f"Using default model: {effective_model}")
-    
-    logger.info(f"🚀 Using model: {effective_model} (thinking: {enable_thinking}, reasoning_effort: {reasoning_effort})")
-    if agent_config:
-        logger.info(f"Using custom agent: {agent_config.get('name', 'Unknown')}")
-
     client = await db.client
     start_time = datetime.now(timezone.utc)
     total_responses = 0
-    pubsub = None
-    stop_checker = None
-    stop_signal_received = False
+    publisher = RunStreamPublisher(agent_run_id)
+    scope = CancellationScope(agent_run_id)
+    checkpointer = RunCheckpointer(agent_run_id, run_kwargs)
+    final_status = "running"
+    error_message = None
 
     # Define Redis keys and channels
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    response_channel = f"agent_run:{agent_run_id}:new_response"
-    instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id}"
     global_control_channel = f"agent_run:{agent_run_id}:control"
-    instance_active_key = f"active_run:{instance_id}:{agent_run_id}"
 
-    async def check_for_stop_signal():
-        nonlocal stop_signal_received
-        if not pubsub: return
-        try:
-            while not stop_signal_received:
-                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=0.5)
-                if message and message.get("type") == "message":
-                    data = message.get("data")
-                    if isinstance(data, bytes): data = data.decode('utf-8')
-                    if data == "STOP":
-                        logger.info(f"Received STOP signal for agent run {agent_run_id} (Instance: {instance_id})")
-                        stop_signal_received = True
-                        break
-                # Periodically refresh the active run key TTL
-                if total_responses % 50 == 0: # Refresh every 50 responses or so
-                    try: await redis.expire(instance_active_key, redis.REDIS_KEY_TTL)
-                    except Exception as ttl_err: logger.warning(f"Failed to refresh TTL for {instance_active_key}: {ttl_err}")
-                await asyncio.sleep(0.1) # Short sleep to prevent tight loop
-        except asyncio.CancelledError:
-            logger.info(f"Stop signal checker cancelled for {agent_run_id} (Instance: {instance_id})")
-        except Exception as e:
-            logger.error(f"Error in stop signal checker for {agent_run_id}: {e}", exc_info=True)
-            stop_signal_received = True # Stop the run if the checker fails
+    async def consume_responses(agent_gen):
+        nonlocal final_status, error_message, total_responses
+        # Tool tasks and sandbox commands started from here find the scope via current_scope()
+        scope.enter()
+        slot = run_admission.get(agent_run_id)
+        async for response in agent_gen:
+            # Store response in Redis list and publish notification
+            # Serialized exactly once here; StreamEvents cache their encoding.
+            # Waits while the publisher queue is full, slowing the agent to Redis speed.
+            payload = encode_event(response)
+            await publisher.publish(payload)
+            total_responses += 1
+            if slot:
+                slot.charge(len(payload))
+
+            # Let other runs on this loop proceed when chunks arrive faster than we can yield on I/O
+            if total_responses % config.WORKER_YIELD_EVERY_RESPONSES == 0:
+                await asyncio.sleep(0)
+
+            # Periodically refresh the active run key and registry TTLs
+            if total_responses % 50 == 0:
+                try: await run_registry.refresh_run(agent_run_id, instance_id)
+                except Exception as ttl_err: logger.warning(f"Failed to refresh registry TTL for {agent_run_id}: {ttl_err}")
+
+            # Check for agent-signaled completion or error
+            if response.get('type') == 'status':
+                 status_val = response.get('status')
+                 if status_val in ['completed', 'failed', 'stopped']:
+                     logger.info(f"Agent run {agent_run_id} finished via status message: {status_val}")
+                     final_status = status_val
+                     if status_val == 'failed' or status_val == 'stopped':
+                         error_message = response.get('message', f"Run ended with status: {status_val}")
+                     await publisher.flush()
+                     break
 
-    trace = langfuse.trace(name="agent_run", id=agent_run_id, session_id=thread_id, metadata={"project_id": project_id, "instance_id": instance_id})
+    trace = tracer.trace(name="agent_run", id=agent_run_id, session_id=thread_id, metadata={"project_id": project_id, "instance_id": instance_id})
+    lock_refresher = asyncio.create_task(_refresh_run_lock(agent_run_id))
     try:
-        # Setup Pub/Sub listener for control signals
-        pubsub = await redis.create_pubsub()
+        # STOP on either control channel cancels the scope through the shared subscriber
         try:
-            await retry(lambda: pubsub.subscribe(instance_control_channel, global_control_channel))
+            await retry(lambda: run_control.register(agent_run_id, instance_id, scope))
         except Exception as e:
             logger.error(f"Redis failed to subscribe to control channels: {e}", exc_info=True)
             raise e
 
-        logger.debug(f"Subscribed to control channels: {instance_control_channel}, {global_control_channel}")
-        stop_checker = asyncio.create_task(check_for_stop_signal())
+        # Register the run on this instance (active run key + registry sets)
+        await run_registry.claim_run(agent_run_id, instance_id)
+        # Claimed: from here on a lost worker is covered by the registry and the checkpoint sweeper
+        await _ack_dispatch(dispatch_job)
 
-        # Ensure active run key exists and has TTL
-        await redis.set(instance_active_key, "running", ex=redis.REDIS_KEY_TTL)
 
+        # Duplicate messages (sweeper, requeuer, redelivery) can arrive after the run
+        # finished or was stopped while no worker was executing it; only running runs go on
+        run_row = await client.table('agent_runs').select('status').eq('id', agent_run_id).execute()
+        run_status = run_row.data[0]['status'] if run_row.data else None
+        if run_status != 'running':
+            final_status = run_status or "missing"
+            logger.info(f"Not starting agent run {agent_run_id}: status is {run_status}")
+            return
+
+        # A checkpoint means an earlier worker was interrupted; continue from it
+        resume_state = await checkpointer.load()
+        if resume_state is not None:
+            trace.event(name="agent_run_resumed", level="DEFAULT", status_message=json.dumps(resume_state))
+        else:
+            # An empty first checkpoint, so the sweeper can restart the run if this worker dies
+            await checkpointer.save()
+        _signal_claimed(claimed)
+
+        # Runs are dispatched with a reference to the agent version; resolve it
+        # through the version cache
+        agent_config = await version_cache.load_agent_config(agent_config)
+        effective_model = _effective_model(model_name, agent_config)
+        logger.info(f"🚀 Using model: {effective_model} (thinking: {enable_thinking}, reasoning_effort: {reasoning_effort})")
+        if agent_config:
+            logger.info(f"Using custom agent: {agent_config.get('name', 'Unknown')}")
 
         # Initialize agent generator
         agent_gen = run_agent(
@@ -198,36 +398,31 @@ async def run_agent_background(
             agent_config=agent_config,
             trace=trace,
             is_agent_builder=is_agent_builder,
-            target_agent_id=target_agent_id
+            target_agent_id=target_agent_id,
+            checkpointer=checkpointer,
+            resume_state=resume_state,
         )
 
-        final_status = "running"
-        error_message = None
-
-        pending_redis_operations = []
+        publisher.start()
 
-        async for response in agent_gen:
-            if stop_signal_received:
-                logger.info(f"Agent run {agent_run_id} stopped by signal.")
-                final_status = "stopped"
-                trace.span(name="agent_run_stopped").end(status_message="agent_run_stopped", level="WARNING")
-                break
-
-            # Store response in Redis list and publish notification
-            response_json = json.dumps(response)
-            pending_redis_operations.append(asyncio.create_task(redis.rpush(response_list_key, response_json)))
-            pending_redis_operations.append(asyncio.create_task(redis.publish(response_channel, "new")))
-            total_responses += 1
-
-            # Check for agent-signaled completion or error
-            if response.get('type') == 'status':
-                 status_val = response.get('status')
-                 if status_val in ['completed', 'failed', 'stopped']:
-                     logger.info(f"Agent run {agent_run_id} finished via status message: {status_val}")
-                     final_status = status_val
-                     if status_val == 'failed' or status_val == 'stopped':
-                         error_message = response.get('message', f"Run ended with status: {status_val}")
-                     break
+        # Run the agent in its own task so a stop can interrupt whatever it is awaiting
+        consumer = asyncio.create_task(consume_responses(agent_gen))
+        scope.attach(consumer)
+        try:
+            await consumer
+        except asyncio.CancelledError:
+            if not scope.cancelled:
+                raise
+
+        if scope.cancelled and scope.reason == HANDOFF_REASON:
+            # Keep the run 'running' for clients; another worker resumes it from the checkpoint
+            logger.info(f"Agent run {agent_run_id} interrupted for handoff after {total_responses} responses")
+            final_status = "handed_off"
+            trace.span(name="agent_run_handed_off").end(status_message="agent_run_handed_off")
+        elif scope.cancelled:
+            logger.info(f"Agent run {agent_run_id} stopped by signal.")
+            final_status = "stopped"
+            trace.span(name="agent_run_stopped").end(status_message="agent_run_stopped", level="WARNING")
 
         # If loop finished without explicit completion/error/stop signal, mark as completed
         if final_status == "running":
@@ -236,12 +431,11 @@ async def run_agent_background(
              logger.info(f"Agent run {agent_run_id} completed normally (duration: {duration:.2f}s, responses: {total_responses})")
              completion_message = {"type": "status", "status": "completed", "message": "Agent run completed successfully"}
              trace.span(name="agent_run_completed").end(status_message="agent_run_completed")
-             await redis.rpush(response_list_key, json.dumps(completion_message))
-             await redis.publish(response_channel, "new") # Notify about the completion message
+             await publisher.publish(encode_event(completion_message))
+             await publisher.flush()
 
-        # Fetch final responses from Redis for DB update
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
-        all_responses = [json.loads(r) for r in all_responses_json]
+        if final_status == "handed_off":
+            return
 
         # Update DB status
         await update_agent_run_status(client, agent_run_id, final_status, error=error_message)
@@ -266,20 +460,12 @@ async def run_agent_background(
         # Push error message to Redis list
         error_response = {"type": "status", "status": "error", "message": error_message}
         try:
-            await redis.rpush(response_list_key, json.dumps(error_response))
-            await redis.publish(response_channel, "new")
+            publisher.start()
+            await publisher.publish(encode_event(error_response))
+            await publisher.flush()
         except Exception as redis_err:
              logger.error(f"Failed to push error response to Redis for {agent_run_id}: {redis_err}")
 
-        # Fetch final responses (including the error)
-        all_responses = []
-        try:
-             all_responses_json = await redis.lrange(response_list_key, 0, -1)
-             all_responses = [json.loads(r) for r in all_responses_json]
-        except Exception as fetch_err:
-             logger.error(f"Failed to fetch responses from Redis after error for {agent_run_id}: {fetch_err}")
-             all_responses = [error_response] # Use the error message we tried to push
-
         # Update DB status
         await update_agent_run_status(client, agent_run_id, "failed", error=f"{error_message}\n{traceback_str}")
 
@@ -291,61 +477,92 @@ async def run_agent_background(
             logger.warning(f"Failed to publish ERROR signal: {str(e)}")
 
     finally:
-        # Cleanup stop checker task
-        if stop_checker and not stop_checker.done():
-            stop_checker.cancel()
-            try: await stop_checker
-            except asyncio.CancelledError: pass
-            except Exception as e: logger.warning(f"Error during stop_checker cancellation: {e}")
-
-        # Close pubsub connection
-        if pubsub:
+        _signal_claimed(claimed)
+        # Stop listening for control signals and release anything a cancelled run left behind
+        await run_control.unregister(agent_run_id)
+        await scope.close()
+        lock_refresher.cancel()
+        if final_status != "handed_off":
+            await checkpointer.clear()
+
+        # Write out anything still queued and stop the publisher
+        await publisher.close(timeout=30.0)
+
+        # Compact a finished run's responses into the archive, then set TTL on what stays in Redis
+        if final_status != "handed_off" and run_archive.enabled():
             try:
-                await pubsub.unsubscribe()
-                await pubsub.close()
-                logger.debug(f"Closed pubsub connection for {agent_run_id}")
+                await run_archive.archive_run(agent_run_id)
             except Exception as e:
-                logger.warning(f"Error closing pubsub for {agent_run_id}: {str(e)}")
-
-        # Set TTL on the response list in Redis
+                logger.warning(f"Failed to archive responses of agent run {agent_run_id}: {e}")
         await _cleanup_redis_response_list(agent_run_id)
 
-        # Remove the instance-specific active run key
-        await _cleanup_redis_instance_key(agent_run_id)
+        # Remove the run from this instance's registry
+        await _cleanup_redis_instance_key(agent_run_id, instance_id)
 
         # Clean up the run lock
         await _cleanup_redis_run_lock(agent_run_id)
 
-        # Wait for all pending redis operations to complete, with timeout
-        try:
-            await asyncio.wait_for(asyncio.gather(*pending_redis_operations), timeout=30.0)
-        except asyncio.TimeoutError:
-            logger.warning(f"Timeout waiting for pending Redis operations for {agent_run_id}")
+        if final_status == "handed_off":
+            resume_agent_run(run_kwargs)
+
+        release_ms = scope.release_latency_ms()
+        if release_ms is not None:
+            logger.info(f"Agent run {agent_run_id} released its worker slot {release_ms:.0f}ms after the stop request")
+            trace.event(name="agent_run_released_after_stop", level="DEFAULT", status_message=f"{release_ms:.0f}ms")
+
+        trace.finish()
+        llm_http_pool.log_stats()
 
         logger.info(f"Agent run background task fully completed for: {agent_run_id} (Instance: {instance_id}) with final status: {final_status}")
 
-async def _cleanup_redis_instance_key(agent_run_id: str):
-    """Clean up the instance-specific Redis key for an agent run."""
-    if not instance_id:
+def resume_agent_run(run_kwargs: Dict[str, Any]):
+    """Send a checkpointed run back to the worker queue; whichever worker takes it resumes it."""
+    run_agent_background.send(**run_kwargs)
+
+def _signal_claimed(claimed: Optional[asyncio.Future]):
+    """Let _start_run ack the run's message."""
+    if claimed is not None and not claimed.done():
+        claimed.set_result(None)
+
+async def _ack_dispatch(dispatch_job: Optional[run_dispatch.DispatchJob]):
+    """Tell the dispatch lanes that a run taken from them no longer needs requeuing."""
+    if dispatch_job is None:
+        return
+    try:
+        await run_dispatch.ack(dispatch_job.lane, dispatch_job.job_id)
+    except Exception as e:
+        logger.warning(f"Failed to ack dispatch job {dispatch_job.job_id}: {e}")
+
+async def _refresh_run_lock(agent_run_id: str):
+    """Keep the run lock alive while the run executes."""
+    while True:
+        await asyncio.sleep(config.RUN_LOCK_TTL_SECONDS / 3)
+        try:
+            await redis.expire(run_lock_key(agent_run_id), config.RUN_LOCK_TTL_SECONDS)
+        except Exception as e:
+            logger.warning(f"Failed to refresh run lock for {agent_run_id}: {e}")
+
+async def _cleanup_redis_instance_key(agent_run_id: str, run_instance_id: str):
+    """Release an agent run from the instance's run registry."""
+    if not run_instance_id:
         logger.warning("Instance ID not set, cannot clean up instance key.")
         return
-    key = f"active_run:{instance_id}:{agent_run_id}"
-    logger.debug(f"Cleaning up Redis instance key: {key}")
+    logger.debug(f"Releasing agent run {agent_run_id} from instance {run_instance_id} registry")
     try:
-        await redis.delete(key)
-        logger.debug(f"Successfully cleaned up Redis key: {key}")
+        await run_registry.release_run(agent_run_id, run_instance_id)
+        logger.debug(f"Successfully released agent run {agent_run_id} from instance {run_instance_id}")
     except Exception as e:
-        logger.warning(f"Failed to clean up Redis key {key}: {str(e)}")
+        logger.warning(f"Failed to release agent run {agent_run_id} from instance {run_instance_id}: {str(e)}")
 
 async def _cleanup_redis_run_lock(agent_run_id: str):
     """Clean up the run lock Redis key for an agent run."""
-    run_lock_key = f"agent_run_lock:{agent_run_id}"
-    logger.debug(f"Cleaning up Redis run lock key: {run_lock_key}")
+    lock_key = run_lock_key(agent_run_id)
+    logger.debug(f"Cleaning up Redis run lock key: {lock_key}")
     try:
-        await redis.delete(run_lock_key)
-        logger.debug(f"Successfully cleaned up Redis run lock key: {run_lock_key}")
+        await redis.delete(lock_key)
+        logger.debug(f"Successfully cleaned up Redis run lock key: {lock_key}")
     except Exception as e:
-        logger.warning(f"Failed to clean up Redis run lock key {run_lock_key}: {str(e)}")
+        logger.warning(f"Failed to clean up Redis run lock key {lock_key}: {str(e)}")
 
 # TTL for Redis response lists (24 hours)
 REDIS_RESPONSE_LIST_TTL = 3600 * 24
@@ -359,6 +576,21 @@ async def _cleanup_redis_response_list(agent_run_id: str):
     except Exception as e:
         logger.warning(f"Failed to set TTL on response list {response_list_key}: {str(e)}")
 
+def _effective_model(model_name: str, agent_config: Optional[dict]) -> str:
+    """The agent's own model unless the user picked one, with aliases resolved."""
+    from utils.constants import MODEL_NAME_ALIASES
+    if model_name == "anthropic/claude-sonnet-4-20250514" and agent_config and agent_config.get('model'):
+        agent_model = agent_config['model']
+        effective_model = MODEL_NAME_ALIASES.get(agent_model, agent_model)
+        logger.info(f"Using model from agent config: {agent_model} -> {effective_model} (no user selection)")
+        return effective_model
+    effective_model = MODEL_NAME_ALIASES.get(model_name, model_name)
+    if model_name != "anthropic/claude-sonnet-4-20250514":
+        logger.info(f"Using user-selected model: {model_name} -> {effective_model}")
+    else:
+        logger.info(f"Using default model: {effective_model}")
+    return effective_model
+
 async def update_agent_run_status(
     client,
     agent_run_id: str,
@@ -370,33 +602,21 @@ async def update_agent_run_status(
     Returns True if update was successful.
     """
     try:
-        update_data = {
-            "status": status,
-            "completed_at": datetime.now(timezone.utc).isoformat()
-        }
-
-        if error:
-            update_data["error"] = error
-
-
+        completed_at = datetime.now(timezone.utc).isoformat()
 
         # Retry up to 3 times
         for retry in range(3):
             try:
-                update_result = await client.table('agent_runs').update(update_data).eq("id", agent_run_id).execute()
-
-                if hasattr(update_result, 'data') and update_result.data:
-                    logger.info(f"Successfully updated agent run {agent_run_id} status to '{status}' (retry {retry})")
+                updated = await postgres.update_agent_run_status(client, agent_run_id, status, completed_at, error)
 
-                    # Verify the update
-                    verify_result = await client.table('agent_runs').select('status', 'completed_at').eq("id", agent_run_id).execute()
-                    if verify_result.data:
-                        actual_status = verify_result.data[0].get('status')
-                        completed_at = verify_result.data[0].get('completed_at')
-                        logger.info(f"Verified agent run update: status={actual_status}, completed_at={completed_at}")
+                if updated:
+                    # The updated row comes back with the update, so no separate verification read
+                    logger.info(f"Successfully updated agent run {agent_run_id} status to '{updated.get('status')}' at {updated.get('completed_at')} (retry {retry})")
+                    if status != "running":
+                        await run_limits.run_finished(agent_run_id)
                     return True
                 else:
-                    logger.warning(f"Database update returned no data for agent run {agent_run_id} on retry {retry}: {update_result}")
+                    logger.warning(f"Database update returned no data for agent run {agent_run_id} on retry {retry}")
                     if retry == 2:  # Last retry
                         logger.error(f"Failed to update agent run status after all retries: {agent_run_id}")
                         return False
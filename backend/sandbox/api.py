@@ -1,15 +1,18 @@
 import os
+import posixpath
 import urllib.parse
 from typing import Optional
 
 from fastapi import FastAPI, UploadFile, File, HTTPException, APIRouter, Form, Depends, Request
-from fastapi.responses import Response
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 from daytona_sdk import AsyncSandbox
 
-from sandbox.sandbox import get_or_start_sandbox, delete_sandbox
+from sandbox.sandbox import get_or_start_sandbox, delete_sandbox, forget_sandbox
+from sandbox.file_download import RangeNotSatisfiable, etag_matches, file_etag, open_file_stream, parse_range
 from utils.logger import logger
 from utils.auth_utils import get_optional_user_id
+from utils import access_cache
 from services.supabase import DBConnection
 
 # Initialize shared resources
@@ -69,25 +72,29 @@ def normalize_path(path: str) -> str:
 async def verify_sandbox_access(client, sandbox_id: str, user_id: Optional[str] = None):
     """
     Verify that a user has access to a specific sandbox based on account membership.
+
+    Granted access is cached briefly (see utils/access_cache.py), so browsing
+    a sandbox's files does not repeat the project and membership lookups.
     
     Args:
         client: The Supabase client
         sandbox_id: The sandbox ID to check access for
         user_id: The user ID to check permissions for. Can be None for public resource access.
         
-    Returns:
-        dict: Project data containing sandbox information
-        
     Raises:
         HTTPException: If the user doesn't have access to the sandbox or sandbox doesn't exist
     """
+    await access_cache.cached_access(
+        "sandbox", sandbox_id, user_id or "anonymous",
+        lambda: _check_sandbox_access(client, sandbox_id, user_id),
+    )
+
+async def _check_sandbox_access(client, sandbox_id: str, user_id: Optional[str]):
     # Find the project that owns this sandbox
-    project_result = await client.table('projects').select('*').filter('sandbox->>id', 'eq', sandbox_id).execute()
+    project_data = await access_cache.get_sandbox_project(client, sandbox_id)
     
-    if not project_result.data or len(project_result.data) == 0:
+    if not project_data:
         raise HTTPException(status_code=404, detail="Sandbox not found")
-    
-    project_data = project_result.data[0]
 
     if project_data.get('is_public'):
         return project_data
@@ -108,7 +115,10 @@ async def verify_sandbox_access(client, sandbox_id: str, user_id: Optional[str]
 
 async def get_sandbox_by_id_safely(client, sandbox_id: str) -> AsyncSandbox:
     """
-    Safely retrieve a sandbox object by its ID, using the project that owns it.
+    Safely retrieve a sandbox object by its ID.
+
+    Callers verify access with verify_sandbox_access first, which already
+    established that a project owns this sandbox.
     
     Args:
         client: The Supabase client
@@ -118,18 +128,8 @@ async def get_sandbox_by_id_safely(client, sandbox_id: str) -> AsyncSandbox:
         AsyncSandbox: The sandbox object
         
     Raises:
-        HTTPException: If the sandbox doesn't exist or can't be retrieved
+        HTTPException: If the sandbox can't be retrieved
     """
-    # Find the project that owns this sandbox
-    project_result = await client.table('projects').select('project_id').filter('sandbox->>id', 'eq', sandbox_id).execute()
-    
-    if not project_result.data or len(project_result.data) == 0:
-        logger.error(f"No project found for sandbox ID: {sandbox_id}")
-        raise HTTPException(status_code=404, detail="Sandbox not found - no project owns this sandbox ID")
-    
-    # project_id = project_result.data[0]['project_id']
-    # logger.debug(f"Found project {project_id} for sandbox {sandbox_id}")
-    
     try:
         # Get the sandbox
         sandbox = await get_or_start_sandbox(sandbox_id)
@@ -173,6 +173,7 @@ async def create_file(
         return {"status": "success", "created": True, "path": path}
     except Exception as e:
         logger.error(f"Error creating file in sandbox {sandbox_id}: {str(e)}")
+        forget_sandbox(sandbox_id)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/sandboxes/{sandbox_id}/files")
@@ -218,6 +219,7 @@ async def list_files(
         return {"files": [file.dict() for file in result]}
     except Exception as e:
         logger.error(f"Error listing files in sandbox {sandbox_id}: {str(e)}")
+        forget_sandbox(sandbox_id)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/sandboxes/{sandbox_id}/files/content")
@@ -227,7 +229,13 @@ async def read_file(
     request: Request = None,
     user_id: Optional[str] = Depends(get_optional_user_id)
 ):
-    """Read a file from the sandbox"""
+    """
+    Stream a file from the sandbox.
+
+    Supports single byte ranges (206/416) and conditional requests: the
+    response carries a strong ETag and If-None-Match is answered with 304
+    without downloading the file.
+    """
     # Normalize the path to handle UTF-8 encoding correctly
     original_path = path
     path = normalize_path(path)
@@ -244,10 +252,36 @@ async def read_file(
     try:
         # Get sandbox using the safer method
         sandbox = await get_sandbox_by_id_safely(client, sandbox_id)
+        if not posixpath.isabs(path):
+            path = posixpath.join(await sandbox.get_user_root_dir(), path)
+        
+        # Metadata alone answers conditional requests and sizes ranges
+        try:
+            info = await sandbox.fs.get_file_info(path)
+        except Exception as info_err:
+            logger.error(f"Error getting info of file {path} in sandbox {sandbox_id}: {str(info_err)}")
+            raise HTTPException(
+                status_code=404, 
+                detail=f"Failed to download file: {str(info_err)}"
+            )
+        if info.is_dir:
+            raise HTTPException(status_code=400, detail="Path is a directory")
+        
+        etag = file_etag(path, info.size, str(info.mod_time))
+        headers = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": "private, no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        
+        byte_range = None
+        if_range = request.headers.get("if-range")
+        if not if_range or if_range.strip() == etag:
+            try:
+                byte_range = parse_range(request.headers.get("range"), info.size)
+            except RangeNotSatisfiable:
+                return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{info.size}"})
         
-        # Read file directly - don't check existence first with a separate call
         try:
-            content = await sandbox.fs.download_file(path)
+            chunks = await open_file_stream(sandbox, path, info.size, byte_range)
         except Exception as download_err:
             logger.error(f"Error downloading file {path} from sandbox {sandbox_id}: {str(download_err)}")
             raise HTTPException(
@@ -255,25 +289,35 @@ async def read_file(
                 detail=f"Failed to download file: {str(download_err)}"
             )
         
-        # Return a Response object with the content directly
         filename = os.path.basename(path)
-        logger.info(f"Successfully read file {filename} from sandbox {sandbox_id}")
+        logger.info(f"Streaming file {filename} ({info.size} bytes, range {byte_range}) from sandbox {sandbox_id}")
         
         # Ensure proper encoding by explicitly using UTF-8 for the filename in Content-Disposition header
         # This applies RFC 5987 encoding for the filename to support non-ASCII characters
         encoded_filename = filename.encode('utf-8').decode('latin-1')
-        content_disposition = f"attachment; filename*=UTF-8''{encoded_filename}"
+        headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{encoded_filename}"
+        
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{info.size}"
+            headers["Content-Length"] = str(end - start + 1)
+            status_code = 206
+        else:
+            headers["Content-Length"] = str(info.size)
+            status_code = 200
         
-        return Response(
-            content=content,
+        return StreamingResponse(
+            chunks,
+            status_code=status_code,
             media_type="application/octet-stream",
-            headers={"Content-Disposition": content_disposition}
+            headers=headers
         )
     except HTTPException:
         # Re-raise HTTP exceptions without wrapping
         raise
     except Exception as e:
         logger.error(f"Error reading file in sandbox {sandbox_id}: {str(e)}")
+        forget_sandbox(sandbox_id)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/sandboxes/{sandbox_id}/files")
@@ -304,6 +348,7 @@ async def delete_file(
         return {"status": "success", "deleted": True, "path": path}
     except Exception as e:
         logger.error(f"Error deleting file in sandbox {sandbox_id}: {str(e)}")
+        forget_sandbox(sandbox_id)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/sandboxes/{sandbox_id}")
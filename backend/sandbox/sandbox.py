@@ -1,3 +1,7 @@
+import asyncio
+import time
+from typing import Dict, Tuple
+
 from daytona_sdk import AsyncDaytona, DaytonaConfig, CreateSandboxFromSnapshotParams, AsyncSandbox, SessionExecuteRequest, Resources, SandboxState
 from dotenv import load_dotenv
 from utils.logger import logger
@@ -30,9 +34,30 @@ else:
 
 daytona = AsyncDaytona(daytona_config)
 
+# Handles of started sandboxes, reused for SANDBOX_HANDLE_CACHE_TTL_SECONDS so
+# bursts of file requests don't each ask Daytona for the sandbox state
+_started_sandboxes: Dict[str, Tuple[float, AsyncSandbox]] = {}
+# One lookup (and start) per sandbox at a time; concurrent callers share it
+_pending_sandboxes: Dict[str, "asyncio.Future[AsyncSandbox]"] = {}
+
+def forget_sandbox(sandbox_id: str) -> None:
+    """Drop the cached handle, e.g. after an operation on the sandbox failed."""
+    _started_sandboxes.pop(sandbox_id, None)
+
 async def get_or_start_sandbox(sandbox_id: str) -> AsyncSandbox:
     """Retrieve a sandbox by ID, check its state, and start it if needed."""
-    
+    cached = _started_sandboxes.get(sandbox_id)
+    if cached and time.monotonic() - cached[0] < config.SANDBOX_HANDLE_CACHE_TTL_SECONDS:
+        return cached[1]
+
+    pending = _pending_sandboxes.get(sandbox_id)
+    if pending is None:
+        pending = asyncio.ensure_future(_fetch_or_start_sandbox(sandbox_id))
+        _pending_sandboxes[sandbox_id] = pending
+        pending.add_done_callback(lambda _: _pending_sandboxes.pop(sandbox_id, None))
+    return await asyncio.shield(pending)
+
+async def _fetch_or_start_sandbox(sandbox_id: str) -> AsyncSandbox:
     logger.info(f"Getting or starting sandbox with ID: {sandbox_id}")
 
     try:
@@ -54,6 +79,8 @@ async def get_or_start_sandbox(sandbox_id: str) -> AsyncSandbox:
                 logger.error(f"Error starting sandbox: {e}")
                 raise e
         
+        if sandbox.state == SandboxState.STARTED:
+            _started_sandboxes[sandbox_id] = (time.monotonic(), sandbox)
         logger.info(f"Sandbox {sandbox_id} is ready")
         return sandbox
         
@@ -128,6 +155,7 @@ async def create_sandbox(password: str, project_id: str = None) -> AsyncSandbox:
 async def delete_sandbox(sandbox_id: str) -> bool:
     """Delete a sandbox by its ID."""
     logger.info(f"Deleting sandbox with ID: {sandbox_id}")
+    forget_sandbox(sandbox_id)
 
     try:
         # Get the sandbox
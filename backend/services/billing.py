@@ -16,7 +16,8 @@ from utils.config import config, EnvMode
 from services.supabase import DBConnection
 from utils.auth_utils import get_current_user_id_from_jwt
 from pydantic import BaseModel
-from utils.constants import MODEL_ACCESS_TIERS, MODEL_NAME_ALIASES, HARDCODED_MODEL_PRICES
+from utils.constants import MODEL_ACCESS_TIERS, MODEL_NAME_ALIASES
+from utils.model_registry import get_model_capabilities
 from litellm.cost_calculator import cost_per_token
 import time
 
@@ -105,9 +106,9 @@ def get_model_pricing(model: str) -> tuple[float, float] | None:
     Returns:
         Tuple of (input_cost_per_million_tokens, output_cost_per_million_tokens) or None if not found
     """
-    if model in HARDCODED_MODEL_PRICES:
-        pricing = HARDCODED_MODEL_PRICES[model]
-        return pricing["input_cost_per_million_tokens"], pricing["output_cost_per_million_tokens"]
+    capabilities = get_model_capabilities(model)
+    if capabilities.known:
+        return capabilities.pricing
     return None
 
 
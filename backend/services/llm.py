@@ -19,6 +19,8 @@ import litellm
 from litellm.files.main import ModelResponse
 from utils.logger import logger
 from utils.config import config
+from utils.model_registry import get_model_capabilities
+from services.llm_transport import llm_http_pool
 
 # litellm.set_verbose=True
 # Let LiteLLM auto-adjust params and drop unsupported ones (e.g., GPT-5 temperature!=1)
@@ -216,7 +218,7 @@ def prepare_params(
         if "service_tier" not in extra_body:
             extra_body["service_tier"] = "priority"
         params["extra_body"] = extra_body
-    if "claude" in effective_model_name.lower() or "anthropic" in effective_model_name.lower():
+    if get_model_capabilities(effective_model_name).supports_prompt_caching:
         messages = params["messages"] # Direct reference, modification affects params
 
         # Ensure messages is a list
@@ -337,6 +339,16 @@ async def make_llm_api_call(
         enable_thinking=enable_thinking,
         reasoning_effort=reasoning_effort
     )
+    # Reuse the process-wide provider connection pools unless the caller overrides credentials
+    if not api_key and not api_base:
+        pooled_client = llm_http_pool.client_for(model_name)
+        if pooled_client is not None:
+            params["client"] = pooled_client
+        for fallback in params.get("fallbacks", []):
+            fallback_client = llm_http_pool.client_for(fallback["model"])
+            if fallback_client is not None:
+                fallback["client"] = fallback_client
+
     last_error = None
     for attempt in range(MAX_RETRIES):
         try:
@@ -0,0 +1,203 @@
+"""
+Shared HTTP transport for LLM provider calls.
+
+Without an explicit client litellm sets up HTTP clients on its own, so a
+worker process that makes thousands of short completions an hour keeps
+repeating TLS handshakes to the same handful of provider hosts. This module
+owns one long-lived, keep-alive (and HTTP/2 when `h2` is installed) httpx
+client per provider, each bounded by LLM_HTTP_MAX_CONNECTIONS_PER_PROVIDER
+connections, and hands litellm the matching client object for each call.
+
+Usage:
+    from services.llm_transport import llm_http_pool
+
+    await llm_http_pool.start()                # once per process
+    client = llm_http_pool.client_for(model)   # None -> litellm default transport
+    llm_http_pool.stats()                      # pool utilisation per provider
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import httpx
+
+from utils.config import config
+from utils.logger import logger
+
+# Providers whose litellm integration is built on the OpenAI SDK take an
+# AsyncOpenAI client; native integrations take a litellm AsyncHTTPHandler.
+OPENAI_SDK_PROVIDERS = {
+    "openai": ("OPENAI_API_KEY", "https://api.openai.com/v1"),
+    "openrouter": ("OPENROUTER_API_KEY", None),
+    "xai": ("XAI_API_KEY", "https://api.x.ai/v1"),
+}
+HTTP_HANDLER_PROVIDERS = {"anthropic", "gemini"}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class _TrackedStream(httpx.AsyncByteStream):
+    """Response body that reports when it is closed, i.e. the request is over."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._on_close is not None:
+                self._on_close()
+                self._on_close = None
+
+
+class _CountingTransport(httpx.AsyncBaseTransport):
+    """Connection-pooling transport that counts the requests currently in flight."""
+
+    def __init__(self, **kwargs):
+        self._transport = httpx.AsyncHTTPTransport(**kwargs)
+        self.in_flight = 0
+
+    def _finished(self) -> None:
+        self.in_flight -= 1
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.in_flight += 1
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self.in_flight -= 1
+            raise
+        response.stream = _TrackedStream(response.stream, self._finished)
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+@dataclass
+class _ProviderPool:
+    provider: str
+    http_client: httpx.AsyncClient
+    transport: _CountingTransport
+    litellm_client: Any
+    requests: int = 0
+
+
+class LLMHTTPPool:
+    """Per-process registry of pooled provider clients."""
+
+    def __init__(self):
+        self._pools: Dict[str, _ProviderPool] = {}
+        self._lock = asyncio.Lock()
+        self._started = False
+        self.http2 = False
+
+    @property
+    def started(self) -> bool:
+        return self._started
+
+    def _new_http_client(self) -> Tuple[httpx.AsyncClient, _CountingTransport]:
+        limits = httpx.Limits(
+            max_connections=config.LLM_HTTP_MAX_CONNECTIONS_PER_PROVIDER,
+            max_keepalive_connections=config.LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=config.LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS,
+        )
+        transport = _CountingTransport(limits=limits, http2=self.http2)
+        # Streams can legitimately stay open for minutes; only bound connect and pool waits
+        timeout = httpx.Timeout(600.0, connect=10.0, pool=30.0)
+        return httpx.AsyncClient(transport=transport, timeout=timeout), transport
+
+    def _build_openai_client(self, provider: str, http_client: httpx.AsyncClient) -> Optional[Any]:
+        key_name, default_base = OPENAI_SDK_PROVIDERS[provider]
+        api_key = getattr(config, key_name, None)
+        if not api_key:
+            return None
+        base_url = config.OPENROUTER_API_BASE if provider == "openrouter" else default_base
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+
+    async def _build_handler_client(self, http_client: httpx.AsyncClient) -> Optional[Any]:
+        from litellm.llms.custom_httpx.http_handler import AsyncHTTPHandler
+        handler = AsyncHTTPHandler()
+        # Swap litellm's private client for the pooled one
+        previous = getattr(handler, "client", None)
+        handler.client = http_client
+        if previous is not None:
+            await previous.aclose()
+        return handler
+
+    async def start(self) -> None:
+        """Create the provider pools. Safe to call repeatedly."""
+        if not config.LLM_HTTP_POOL_ENABLED:
+            return
+        async with self._lock:
+            if self._started:
+                return
+            self.http2 = config.LLM_HTTP2_ENABLED and _http2_available()
+            for provider in list(OPENAI_SDK_PROVIDERS) + sorted(HTTP_HANDLER_PROVIDERS):
+                http_client, transport = self._new_http_client()
+                try:
+                    if provider in OPENAI_SDK_PROVIDERS:
+                        litellm_client = self._build_openai_client(provider, http_client)
+                    else:
+                        litellm_client = await self._build_handler_client(http_client)
+                except Exception as e:
+                    logger.warning(f"Could not build pooled client for provider {provider}: {e}")
+                    litellm_client = None
+                if litellm_client is None:
+                    await http_client.aclose()
+                    continue
+                self._pools[provider] = _ProviderPool(provider, http_client, transport, litellm_client)
+            self._started = True
+            logger.info(f"LLM HTTP pool started for providers {sorted(self._pools)} (http2={self.http2}, max_connections_per_provider={config.LLM_HTTP_MAX_CONNECTIONS_PER_PROVIDER})")
+
+    async def close(self) -> None:
+        async with self._lock:
+            for pool in self._pools.values():
+                try:
+                    await pool.http_client.aclose()
+                except Exception as e:
+                    logger.warning(f"Error closing LLM HTTP pool for {pool.provider}: {e}")
+            self._pools.clear()
+            self._started = False
+
+    def client_for(self, model_name: str) -> Optional[Any]:
+        """Return the pooled litellm client for model_name's provider, if one exists."""
+        if not self._started or "/" not in model_name:
+            return None
+        pool = self._pools.get(model_name.split("/", 1)[0])
+        if not pool:
+            return None
+        pool.requests += 1
+        return pool.litellm_client
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Snapshot of usage per provider pool."""
+        return {
+            provider: {
+                "in_flight": pool.transport.in_flight,
+                "max_connections": config.LLM_HTTP_MAX_CONNECTIONS_PER_PROVIDER,
+                "requests": pool.requests,
+            }
+            for provider, pool in self._pools.items()
+        }
+
+    def log_stats(self) -> None:
+        if self._pools:
+            logger.info(f"LLM HTTP pool utilisation: {self.stats()}")
+
+
+llm_http_pool = LLMHTTPPool()
@@ -0,0 +1,300 @@
+"""
+Optional direct Postgres path for the hottest statements.
+
+Every DBConnection query is an HTTP request that PostgREST parses, authorizes
+and translates to SQL. For the statements executed on every agent step this
+module can use a bounded asyncpg pool instead, connected with DATABASE_URL:
+
+- message insert and the LLM message select of a thread
+- agent_runs status updates
+- thread lookups by id
+
+asyncpg prepares each statement once per connection and reuses it
+(DB_POOL_STATEMENT_CACHE_SIZE; 0 disables this behind a transaction-mode
+pooler). The backend talks to PostgREST with the service role, which bypasses
+row level security, and the database owner role used here does too; triggers
+and defaults apply the same way. Rows are returned in PostgREST's shape: JSON
+columns decoded, uuids as strings, timestamps as ISO 8601 strings.
+
+Without DATABASE_URL, or while no pooled connection can be
+acquired, each helper runs the equivalent PostgREST query. Statements that
+fail on a pooled connection raise; they are not retried over PostgREST, since
+a write may already have been applied.
+
+Usage:
+    from services import postgres
+    from services.postgres import pg_pool
+
+    await pg_pool.start()                       # once per process
+    await pg_pool.listen(channel, callback)     # LISTEN on a dedicated connection, reconnected if lost
+    row = await postgres.insert_message(client, data)
+    thread = await postgres.get_thread(client, thread_id)
+"""
+
+import asyncio
+import json
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import asyncpg
+
+from utils.config import config
+from utils.logger import logger
+
+INSERT_MESSAGE = """
+INSERT INTO messages (thread_id, type, content, is_llm_message, metadata, agent_id, agent_version_id)
+VALUES ($1, $2, $3, $4, $5, $6, $7)
+RETURNING *
+"""
+
+SELECT_LLM_MESSAGES = """
+SELECT message_id, content FROM messages
+WHERE thread_id = $1 AND is_llm_message = TRUE
+ORDER BY created_at
+"""
+
+UPDATE_AGENT_RUN_STATUS = """
+UPDATE agent_runs SET status = $2, completed_at = $3, error = COALESCE($4, error)
+WHERE id = $1
+RETURNING status, completed_at
+"""
+
+SELECT_THREAD = "SELECT * FROM threads WHERE thread_id = $1"
+
+
+def _value(value: Any) -> Any:
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _row(record) -> Dict[str, Any]:
+    return {key: _value(value) for key, value in record.items()}
+
+
+async def _init_connection(conn) -> None:
+    for type_name in ("json", "jsonb"):
+        await conn.set_type_codec(type_name, encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+
+class PostgresPool:
+    """Per-process asyncpg pool, started only when DATABASE_URL is set."""
+
+    def __init__(self):
+        self._pool = None
+        self._listen_conn = None
+        self._listeners: Dict[str, Callable[[Optional[str]], None]] = {}
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.queries = 0
+        self.fallbacks = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._pool is not None
+
+    async def start(self) -> None:
+        """Create the pool. Safe to call repeatedly; a failure leaves PostgREST in use."""
+        if not config.DATABASE_URL:
+            return
+        async with self._lock:
+            if self._pool is not None:
+                return
+            try:
+                self._pool = await asyncpg.create_pool(
+                    config.DATABASE_URL,
+                    min_size=config.DB_POOL_MIN_SIZE,
+                    max_size=config.DB_POOL_MAX_SIZE,
+                    statement_cache_size=config.DB_POOL_STATEMENT_CACHE_SIZE,
+                    init=_init_connection,
+                )
+            except Exception as e:
+                logger.error(f"Failed to create Postgres pool, using PostgREST only: {e}")
+                return
+            logger.info(f"Postgres pool started (min_size={config.DB_POOL_MIN_SIZE}, max_size={config.DB_POOL_MAX_SIZE})")
+
+    async def listen(self, channel: str, callback: Callable[[Optional[str]], None]) -> bool:
+        """
+        Call callback(payload) for each NOTIFY on channel. Returns False without a pool.
+
+        Listening holds a dedicated connection, so DATABASE_URL must not point
+        at a transaction-mode pooler for this to work. If the connection is
+        lost it is reopened in the background, and every callback is called
+        with None once listening again, since notifications may have been
+        missed in between.
+        """
+        if self._pool is None:
+            return False
+        self._listeners[channel] = callback
+        if self._listen_conn is None:
+            try:
+                await self._connect_listener()
+            except Exception:
+                self._schedule_reconnect()
+                raise
+        else:
+            await self._add_listener(self._listen_conn, channel, callback)
+        return True
+
+    @staticmethod
+    async def _add_listener(conn, channel: str, callback: Callable[[Optional[str]], None]) -> None:
+        await conn.add_listener(channel, lambda _conn, _pid, _channel, payload: callback(payload))
+
+    async def _connect_listener(self) -> None:
+        conn = await asyncpg.connect(config.DATABASE_URL)
+        conn.add_termination_listener(self._on_listener_lost)
+        for channel, callback in self._listeners.items():
+            await self._add_listener(conn, channel, callback)
+        self._listen_conn = conn
+
+    def _on_listener_lost(self, conn) -> None:
+        if conn is not self._listen_conn:
+            return
+        self._listen_conn = None
+        logger.warning(f"Postgres listener connection lost; reconnecting to {', '.join(self._listeners)}")
+        self._schedule_reconnect()
+
+    def _schedule_reconnect(self) -> None:
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.create_task(self._reconnect_listener())
+
+    async def _reconnect_listener(self) -> None:
+        delay = 1.0
+        while self._pool is not None and self._listen_conn is None:
+            await asyncio.sleep(delay)
+            try:
+                await self._connect_listener()
+            except Exception as e:
+                delay = min(delay * 2, 60.0)
+                logger.warning(f"Failed to reconnect Postgres listener, retrying in {delay:.0f}s: {e}")
+                continue
+            logger.info("Postgres listener reconnected")
+            for callback in self._listeners.values():
+                callback(None)
+
+    async def close(self) -> None:
+        async with self._lock:
+            if self._reconnect_task is not None:
+                self._reconnect_task.cancel()
+                self._reconnect_task = None
+            self._listeners.clear()
+            if self._listen_conn is not None:
+                conn, self._listen_conn = self._listen_conn, None
+                try:
+                    await conn.close()
+                except Exception as e:
+                    logger.warning(f"Error closing Postgres listener connection: {e}")
+            if self._pool is not None:
+                try:
+                    await self._pool.close()
+                except Exception as e:
+                    logger.warning(f"Error closing Postgres pool: {e}")
+                self._pool = None
+
+    async def acquire(self):
+        """A pooled connection, or None to fall back to PostgREST."""
+        if self._pool is None:
+            return None
+        try:
+            conn = await self._pool.acquire(timeout=config.DB_POOL_ACQUIRE_TIMEOUT_SECONDS)
+        except Exception as e:
+            self.fallbacks += 1
+            logger.warning(f"No Postgres pool connection available, falling back to PostgREST: {e}")
+            return None
+        self.queries += 1
+        return conn
+
+    async def release(self, conn) -> None:
+        await self._pool.release(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        if self._pool is None:
+            return {"enabled": False}
+        return {
+            "enabled": True,
+            "size": self._pool.get_size(),
+            "idle": self._pool.get_idle_size(),
+            "max_size": self._pool.get_max_size(),
+            "queries": self.queries,
+            "fallbacks": self.fallbacks,
+        }
+
+
+pg_pool = PostgresPool()
+
+
+async def insert_message(client, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Insert a messages row built like ThreadManager.add_message and return it."""
+    conn = await pg_pool.acquire()
+    if conn is not None:
+        try:
+            record = await conn.fetchrow(
+                INSERT_MESSAGE,
+                data['thread_id'], data['type'], data['content'], data.get('is_llm_message', True),
+                data.get('metadata') or {}, data.get('agent_id'), data.get('agent_version_id'),
+            )
+            return _row(record) if record else None
+        finally:
+            await pg_pool.release(conn)
+
+    result = await client.table('messages').insert(data).execute()
+    return result.data[0] if result.data else None
+
+
+async def get_llm_message_rows(client, thread_id: str) -> List[Dict[str, Any]]:
+    """message_id and content of the thread's LLM messages, oldest first."""
+    conn = await pg_pool.acquire()
+    if conn is not None:
+        try:
+            return [_row(record) for record in await conn.fetch(SELECT_LLM_MESSAGES, thread_id)]
+        finally:
+            await pg_pool.release(conn)
+
+    # Fetch messages in batches of 1000 to avoid overloading the database
+    rows = []
+    batch_size = 1000
+    offset = 0
+    while True:
+        result = await client.table('messages').select('message_id, content').eq('thread_id', thread_id).eq('is_llm_message', True).order('created_at').range(offset, offset + batch_size - 1).execute()
+        rows.extend(result.data or [])
+        if not result.data or len(result.data) < batch_size:
+            return rows
+        offset += batch_size
+
+
+async def update_agent_run_status(client, agent_run_id: str, status: str, completed_at: str, error: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Set a run's status and completion time (and error, if given). Returns the updated status and completed_at, None if no row matched."""
+    conn = await pg_pool.acquire()
+    if conn is not None:
+        try:
+            record = await conn.fetchrow(
+                UPDATE_AGENT_RUN_STATUS, agent_run_id, status, datetime.fromisoformat(completed_at), error or None,
+            )
+            return _row(record) if record else None
+        finally:
+            await pg_pool.release(conn)
+
+    update_data = {"status": status, "completed_at": completed_at}
+    if error:
+        update_data["error"] = error
+    result = await client.table('agent_runs').update(update_data).eq("id", agent_run_id).execute()
+    if not result.data:
+        return None
+    return {"status": result.data[0].get("status"), "completed_at": result.data[0].get("completed_at")}
+
+
+async def get_thread(client, thread_id: str) -> Optional[Dict[str, Any]]:
+    """The threads row with thread_id, or None."""
+    conn = await pg_pool.acquire()
+    if conn is not None:
+        try:
+            record = await conn.fetchrow(SELECT_THREAD, thread_id)
+            return _row(record) if record else None
+        finally:
+            await pg_pool.release(conn)
+
+    result = await client.table('threads').select('*').eq('thread_id', thread_id).execute()
+    return result.data[0] if result.data else None
@@ -0,0 +1,190 @@
+"""
+Admission control for agent runs sharing one worker event loop.
+
+With WORKER_ASYNC_RUNS_ENABLED the dramatiq actor only admits a run and
+schedules it as a task on the process event loop, so the number of concurrent
+runs per process is bounded by the limits below instead of by --threads:
+
+- WORKER_MAX_CONCURRENT_RUNS caps the runs executing at once;
+- WORKER_MAX_RSS_MB stops admitting new runs while the process is above it.
+
+Each admitted run gets a RunSlot that records its queue wait, the bytes it
+streamed and the process RSS at admission and release, which are logged when
+the run finishes. A lag monitor measures how late the loop wakes up, which is
+the signal that some run is not yielding often enough.
+
+Usage:
+    from services.run_admission import run_admission
+
+    slot = await run_admission.admit(agent_run_id)
+    run_admission.spawn(slot, execute_run(...))
+
+    # or, without waiting for a slot
+    slot = run_admission.try_admit(agent_run_id)
+"""
+
+import asyncio
+import resource
+import time
+from typing import Any, Coroutine, Dict, Optional
+
+from utils.config import config
+from utils.logger import logger
+
+LAG_SAMPLE_INTERVAL_SECONDS = 1.0
+LAG_WARNING_MS = 250
+
+
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * resource.getpagesize() / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class RunSlot:
+    """Accounting for one admitted run."""
+
+    __slots__ = ("agent_run_id", "queued_seconds", "admitted_at", "rss_at_admission_mb", "stream_bytes", "task")
+
+    def __init__(self, agent_run_id: str, queued_seconds: float):
+        self.agent_run_id = agent_run_id
+        self.queued_seconds = queued_seconds
+        self.admitted_at = time.monotonic()
+        self.rss_at_admission_mb = current_rss_mb()
+        self.stream_bytes = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def charge(self, nbytes: int) -> None:
+        """Attribute streamed payload bytes to this run."""
+        self.stream_bytes += nbytes
+
+
+class RunAdmission:
+    """Per-process admission controller and registry of running agent runs."""
+
+    def __init__(self):
+        self._active: Dict[str, RunSlot] = {}
+        self._condition: Optional[asyncio.Condition] = None
+        self._lag_monitor: Optional[asyncio.Task] = None
+        self.admitted = 0
+        self.max_loop_lag_ms = 0.0
+
+    def _has_capacity(self, reserved_slots: int) -> bool:
+        if len(self._active) >= max(config.WORKER_MAX_CONCURRENT_RUNS - reserved_slots, 1):
+            return False
+        if config.WORKER_MAX_RSS_MB and self._active and current_rss_mb() >= config.WORKER_MAX_RSS_MB:
+            return False
+        return True
+
+    async def admit(self, agent_run_id: str, reserved_slots: int = 0) -> RunSlot:
+        """
+        Wait until the process can take another run and reserve a slot for it.
+
+        reserved_slots are kept free for other callers: the run is only admitted
+        while fewer than WORKER_MAX_CONCURRENT_RUNS - reserved_slots are active.
+        """
+        self._start_lag_monitor()
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        started = time.monotonic()
+        async with self._condition:
+            while not self._has_capacity(reserved_slots):
+                try:
+                    # Re-check periodically: memory can drop without a run finishing
+                    await asyncio.wait_for(self._condition.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    pass
+            slot = self._take(agent_run_id, time.monotonic() - started)
+        if slot.queued_seconds > 1:
+            logger.info(f"Agent run {agent_run_id} admitted after waiting {slot.queued_seconds:.1f}s ({len(self._active)} active)")
+        return slot
+
+    def try_admit(self, agent_run_id: str, reserved_slots: int = 0) -> Optional[RunSlot]:
+        """
+        Reserve a slot only if the process can take another run right now.
+
+        Returns None instead of waiting, so a caller can leave its run queued
+        rather than hold a worker thread until a slot frees.
+        """
+        self._start_lag_monitor()
+        if not self._has_capacity(reserved_slots):
+            return None
+        return self._take(agent_run_id, 0.0)
+
+    def rekey(self, slot: RunSlot, agent_run_id: str, queued_seconds: float) -> None:
+        """Hand a slot reserved before its run was known to that run."""
+        self._active.pop(slot.agent_run_id, None)
+        slot.agent_run_id = agent_run_id
+        slot.queued_seconds = queued_seconds
+        self._active[agent_run_id] = slot
+
+    async def unreserve(self, slot: RunSlot) -> None:
+        """Give back a slot that never got a run, without counting it as one."""
+        self._active.pop(slot.agent_run_id, None)
+        self.admitted -= 1
+        await self._notify()
+
+    def _take(self, agent_run_id: str, queued_seconds: float) -> RunSlot:
+        slot = RunSlot(agent_run_id, queued_seconds)
+        self._active[agent_run_id] = slot
+        self.admitted += 1
+        return slot
+
+    def _start_lag_monitor(self) -> None:
+        if self._lag_monitor is None or self._lag_monitor.done():
+            self._lag_monitor = asyncio.create_task(self._monitor_loop_lag())
+
+    def spawn(self, slot: RunSlot, run: Coroutine[Any, Any, Any]) -> asyncio.Task:
+        """Execute an admitted run as a task on the current loop."""
+        slot.task = asyncio.create_task(self._execute(slot, run))
+        return slot.task
+
+    async def _execute(self, slot: RunSlot, run: Coroutine[Any, Any, Any]) -> None:
+        try:
+            await run
+        except Exception as e:
+            logger.error(f"Agent run {slot.agent_run_id} failed outside its error handling: {e}", exc_info=True)
+        finally:
+            await self.release(slot)
+
+    async def release(self, slot: RunSlot) -> None:
+        self._active.pop(slot.agent_run_id, None)
+        logger.info(
+            f"Agent run {slot.agent_run_id} released slot after {time.monotonic() - slot.admitted_at:.1f}s "
+            f"(queued {slot.queued_seconds:.1f}s, streamed {slot.stream_bytes} bytes, "
+            f"process RSS {slot.rss_at_admission_mb:.0f} -> {current_rss_mb():.0f} MB, {len(self._active)} still active)"
+        )
+        await self._notify()
+
+    async def _notify(self) -> None:
+        if self._condition is not None:
+            async with self._condition:
+                self._condition.notify_all()
+
+    def get(self, agent_run_id: str) -> Optional[RunSlot]:
+        return self._active.get(agent_run_id)
+
+    async def _monitor_loop_lag(self) -> None:
+        while True:
+            expected = time.monotonic() + LAG_SAMPLE_INTERVAL_SECONDS
+            await asyncio.sleep(LAG_SAMPLE_INTERVAL_SECONDS)
+            lag_ms = (time.monotonic() - expected) * 1000
+            self.max_loop_lag_ms = max(self.max_loop_lag_ms, lag_ms)
+            if lag_ms > LAG_WARNING_MS:
+                logger.warning(f"Worker event loop lagged {lag_ms:.0f}ms with {len(self._active)} active runs")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": len(self._active),
+            "admitted": self.admitted,
+            "max_concurrent_runs": config.WORKER_MAX_CONCURRENT_RUNS,
+            "rss_mb": round(current_rss_mb(), 1),
+            "max_loop_lag_ms": round(self.max_loop_lag_ms, 1),
+        }
+
+
+run_admission = RunAdmission()
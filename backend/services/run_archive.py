@@ -0,0 +1,168 @@
+"""
+Cold archival of completed agent run response streams.
+
+While a run executes, its responses are appended to the Redis list
+`agent_run:{id}:responses` (see services/run_stream.py). Once the run reaches a
+terminal status the worker compacts the list: all responses are written as one
+gzip-compressed, newline-delimited blob to the archive store, and the Redis
+list is trimmed to the last RUN_ARCHIVE_TAIL_RESPONSES items. The hash
+`agent_run:{id}:archive` records where the blob is and which logical index the
+tail starts at, so event ids (list indices) stay stable for resuming clients.
+
+The archive store is a Supabase storage bucket when RUN_ARCHIVE_BUCKET is set,
+otherwise the local directory RUN_ARCHIVE_DIR, which has to be shared by the
+API and the worker. With neither configured nothing is archived and complete
+streams stay in Redis until their TTL.
+
+Readers go through `read_responses`, which serves from the Redis list, its
+tail or the archive as needed. If an archive blob cannot be loaded, the tail
+still in Redis is served, starting at its own index.
+
+Usage:
+    from services import run_archive
+
+    await run_archive.archive_run(agent_run_id)                  # worker, after a terminal status
+    first_index, responses = await run_archive.read_responses(agent_run_id, start)
+"""
+
+import asyncio
+import gzip
+import os
+from typing import List, Optional, Tuple
+
+from services import redis
+from services.run_stream import response_list_key
+from services.supabase import DBConnection
+from utils.config import config
+from utils.logger import logger
+
+# Trim only if nothing was appended since the list was read
+_COMPACT_SCRIPT = """
+if redis.call('LLEN', KEYS[1]) ~= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('LTRIM', KEYS[1], -tonumber(ARGV[2]), -1)
+redis.call('HSET', KEYS[2], 'path', ARGV[3], 'count', ARGV[1], 'tail_offset', ARGV[4], 'compressed_bytes', ARGV[5])
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+return 1
+"""
+
+
+def enabled() -> bool:
+    """Whether finished runs are archived: switched on and with a store every process can read."""
+    return config.RUN_ARCHIVE_ENABLED and bool(config.RUN_ARCHIVE_BUCKET or config.RUN_ARCHIVE_DIR)
+
+
+def archive_key(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:archive"
+
+
+def archive_path(agent_run_id: str) -> str:
+    return f"{agent_run_id}.jsonl.gz"
+
+
+async def _store(path: str, data: bytes) -> None:
+    if config.RUN_ARCHIVE_BUCKET:
+        client = await DBConnection().client
+        await client.storage.from_(config.RUN_ARCHIVE_BUCKET).upload(path, data, {"content-type": "application/gzip", "upsert": "true"})
+        return
+
+    def write():
+        os.makedirs(config.RUN_ARCHIVE_DIR, exist_ok=True)
+        target = os.path.join(config.RUN_ARCHIVE_DIR, path)
+        with open(f"{target}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{target}.tmp", target)
+
+    await asyncio.to_thread(write)
+
+
+async def _load(path: str) -> Optional[bytes]:
+    try:
+        if config.RUN_ARCHIVE_BUCKET:
+            client = await DBConnection().client
+            return await client.storage.from_(config.RUN_ARCHIVE_BUCKET).download(path)
+
+        def read():
+            with open(os.path.join(config.RUN_ARCHIVE_DIR, path), "rb") as f:
+                return f.read()
+
+        return await asyncio.to_thread(read)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Failed to load run archive {path}: {e}")
+        return None
+
+
+async def archive_run(agent_run_id: str) -> bool:
+    """Move a finished run's responses to the archive, keeping a short tail in Redis."""
+    if not enabled():
+        return False
+    list_key = response_list_key(agent_run_id)
+    responses = await redis.lrange(list_key, 0, -1)
+    tail = config.RUN_ARCHIVE_TAIL_RESPONSES
+    if len(responses) <= tail:
+        return False
+
+    raw = "\n".join(responses).encode("utf-8")
+    blob = await asyncio.to_thread(gzip.compress, raw, 6)
+    path = archive_path(agent_run_id)
+    await _store(path, blob)
+
+    client = await redis.get_client()
+    compacted = await client.eval(
+        _COMPACT_SCRIPT, 2, list_key, archive_key(agent_run_id),
+        len(responses), tail, path, len(responses) - tail, len(blob), config.RUN_ARCHIVE_TTL_SECONDS,
+    )
+    if not compacted:
+        logger.warning(f"Response list of agent run {agent_run_id} changed while archiving; keeping it in Redis")
+        return False
+    logger.info(
+        f"Archived {len(responses)} responses of agent run {agent_run_id} to {path} "
+        f"({len(raw)} -> {len(blob)} bytes), kept last {tail} in Redis"
+    )
+    return True
+
+
+async def _read_archive(path: str, start: int) -> Optional[List[str]]:
+    blob = await _load(path)
+    if not blob:
+        return None
+    raw = await asyncio.to_thread(gzip.decompress, blob)
+    return raw.decode("utf-8").split("\n")[start:]
+
+
+async def read_responses(agent_run_id: str, start: int, allow_cold: bool = False) -> Tuple[int, List[str]]:
+    """
+    Stored responses of a run from logical index start onwards, with the index of the first one.
+
+    The first index is start unless the archive holding start is missing, in
+    which case only the tail still in Redis is returned. allow_cold looks for
+    an archive even after the Redis keys expired; only worth it for runs that
+    are no longer running.
+    """
+    start = max(start, 0)
+    list_key = response_list_key(agent_run_id)
+    client = await redis.get_client()
+    # One snapshot of both keys, so a compaction can't shift the indices in between
+    pipe = client.pipeline(transaction=True)
+    pipe.hgetall(archive_key(agent_run_id))
+    pipe.lrange(list_key, start, -1)
+    meta, responses = await pipe.execute()
+
+    if not meta:
+        if responses or not allow_cold:
+            return start, responses
+        # Redis keys expired; the archive may still exist
+        return start, await _read_archive(archive_path(agent_run_id), start) or []
+
+    tail_offset = int(meta["tail_offset"])
+    if start >= tail_offset:
+        return start, await redis.lrange(list_key, start - tail_offset, -1)
+    archived = await _read_archive(meta["path"], start)
+    if archived is None:
+        logger.error(f"Archive {meta['path']} of agent run {agent_run_id} is missing; serving only the last responses from index {tail_offset}")
+        return tail_offset, await redis.lrange(list_key, 0, -1)
+    return start, archived
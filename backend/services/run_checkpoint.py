@@ -0,0 +1,130 @@
+"""
+Checkpoints that let an agent run continue on another worker.
+
+Everything a run produces is persisted as thread messages as it goes, so
+resuming a run only needs the loop position that is not in the database: the
+agent iteration, the auto-continue count and partial assistant content within
+it, the id of the last message written, and the tool calls of the current step
+whose results are not saved yet (with their results once computed). The run saves this after every
+completed step under `agent_run:{agent_run_id}:checkpoint`, together with the
+arguments it was started with, and clears it when it reaches a terminal status.
+A new run saves an empty checkpoint as soon as it has claimed its lock, so a
+worker lost before the first step is covered too; resuming from it restarts
+the run.
+
+A run that finds a checkpoint when it starts resumes from it, first saving the
+recorded results of the interrupted step's tool calls, or a failed
+"interrupted" result for calls that were still executing, so the thread never
+has a tool call without a result. Runs are handed
+over by re-sending their message: on a graceful worker drain for the runs still
+active, and by the sweeper for runs whose worker died (checkpoint present, run
+lock expired).
+
+Usage:
+    checkpointer = RunCheckpointer(agent_run_id, run_kwargs)
+    resume_state = await checkpointer.load()
+    ...
+    await checkpointer.save(iteration=3, auto_continue_count=0)
+    ...
+    await checkpointer.clear()
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+CHECKPOINT_INDEX_KEY = "agent_run_checkpoints"
+
+
+def checkpoint_key(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:checkpoint"
+
+
+def run_lock_key(agent_run_id: str) -> str:
+    return f"agent_run_lock:{agent_run_id}"
+
+
+class RunCheckpointer:
+    """Loads and saves the resumable state of one agent run."""
+
+    def __init__(self, agent_run_id: str, run_kwargs: Dict[str, Any]):
+        self.agent_run_id = agent_run_id
+        self.run_kwargs = run_kwargs
+        self.state: Dict[str, Any] = {}
+        self.resumed = False
+
+    async def load(self) -> Optional[Dict[str, Any]]:
+        """Return the saved state if the run was interrupted before, else None."""
+        raw = await redis.get(checkpoint_key(self.agent_run_id))
+        if not raw:
+            return None
+        self.state = json.loads(raw).get("state", {})
+        self.resumed = True
+        logger.info(f"Resuming agent run {self.agent_run_id} from checkpoint: {self.state}")
+        return self.state
+
+    async def save(self, **fields: Any) -> None:
+        """Merge fields into the checkpoint and persist it. Failures are logged, not raised."""
+        self.state.update(fields)
+        now = time.time()
+        try:
+            payload = json.dumps({"run": self.run_kwargs, "state": self.state, "updated_at": now})
+            client = await redis.get_client()
+            pipe = client.pipeline(transaction=False)
+            pipe.set(checkpoint_key(self.agent_run_id), payload, ex=redis.REDIS_KEY_TTL)
+            pipe.zadd(CHECKPOINT_INDEX_KEY, {self.agent_run_id: now})
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to save checkpoint for agent run {self.agent_run_id}: {e}")
+
+    async def clear(self) -> None:
+        try:
+            client = await redis.get_client()
+            pipe = client.pipeline(transaction=False)
+            pipe.delete(checkpoint_key(self.agent_run_id))
+            pipe.zrem(CHECKPOINT_INDEX_KEY, self.agent_run_id)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to clear checkpoint for agent run {self.agent_run_id}: {e}")
+
+
+async def orphaned_runs(stale_after: int) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Checkpointed runs not updated for stale_after seconds whose run lock is gone.
+
+    Returns (agent_run_id, run kwargs) pairs. Each run is returned by at most one
+    caller per stale_after window, so several API processes can sweep at once.
+    """
+    client = await redis.get_client()
+    candidates = await client.zrangebyscore(CHECKPOINT_INDEX_KEY, 0, time.time() - stale_after)
+    orphans = []
+    for agent_run_id in candidates:
+        if await client.exists(run_lock_key(agent_run_id)):
+            continue
+        if not await client.set(f"agent_run:{agent_run_id}:resume_claim", "1", nx=True, ex=stale_after):
+            continue
+        raw = await client.get(checkpoint_key(agent_run_id))
+        if not raw:
+            # Checkpoint expired; nothing left to resume from
+            await client.zrem(CHECKPOINT_INDEX_KEY, agent_run_id)
+            continue
+        orphans.append((agent_run_id, json.loads(raw)["run"]))
+    return orphans
+
+
+async def run_sweeper(resume: Callable[[Dict[str, Any]], None], interval: Optional[int] = None) -> None:
+    """Periodically hand runs whose worker died back to the worker until cancelled."""
+    interval = interval or config.RUN_CHECKPOINT_SWEEP_INTERVAL_SECONDS
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            for agent_run_id, run_kwargs in await orphaned_runs(config.RUN_LOCK_TTL_SECONDS * 2):
+                logger.warning(f"Agent run {agent_run_id} lost its worker, resuming it from its checkpoint")
+                resume(run_kwargs)
+        except Exception as e:
+            logger.warning(f"Checkpoint sweep failed: {e}")
@@ -0,0 +1,98 @@
+"""
+Shared control-channel subscriber for agent runs executing in this process.
+
+Instead of every run polling its own pub/sub connection for STOP, the process
+keeps a single subscription and a single reader task. Runs register their
+control channels together with a cancellation scope; a STOP on any of those
+channels cancels the scope immediately, whatever the run is awaiting.
+
+Usage:
+    from services.run_control import run_control
+
+    await run_control.register(agent_run_id, instance_id, scope)
+    ...
+    await run_control.unregister(agent_run_id)
+"""
+
+import asyncio
+from typing import Dict, List, Optional
+
+from agentpress.cancellation import CancellationScope
+from services import redis
+from utils.logger import logger
+
+
+def control_channels(agent_run_id: str, instance_id: str) -> List[str]:
+    return [f"agent_run:{agent_run_id}:control:{instance_id}", f"agent_run:{agent_run_id}:control"]
+
+
+class RunControlHub:
+    """Routes control messages from one shared pub/sub connection to run scopes."""
+
+    def __init__(self):
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._scopes: Dict[str, CancellationScope] = {}
+        self._channels: Dict[str, List[str]] = {}
+
+    async def register(self, agent_run_id: str, instance_id: str, scope: CancellationScope) -> None:
+        channels = control_channels(agent_run_id, instance_id)
+        async with self._lock:
+            if self._pubsub is None:
+                self._pubsub = await redis.create_pubsub()
+            for channel in channels:
+                self._scopes[channel] = scope
+            self._channels[agent_run_id] = channels
+            await self._pubsub.subscribe(*channels)
+            if self._reader is None or self._reader.done():
+                self._reader = asyncio.create_task(self._read())
+        logger.debug(f"Registered control channels for agent run {agent_run_id}: {channels}")
+
+    async def unregister(self, agent_run_id: str) -> None:
+        async with self._lock:
+            channels = self._channels.pop(agent_run_id, [])
+            for channel in channels:
+                self._scopes.pop(channel, None)
+            if channels and self._pubsub is not None:
+                try:
+                    await self._pubsub.unsubscribe(*channels)
+                except Exception as e:
+                    logger.warning(f"Failed to unsubscribe control channels for agent run {agent_run_id}: {e}")
+
+    async def _read(self) -> None:
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Run control subscriber failed, cancelling {len(self._channels)} runs: {e}", exc_info=True)
+                # Without the subscriber a STOP could be missed; fail the runs rather than leak them
+                for scope in set(self._scopes.values()):
+                    scope.cancel("control subscriber failed")
+                self._pubsub = None
+                return
+            if not message or message.get("type") != "message":
+                continue
+            data = message.get("data")
+            if isinstance(data, bytes):
+                data = data.decode("utf-8")
+            if data != "STOP":
+                continue
+            scope = self._scopes.get(message.get("channel"))
+            if scope:
+                scope.cancel("stop requested")
+
+    def cancel_all(self, reason: str) -> int:
+        """Cancel every registered run. Returns how many were cancelled."""
+        scopes = set(self._scopes.values())
+        for scope in scopes:
+            scope.cancel(reason)
+        return len(scopes)
+
+    def active_runs(self) -> int:
+        return len(self._channels)
+
+
+run_control = RunControlHub()
@@ -0,0 +1,241 @@
+"""
+Fair dispatch of agent runs to the worker.
+
+Runs are not sent to the worker directly. They are queued per priority lane in
+Redis and ordered by weighted fair queuing across accounts: each run gets a
+virtual finish tag of max(lane clock, account's previous tag) + 1 / weight, and
+the worker always takes the run with the smallest tag. An account that queues
+hundreds of runs at once therefore only delays its own runs, while a single
+run from another account goes to the front of the next dispatch.
+
+Lanes:
+    interactive   runs started by a user from the UI or API
+    background    trigger and workflow executions
+
+For every queued run the caller sends one dispatch message; the worker
+handling it takes whatever run is next, not necessarily the one it was sent
+for. Lanes are taken in strict priority order: a dispatch message from either
+lane starts a queued interactive run before any background run, since dramatiq
+priorities only order the messages a worker has already prefetched.
+
+A taken run stays in the lane's processing set until its worker claims it in
+the run registry and acks it. A worker that dies in between never acks, so
+`requeue_expired` (run periodically by the API) puts runs not acked within
+RUN_DISPATCH_CLAIM_TIMEOUT_SECONDS back at the front of their lane and the
+caller sends a dispatch message for each; a run is dropped after
+MAX_DISPATCH_ATTEMPTS takes.
+
+Usage:
+    from services import run_dispatch
+
+    await run_dispatch.enqueue(run_dispatch.INTERACTIVE, account_id, run_kwargs)
+    job = await run_dispatch.pop_next()
+    ...
+    await run_dispatch.ack(job.lane, job.job_id)   # once the run is claimed
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+LANES = (INTERACTIVE, BACKGROUND)  # in priority order
+
+MAX_DISPATCH_ATTEMPTS = 3
+
+_ENQUEUE_SCRIPT = """
+local clock = tonumber(redis.call('GET', KEYS[4]) or '0')
+local previous = tonumber(redis.call('HGET', KEYS[3], ARGV[2]) or '0')
+local finish = math.max(clock, previous) + 1 / tonumber(ARGV[3])
+redis.call('HSET', KEYS[3], ARGV[2], finish)
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[4])
+redis.call('HSET', KEYS[5], ARGV[1], ARGV[5])
+redis.call('ZADD', KEYS[1], finish, ARGV[1])
+return redis.call('ZCARD', KEYS[1])
+"""
+
+_POP_SCRIPT = """
+local popped = redis.call('ZPOPMIN', KEYS[1])
+if #popped == 0 then
+    return nil
+end
+local job_id = popped[1]
+redis.call('SET', KEYS[4], popped[2])
+redis.call('ZADD', KEYS[7], ARGV[1], job_id)
+local payload = redis.call('HGET', KEYS[2], job_id)
+local enqueued_at = tonumber(redis.call('HGET', KEYS[5], job_id) or ARGV[1])
+if redis.call('ZCARD', KEYS[1]) == 0 then
+    redis.call('DEL', KEYS[3])
+end
+local wait_ms = math.max(0, tonumber(ARGV[1]) - enqueued_at)
+redis.call('HINCRBY', KEYS[6], 'dispatched', 1)
+redis.call('HINCRBY', KEYS[6], 'wait_ms_total', wait_ms)
+if wait_ms > tonumber(redis.call('HGET', KEYS[6], 'wait_ms_max') or '0') then
+    redis.call('HSET', KEYS[6], 'wait_ms_max', wait_ms)
+end
+return {job_id, payload, wait_ms}
+"""
+
+_ACK_SCRIPT = """
+local acked = redis.call('ZREM', KEYS[7], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[5], ARGV[1])
+redis.call('HDEL', KEYS[8], ARGV[1])
+return acked
+"""
+
+# Runs taken before ARGV[1] and never acked go back to the front of the lane
+_REQUEUE_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[7], '-inf', '(' .. ARGV[1])
+local requeued = 0
+local dropped = {}
+local front = tonumber(redis.call('GET', KEYS[4]) or '0')
+for _, job_id in ipairs(expired) do
+    redis.call('ZREM', KEYS[7], job_id)
+    local attempts = redis.call('HINCRBY', KEYS[8], job_id, 1)
+    if attempts >= tonumber(ARGV[2]) then
+        table.insert(dropped, redis.call('HGET', KEYS[2], job_id) or '{}')
+        redis.call('HDEL', KEYS[2], job_id)
+        redis.call('HDEL', KEYS[5], job_id)
+        redis.call('HDEL', KEYS[8], job_id)
+    else
+        redis.call('ZADD', KEYS[1], front, job_id)
+        requeued = requeued + 1
+    end
+end
+return {requeued, dropped}
+"""
+
+
+@dataclass
+class DispatchJob:
+    """A run taken from a lane; ack it once the run is claimed."""
+    lane: str
+    job_id: str
+    run_kwargs: Dict[str, Any]
+    wait_ms: int
+
+
+def _lane_keys(lane: str):
+    prefix = f"run_dispatch:{lane}"
+    return [
+        f"{prefix}:queue",       # zset job_id -> virtual finish tag
+        f"{prefix}:jobs",        # hash job_id -> run kwargs
+        f"{prefix}:finish",      # hash account_id -> last finish tag
+        f"{prefix}:clock",       # lane virtual clock
+        f"{prefix}:enqueued",    # hash job_id -> enqueue time in ms
+        f"{prefix}:stats",       # hash of dispatch counters
+        f"{prefix}:processing",  # zset job_id -> time taken in ms, until acked
+        f"{prefix}:attempts",    # hash job_id -> times requeued
+    ]
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+async def enqueue(lane: str, account_id: str, run_kwargs: Dict[str, Any], weight: int = 1) -> int:
+    """Queue a run for account_id on lane. Returns the lane depth after queuing."""
+    if lane not in LANES:
+        raise ValueError(f"Unknown dispatch lane: {lane}")
+    client = await redis.get_client()
+    job_id = str(uuid.uuid4())
+    depth = await client.eval(
+        _ENQUEUE_SCRIPT, 8, *_lane_keys(lane),
+        job_id, account_id or "unknown", max(weight, 1), json.dumps(run_kwargs), _now_ms(),
+    )
+    logger.debug(f"Queued agent run {run_kwargs.get('agent_run_id')} on {lane} lane for account {account_id} (depth {depth})")
+    return depth
+
+
+async def pop(lane: str) -> Optional[DispatchJob]:
+    """Take the next run in fair order from lane, or None if the lane is empty."""
+    client = await redis.get_client()
+    result = await client.eval(_POP_SCRIPT, 8, *_lane_keys(lane), _now_ms())
+    if not result or result[0] is None:
+        return None
+    job_id, payload, wait_ms = result
+    if payload is None:
+        # Dropped while it was being requeued; nothing to run
+        await ack(lane, job_id)
+        return None
+    return DispatchJob(lane, job_id, json.loads(payload), int(wait_ms))
+
+
+async def pop_next() -> Optional[DispatchJob]:
+    """Take the next run from the highest-priority lane that has one."""
+    for lane in LANES:
+        job = await pop(lane)
+        if job is not None:
+            return job
+    return None
+
+
+async def ack(lane: str, job_id: str) -> None:
+    """Forget a taken run once its worker has claimed it."""
+    client = await redis.get_client()
+    await client.eval(_ACK_SCRIPT, 8, *_lane_keys(lane), job_id)
+
+
+async def requeue_expired(timeout_seconds: Optional[int] = None) -> Dict[str, int]:
+    """Put runs taken but not acked within the timeout back at the front of their lane. Returns requeued counts per lane."""
+    if timeout_seconds is None:
+        timeout_seconds = config.RUN_DISPATCH_CLAIM_TIMEOUT_SECONDS
+    client = await redis.get_client()
+    requeued = {}
+    for lane in LANES:
+        count, dropped = await client.eval(
+            _REQUEUE_SCRIPT, 8, *_lane_keys(lane), _now_ms() - timeout_seconds * 1000, MAX_DISPATCH_ATTEMPTS,
+        )
+        for payload in dropped:
+            logger.error(f"Dropping agent run {json.loads(payload).get('agent_run_id')} from the {lane} lane after {MAX_DISPATCH_ATTEMPTS} dispatch attempts")
+        if count:
+            logger.warning(f"Requeued {count} agent runs on the {lane} lane that were never claimed by a worker")
+            requeued[lane] = int(count)
+    return requeued
+
+
+async def run_requeuer(send_dispatch: Callable[[str], None], interval: Optional[int] = None) -> None:
+    """Periodically requeue runs lost between dispatch and claim, sending a dispatch message for each, until cancelled."""
+    interval = interval or config.RUN_DISPATCH_CLAIM_TIMEOUT_SECONDS // 4
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            for lane, count in (await requeue_expired()).items():
+                for _ in range(count):
+                    send_dispatch(lane)
+        except Exception as e:
+            logger.warning(f"Dispatch requeue failed: {e}")
+
+
+async def lane_stats() -> Dict[str, Dict[str, Any]]:
+    """Depth and queue-wait counters for each lane."""
+    client = await redis.get_client()
+    pipe = client.pipeline(transaction=False)
+    for lane in LANES:
+        keys = _lane_keys(lane)
+        pipe.zcard(keys[0])
+        pipe.hgetall(keys[5])
+        pipe.zcard(keys[6])
+    results = await pipe.execute()
+    stats = {}
+    for i, lane in enumerate(LANES):
+        depth, counters, processing = results[3 * i], results[3 * i + 1] or {}, results[3 * i + 2]
+        dispatched = int(counters.get("dispatched", 0))
+        wait_total = int(counters.get("wait_ms_total", 0))
+        stats[lane] = {
+            "depth": depth,
+            "processing": processing,
+            "dispatched": dispatched,
+            "avg_wait_ms": round(wait_total / dispatched, 1) if dispatched else 0.0,
+            "max_wait_ms": int(counters.get("wait_ms_max", 0)),
+        }
+    return stats
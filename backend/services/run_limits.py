@@ -0,0 +1,342 @@
+"""
+Running agent runs per account and per project, for concurrency limits.
+
+Every run that is inserted as `running` is recorded in Redis, and removed when
+update_agent_run_status moves it to a terminal status:
+
+    account_running_runs:{account_id}     zset of run ids scored by start time
+    account_running_threads:{account_id}  hash of run id -> thread id
+    project_running_runs:{project_id}     set of run ids
+    running_run_owner:{agent_run_id}      hash with the run's account and project
+    run_limits:accounts                   accounts that have recorded runs
+
+Start, finish and check each update or read these keys atomically in one Lua
+script, so a limit check is a single round trip whatever the size of the
+account. Only runs started within RUN_LIMIT_WINDOW_SECONDS count, as before.
+
+Starting a run checks the limit and takes a slot in the same script
+(`reserve`), under the id the run is then inserted with, so concurrent starts
+cannot both see a free slot. A start that is rejected after reserving releases
+its slot with `release`; one that dies in between is dropped by the reconciler.
+
+Redis can miss a transition (an API process dies between the insert and the
+record, a flushed key), so `reconcile` periodically compares the keys with
+the running runs in agent_runs and repairs both directions.
+
+Runs whose workspace the API provisions before dispatching them are held in
+`run_limits:provisioning` until they are dispatched. If the API process dies
+in between, nothing would ever finish them, so the reconciler hands runs held
+longer than RUN_PROVISIONING_TIMEOUT_SECONDS to a callback that fails them.
+
+Usage:
+    from services import run_limits
+
+    reserved, thread_ids = await run_limits.reserve(account_id, agent_run_id, thread_id, limit)
+    await run_limits.run_started(account_id, project_id, agent_run_id, thread_id)
+    thread_ids = await run_limits.running_thread_ids(account_id)
+    await run_limits.run_finished(agent_run_id)
+
+    await run_limits.provisioning_started(agent_run_id)
+    ...
+    await run_limits.provisioning_finished(agent_run_id)
+"""
+
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+RUN_LIMIT_WINDOW_SECONDS = 24 * 3600
+TRACKED_ACCOUNTS_KEY = "run_limits:accounts"
+PROVISIONING_KEY = "run_limits:provisioning"
+# Runs younger than this may be missing from a database snapshot taken just
+# before they were inserted, so reconciliation leaves them alone
+RECONCILE_GRACE_SECONDS = 60
+
+_START_SCRIPT = """
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+redis.call('SADD', KEYS[3], ARGV[1])
+redis.call('HSET', KEYS[4], 'account_id', ARGV[4], 'project_id', ARGV[5])
+for i = 1, 4 do
+    redis.call('EXPIRE', KEYS[i], ARGV[6])
+end
+redis.call('SADD', KEYS[5], ARGV[4])
+return redis.call('ZCARD', KEYS[1])
+"""
+
+_FINISH_SCRIPT = """
+local removed = redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('SREM', KEYS[3], ARGV[1])
+redis.call('DEL', KEYS[4])
+return removed
+"""
+
+_CHECK_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[1])
+if #expired > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[1])
+    redis.call('HDEL', KEYS[2], unpack(expired))
+end
+local runs = redis.call('ZRANGE', KEYS[1], 0, -1)
+if #runs == 0 then
+    return {}
+end
+return redis.call('HMGET', KEYS[2], unpack(runs))
+"""
+
+
+_RESERVE_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[1])
+if #expired > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[1])
+    redis.call('HDEL', KEYS[2], unpack(expired))
+end
+local runs = redis.call('ZRANGE', KEYS[1], 0, -1)
+local thread_ids = {}
+if #runs > 0 then
+    thread_ids = redis.call('HMGET', KEYS[2], unpack(runs))
+end
+if #runs >= tonumber(ARGV[5]) then
+    return {0, thread_ids}
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[3])
+redis.call('HSET', KEYS[2], ARGV[3], ARGV[4])
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+redis.call('SADD', KEYS[3], ARGV[7])
+return {1, thread_ids}
+"""
+
+_RELEASE_SCRIPT = """
+local removed = redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+return removed
+"""
+
+
+def account_runs_key(account_id: str) -> str:
+    return f"account_running_runs:{account_id}"
+
+
+def account_threads_key(account_id: str) -> str:
+    return f"account_running_threads:{account_id}"
+
+
+def project_runs_key(project_id: str) -> str:
+    return f"project_running_runs:{project_id}"
+
+
+def run_owner_key(agent_run_id: str) -> str:
+    return f"running_run_owner:{agent_run_id}"
+
+
+def _run_keys(account_id: str, project_id: str, agent_run_id: str) -> List[str]:
+    return [
+        account_runs_key(account_id),
+        account_threads_key(account_id),
+        project_runs_key(project_id),
+        run_owner_key(agent_run_id),
+    ]
+
+
+def _parse_started_at(value: Optional[str]) -> float:
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return time.time()
+
+
+async def _record_start(account_id: str, project_id: str, agent_run_id: str, thread_id: str, started_at: float) -> int:
+    client = await redis.get_client()
+    return await client.eval(
+        _START_SCRIPT, 5, *_run_keys(account_id, project_id, agent_run_id), TRACKED_ACCOUNTS_KEY,
+        agent_run_id, thread_id, started_at, account_id, project_id, 2 * RUN_LIMIT_WINDOW_SECONDS,
+    )
+
+
+async def _record_finish(agent_run_id: str) -> bool:
+    client = await redis.get_client()
+    owner = await client.hgetall(run_owner_key(agent_run_id))
+    if not owner:
+        return False
+    removed = await client.eval(
+        _FINISH_SCRIPT, 4, *_run_keys(owner['account_id'], owner['project_id'], agent_run_id), agent_run_id,
+    )
+    return bool(removed)
+
+
+async def reserve(account_id: str, agent_run_id: str, thread_id: str, limit: int) -> Tuple[bool, List[str]]:
+    """
+    Take a running-run slot for agent_run_id if the account has fewer than limit runs.
+
+    Returns whether the slot was taken and the thread ids of the runs already
+    running, one per run. Raises if Redis fails.
+    """
+    client = await redis.get_client()
+    now = time.time()
+    reserved, thread_ids = await client.eval(
+        _RESERVE_SCRIPT, 3, account_runs_key(account_id), account_threads_key(account_id), TRACKED_ACCOUNTS_KEY,
+        now - RUN_LIMIT_WINDOW_SECONDS, now, agent_run_id, thread_id or "", limit,
+        2 * RUN_LIMIT_WINDOW_SECONDS, account_id,
+    )
+    return bool(reserved), [running or "" for running in thread_ids]
+
+
+async def release(account_id: str, agent_run_id: str) -> None:
+    """Give back a slot taken by reserve for a run that was not started. Failures are left to the reconciler."""
+    try:
+        client = await redis.get_client()
+        await client.eval(_RELEASE_SCRIPT, 2, account_runs_key(account_id), account_threads_key(account_id), agent_run_id)
+    except Exception as e:
+        logger.warning(f"Failed to release run limit slot of agent run {agent_run_id}: {e}")
+
+
+async def run_started(account_id: str, project_id: str, agent_run_id: str, thread_id: str) -> None:
+    """Record a run that was just inserted as running. Failures are left to the reconciler."""
+    try:
+        await _record_start(account_id, project_id, agent_run_id, thread_id, time.time())
+    except Exception as e:
+        logger.warning(f"Failed to record start of agent run {agent_run_id} in run limits: {e}")
+
+
+async def run_finished(agent_run_id: str) -> None:
+    """Forget a run that reached a terminal status. Failures are left to the reconciler."""
+    try:
+        await _record_finish(agent_run_id)
+    except Exception as e:
+        logger.warning(f"Failed to record end of agent run {agent_run_id} in run limits: {e}")
+
+
+async def provisioning_started(agent_run_id: str) -> None:
+    """Hold a running run that will be dispatched once its workspace is ready."""
+    try:
+        client = await redis.get_client()
+        await client.zadd(PROVISIONING_KEY, {agent_run_id: time.time()})
+    except Exception as e:
+        logger.warning(f"Failed to record provisioning of agent run {agent_run_id}: {e}")
+
+
+async def provisioning_finished(agent_run_id: str) -> None:
+    """Release a run held by provisioning_started, dispatched or not."""
+    try:
+        client = await redis.get_client()
+        await client.zrem(PROVISIONING_KEY, agent_run_id)
+    except Exception as e:
+        logger.warning(f"Failed to clear provisioning of agent run {agent_run_id}: {e}")
+
+
+async def abandoned_provisioning(timeout_seconds: int) -> List[str]:
+    """
+    Runs held in provisioning for longer than timeout_seconds.
+
+    Each run is released as it is returned, so with several API processes
+    reconciling at once only one of them gets it.
+    """
+    client = await redis.get_client()
+    stale = await client.zrangebyscore(PROVISIONING_KEY, 0, time.time() - timeout_seconds)
+    return [agent_run_id for agent_run_id in stale if await client.zrem(PROVISIONING_KEY, agent_run_id)]
+
+
+async def running_thread_ids(account_id: str) -> List[str]:
+    """Thread ids of the account's runs started within the window, one per run. Raises if Redis fails."""
+    client = await redis.get_client()
+    window_start = time.time() - RUN_LIMIT_WINDOW_SECONDS
+    thread_ids = await client.eval(
+        _CHECK_SCRIPT, 2, account_runs_key(account_id), account_threads_key(account_id), window_start,
+    )
+    return [thread_id or "" for thread_id in thread_ids]
+
+
+async def project_running_run(project_id: str) -> Optional[str]:
+    """Id of one running run of the project, if any. Raises if Redis fails."""
+    client = await redis.get_client()
+    return await client.srandmember(project_runs_key(project_id))
+
+
+async def running_runs_from_db(client, account_id: Optional[str] = None, project_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Running runs started within the window according to agent_runs.
+
+    Each row has id, thread_id, started_at and threads.account_id/project_id.
+    """
+    window_start = datetime.fromtimestamp(time.time() - RUN_LIMIT_WINDOW_SECONDS, timezone.utc).isoformat()
+    query = client.table('agent_runs').select(
+        'id, thread_id, started_at, threads!inner(account_id, project_id)'
+    ).eq('status', 'running').gte('started_at', window_start)
+    if account_id:
+        query = query.eq('threads.account_id', account_id)
+    if project_id:
+        query = query.eq('threads.project_id', project_id)
+    result = await query.execute()
+    return result.data or []
+
+
+async def reconcile(client) -> int:
+    """Make the Redis keys match the running runs in agent_runs. Returns how many entries were fixed."""
+    snapshot_at = time.time()
+    expected = {run['id']: run for run in await running_runs_from_db(client)}
+    redis_client = await redis.get_client()
+    fixed = 0
+
+    for account_id in await redis_client.smembers(TRACKED_ACCOUNTS_KEY):
+        entries = await redis_client.zrange(account_runs_key(account_id), 0, -1, withscores=True)
+        for agent_run_id, started_at in entries:
+            if agent_run_id not in expected and started_at < snapshot_at - RECONCILE_GRACE_SECONDS:
+                if not await _record_finish(agent_run_id):
+                    # The owner key expired; the account keys still name the run
+                    await redis_client.zrem(account_runs_key(account_id), agent_run_id)
+                    await redis_client.hdel(account_threads_key(account_id), agent_run_id)
+                fixed += 1
+        if not await redis_client.exists(account_runs_key(account_id)):
+            await redis_client.srem(TRACKED_ACCOUNTS_KEY, account_id)
+
+    run_ids = list(expected)
+    if run_ids:
+        pipe = redis_client.pipeline(transaction=False)
+        for agent_run_id in run_ids:
+            pipe.exists(run_owner_key(agent_run_id))
+        recorded = await pipe.execute()
+        missing = [agent_run_id for agent_run_id, exists in zip(run_ids, recorded) if not exists]
+        if missing:
+            # Runs that finished since the snapshot must not be recorded again
+            still_running = await client.table('agent_runs').select('id').in_('id', missing).eq('status', 'running').execute()
+            for row in still_running.data or []:
+                run = expected[row['id']]
+                thread = run.get('threads') or {}
+                await _record_start(
+                    thread['account_id'], thread['project_id'], run['id'], run['thread_id'],
+                    _parse_started_at(run.get('started_at')),
+                )
+                fixed += 1
+
+    if fixed:
+        logger.info(f"Run limits reconciliation fixed {fixed} entries ({len(expected)} runs running)")
+    return fixed
+
+
+async def run_reconciler(
+    db,
+    fail_abandoned: Optional[Callable[[str], Awaitable[None]]] = None,
+    interval: Optional[int] = None,
+) -> None:
+    """Reconcile once, then periodically until cancelled, failing abandoned provisioning runs with fail_abandoned."""
+    interval = interval or config.RUN_LIMITS_RECONCILE_INTERVAL_SECONDS
+    while True:
+        try:
+            await reconcile(await db.client)
+        except Exception as e:
+            logger.warning(f"Run limits reconciliation failed: {e}")
+        if fail_abandoned:
+            try:
+                for agent_run_id in await abandoned_provisioning(config.RUN_PROVISIONING_TIMEOUT_SECONDS):
+                    logger.warning(f"Agent run {agent_run_id} was never dispatched after provisioning, failing it")
+                    await fail_abandoned(agent_run_id)
+            except Exception as e:
+                logger.warning(f"Failing abandoned provisioning runs failed: {e}")
+        await asyncio.sleep(interval)
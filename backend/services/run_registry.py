@@ -0,0 +1,141 @@
+"""
+Registry of agent runs executing on each instance.
+
+Alongside the per-run liveness key `active_run:{instance_id}:{agent_run_id}`
+the run lifecycle maintains two sets, so nothing has to scan the keyspace to
+find runs:
+
+    instance_runs:{instance_id}    run ids executing on the instance
+    run_instances:{agent_run_id}   instances executing the run
+    run_registry:instances         instances that have claimed runs
+
+Every write goes through claim_run / release_run, which update the liveness
+key and the sets atomically in a Lua script. Entries whose liveness key
+expired (a crashed worker never released them) are removed by
+`reconcile_all`, which the API runs periodically for every instance.
+"""
+
+import asyncio
+from typing import List, Optional
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+INSTANCES_KEY = "run_registry:instances"
+
+_CLAIM_SCRIPT = """
+redis.call('SET', KEYS[1], 'running', 'EX', ARGV[3])
+redis.call('SADD', KEYS[2], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+redis.call('SADD', KEYS[3], ARGV[2])
+redis.call('EXPIRE', KEYS[3], ARGV[3])
+redis.call('SADD', KEYS[4], ARGV[2])
+return 1
+"""
+
+_RELEASE_SCRIPT = """
+redis.call('DEL', KEYS[1])
+redis.call('SREM', KEYS[2], ARGV[1])
+redis.call('SREM', KEYS[3], ARGV[2])
+return 1
+"""
+
+# Forget an instance once it has no runs left; atomic so a concurrent claim is kept
+_FORGET_INSTANCE_SCRIPT = """
+if redis.call('SCARD', KEYS[1]) == 0 then
+    return redis.call('SREM', KEYS[2], ARGV[1])
+end
+return 0
+"""
+
+
+def active_run_key(instance_id: str, agent_run_id: str) -> str:
+    return f"active_run:{instance_id}:{agent_run_id}"
+
+
+def instance_runs_key(instance_id: str) -> str:
+    return f"instance_runs:{instance_id}"
+
+
+def run_instances_key(agent_run_id: str) -> str:
+    return f"run_instances:{agent_run_id}"
+
+
+def _keys(agent_run_id: str, instance_id: str) -> List[str]:
+    return [active_run_key(instance_id, agent_run_id), instance_runs_key(instance_id), run_instances_key(agent_run_id)]
+
+
+async def claim_run(agent_run_id: str, instance_id: str) -> None:
+    """Record that instance_id is executing agent_run_id."""
+    client = await redis.get_client()
+    await client.eval(_CLAIM_SCRIPT, 4, *_keys(agent_run_id, instance_id), INSTANCES_KEY, agent_run_id, instance_id, redis.REDIS_KEY_TTL)
+
+
+async def release_run(agent_run_id: str, instance_id: str) -> None:
+    """Remove agent_run_id from the registry of instance_id."""
+    client = await redis.get_client()
+    await client.eval(_RELEASE_SCRIPT, 3, *_keys(agent_run_id, instance_id), agent_run_id, instance_id)
+
+
+async def refresh_run(agent_run_id: str, instance_id: str) -> None:
+    """Extend the TTL of the liveness key and both sets for a long-running run."""
+    client = await redis.get_client()
+    pipe = client.pipeline(transaction=False)
+    for key in _keys(agent_run_id, instance_id):
+        pipe.expire(key, redis.REDIS_KEY_TTL)
+    await pipe.execute()
+
+
+async def instances_for_run(agent_run_id: str) -> List[str]:
+    client = await redis.get_client()
+    return list(await client.smembers(run_instances_key(agent_run_id)))
+
+
+async def runs_for_instance(instance_id: str) -> List[str]:
+    client = await redis.get_client()
+    return list(await client.smembers(instance_runs_key(instance_id)))
+
+
+async def reconcile_instance(instance_id: str) -> int:
+    """Drop registry entries for runs whose liveness key has expired. Returns how many were removed."""
+    run_ids = await runs_for_instance(instance_id)
+    client = await redis.get_client()
+    if not run_ids:
+        await client.eval(_FORGET_INSTANCE_SCRIPT, 2, instance_runs_key(instance_id), INSTANCES_KEY, instance_id)
+        return 0
+    pipe = client.pipeline(transaction=False)
+    for agent_run_id in run_ids:
+        pipe.exists(active_run_key(instance_id, agent_run_id))
+    alive = await pipe.execute()
+    stale = [agent_run_id for agent_run_id, exists in zip(run_ids, alive) if not exists]
+    for agent_run_id in stale:
+        await release_run(agent_run_id, instance_id)
+    if stale:
+        logger.info(f"Run registry reconciliation removed {len(stale)} stale runs for instance {instance_id}")
+        if len(stale) == len(run_ids):
+            await client.eval(_FORGET_INSTANCE_SCRIPT, 2, instance_runs_key(instance_id), INSTANCES_KEY, instance_id)
+    return len(stale)
+
+
+async def reconcile_all() -> int:
+    """Reconcile the registry of every instance that has claimed runs. Returns how many entries were removed."""
+    client = await redis.get_client()
+    removed = 0
+    for instance_id in await client.smembers(INSTANCES_KEY):
+        try:
+            removed += await reconcile_instance(instance_id)
+        except Exception as e:
+            logger.warning(f"Run registry reconciliation failed for instance {instance_id}: {e}")
+    return removed
+
+
+async def run_reconciler(interval: Optional[int] = None) -> None:
+    """Periodically reconcile the registries of all instances until cancelled."""
+    interval = interval or config.RUN_REGISTRY_RECONCILE_INTERVAL_SECONDS
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await reconcile_all()
+        except Exception as e:
+            logger.warning(f"Run registry reconciliation failed: {e}")
@@ -0,0 +1,162 @@
+"""
+Redis transport for agent run response streams.
+
+Each agent run appends its responses to `agent_run:{id}:responses` and
+notifies readers on `agent_run:{id}:new_response`. The publisher below owns
+those writes for one run: responses go through a bounded queue to a single
+writer task that sends them in pipelined (non-transactional) batches, with the
+RPUSH and the notification in the same round trip so a reader woken by the
+notification always finds the items in the list.
+
+Because the list is append-only, an item's index is a stable event id. Readers
+send it as the SSE `id:` so reconnecting clients can resume with Last-Event-ID
+and receive only the stored items they missed, as the raw stored strings.
+
+Usage:
+    publisher = RunStreamPublisher(agent_run_id)
+    publisher.start()
+    await publisher.publish(encode_event(response))   # waits while the queue is full
+    await publisher.flush()                           # terminal status: make it visible
+    await publisher.close()
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional, Union
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+
+def response_list_key(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:responses"
+
+
+def response_channel(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:new_response"
+
+
+class RunStreamPublisher:
+    """Single-writer, backpressured publisher for one run's response stream."""
+
+    def __init__(self, agent_run_id: str, max_pending: Optional[int] = None, max_batch: Optional[int] = None):
+        self.agent_run_id = agent_run_id
+        self.list_key = response_list_key(agent_run_id)
+        self.channel = response_channel(agent_run_id)
+        self.max_batch = max_batch or config.RUN_STREAM_MAX_BATCH
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending or config.RUN_STREAM_MAX_PENDING)
+        self._writer: Optional[asyncio.Task] = None
+        self.published = 0
+        self.batches = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.producer_wait_seconds = 0.0
+
+    def start(self) -> None:
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._run_writer())
+
+    async def publish(self, payload: Union[bytes, str]) -> None:
+        """Queue one encoded response. Blocks the producer while the queue is full."""
+        if self._queue.full():
+            started = time.monotonic()
+            await self._queue.put(payload)
+            self.producer_wait_seconds += time.monotonic() - started
+        else:
+            self._queue.put_nowait(payload)
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    async def _run_writer(self) -> None:
+        while True:
+            batch: List[Union[bytes, str]] = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await self._write(batch)
+                self.published += len(batch)
+                self.batches += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += len(batch)
+                logger.warning(f"Failed to publish {len(batch)} responses for agent run {self.agent_run_id}: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write(self, batch: List[Union[bytes, str]]) -> None:
+        client = await redis.get_client()
+        pipe = client.pipeline(transaction=False)
+        pipe.rpush(self.list_key, *batch)
+        pipe.publish(self.channel, "new")
+        await pipe.execute()
+
+    async def flush(self, timeout: float = 30.0) -> bool:
+        """Wait until everything queued so far is written. Returns False on timeout."""
+        if self._writer is None:
+            return self._queue.empty()
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(f"Timeout flushing {self._queue.qsize()} pending responses for agent run {self.agent_run_id}")
+            return False
+
+    async def close(self, timeout: float = 30.0) -> None:
+        """Flush pending responses and stop the writer."""
+        await self.flush(timeout)
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+        logger.debug(f"Response publisher for agent run {self.agent_run_id} closed: {self.stats()}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "published": self.published,
+            "batches": self.batches,
+            "failed": self.failed,
+            "pending": self._queue.qsize(),
+            "max_depth": self.max_depth,
+            "producer_wait_seconds": round(self.producer_wait_seconds, 3),
+        }
+
+
+TERMINAL_STATUSES = ("completed", "failed", "stopped")
+
+
+def parse_last_event_id(value: Optional[str]) -> int:
+    """Return the list index of the last event a client saw, or -1 for a fresh stream."""
+    if not value:
+        return -1
+    try:
+        return max(int(value.strip()), -1)
+    except ValueError:
+        return -1
+
+
+def sse_frame(index: int, raw: str) -> str:
+    """Format a stored response as an SSE frame whose id is its position in the list."""
+    return f"id: {index}\ndata: {raw}\n\n"
+
+
+def terminal_status(raw: str) -> Optional[str]:
+    """Return the terminal status carried by a stored response, if any.
+
+    Only responses that textually mention a terminal status are parsed, so the
+    common case never touches the JSON decoder.
+    """
+    if not any(f'"status": "{status}"' in raw for status in TERMINAL_STATUSES):
+        return None
+    try:
+        response = json.loads(raw)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    if isinstance(response, dict) and response.get("type") == "status" and response.get("status") in TERMINAL_STATUSES:
+        return response["status"]
+    return None
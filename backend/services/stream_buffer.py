@@ -0,0 +1,218 @@
+"""
+Bounded per-client buffers for agent run SSE streams.
+
+stream_agent_run reads a run's responses from Redis as soon as they are
+published and pushes them into the client's buffer; the SSE response drains it
+at whatever pace the client reads. When a client falls behind far enough that
+its buffer exceeds RUN_STREAM_CLIENT_BUFFER_BYTES, the buffer sheds load
+according to RUN_STREAM_SLOW_CLIENT_POLICY, escalating until it fits:
+
+    coalesce     merge consecutive assistant text deltas into one frame,
+                 then drop progress status frames, then disconnect
+    drop_status  drop progress status frames, then disconnect
+    disconnect   disconnect straight away
+
+Disconnecting discards the pending frames and ends the stream with a
+`reconnect` status carrying `resume_id`, the id of the last frame the client
+was sent; it reconnects with that as Last-Event-ID and replays from Redis.
+Only statuses in PROGRESS_STATUS_TYPES are ever dropped; error, finish and
+run-level status frames are always delivered.
+
+Usage:
+    buffer = ClientStreamBuffer(agent_run_id)
+    buffer.push(index, raw)          # reader side; False once the buffer is closed
+    frame = await buffer.get()       # SSE side; None when the stream is over
+"""
+
+import asyncio
+import json
+import weakref
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from agentpress.stream_event import encode_event, stored_version
+from utils.config import config
+from utils.json_helpers import ensure_dict
+from utils.logger import logger
+
+Frame = Tuple[Optional[int], str]
+
+_ESCALATION = {
+    "coalesce": ("coalesce", "drop_status", "disconnect"),
+    "drop_status": ("drop_status", "disconnect"),
+    "disconnect": ("disconnect",),
+}
+
+_live_buffers: "weakref.WeakSet[ClientStreamBuffer]" = weakref.WeakSet()
+_totals = {"disconnects": 0, "coalesced_frames": 0, "dropped_frames": 0}
+
+
+# Status frames that only report progress; anything else (errors, finish, run
+# start/end, tool results) reaches the client even when it falls behind
+PROGRESS_STATUS_TYPES = frozenset({"assistant_response_start", "tool_call_chunk", "tool_started"})
+
+
+def _event(raw: str) -> Dict[str, Any]:
+    try:
+        event = json.loads(raw)
+    except (json.JSONDecodeError, TypeError):
+        return {}
+    return event if isinstance(event, dict) else {}
+
+
+def _is_text_delta(raw: str) -> bool:
+    event = _event(raw)
+    return event.get("type") == "assistant" and "message_id" in event and event["message_id"] is None
+
+
+def _is_progress_status(raw: str) -> bool:
+    event = _event(raw)
+    if event.get("type") != "status" or event.get("status"):
+        # Top-level statuses are run-level (completed, failed, stopped, error)
+        return False
+    return ensure_dict(event.get("content")).get("status_type") in PROGRESS_STATUS_TYPES
+
+
+class ClientStreamBuffer:
+    """Frames waiting to be sent to one SSE client, bounded in bytes."""
+
+    def __init__(self, agent_run_id: str, max_bytes: Optional[int] = None, policy: Optional[str] = None):
+        self.agent_run_id = agent_run_id
+        self.max_bytes = max_bytes or config.RUN_STREAM_CLIENT_BUFFER_BYTES
+        self.policy = policy if policy in _ESCALATION else config.RUN_STREAM_SLOW_CLIENT_POLICY
+        if self.policy not in _ESCALATION:
+            self.policy = "coalesce"
+        self.frames: Deque[Frame] = deque()
+        self.buffered_bytes = 0
+        self.peak_bytes = 0
+        self.last_sent_index = -1
+        self.closed = False
+        self.disconnected = False
+        self.coalesced = 0
+        self.dropped = 0
+        self._ready = asyncio.Event()
+        _live_buffers.add(self)
+
+    def push(self, index: Optional[int], raw: str) -> bool:
+        """Queue a frame (index None for frames without an SSE id). Returns False once closed."""
+        if self.closed:
+            return False
+        self.frames.append((index, raw))
+        self.buffered_bytes += len(raw)
+        if self.buffered_bytes > self.max_bytes:
+            self._shed()
+        self.peak_bytes = max(self.peak_bytes, self.buffered_bytes)
+        self._ready.set()
+        return not self.closed
+
+    def finish(self, raw: Optional[str] = None) -> None:
+        """Queue an optional last frame and close the buffer."""
+        if self.closed:
+            return
+        if raw is not None:
+            self.frames.append((None, raw))
+            self.buffered_bytes += len(raw)
+        self.closed = True
+        self._ready.set()
+
+    async def get(self) -> Optional[Frame]:
+        while not self.frames:
+            if self.closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        index, raw = self.frames.popleft()
+        self.buffered_bytes -= len(raw)
+        if index is not None:
+            self.last_sent_index = index
+        return index, raw
+
+    def _shed(self) -> None:
+        for step in _ESCALATION[self.policy]:
+            if step == "coalesce":
+                self._coalesce_text_deltas()
+            elif step == "drop_status":
+                self._drop_progress_statuses()
+            else:
+                self._disconnect()
+            if self.buffered_bytes <= self.max_bytes:
+                return
+
+    def _coalesce_text_deltas(self) -> None:
+        merged: Deque[Frame] = deque()
+        run: list = []
+
+        def flush_run():
+            if len(run) == 1:
+                merged.append(run[0])
+            elif run:
+                merged.append(self._merge(run))
+                self.coalesced += len(run) - 1
+            run.clear()
+
+        for index, raw in self.frames:
+            if index is not None and _is_text_delta(raw):
+                run.append((index, raw))
+            else:
+                flush_run()
+                merged.append((index, raw))
+        flush_run()
+        self._replace(merged)
+
+    @staticmethod
+    def _merge(run: list) -> Frame:
+        first = json.loads(run[0][1])
+        content = ensure_dict(first.get("content"))
+        text = [content.get("content") or ""]
+        for _, raw in run[1:]:
+            text.append(ensure_dict(json.loads(raw).get("content")).get("content") or "")
+        content["content"] = "".join(text)
+        first["content"] = content
+        # The merged frame takes the id of the last delta it contains
+        return run[-1][0], encode_event(first, stored_version(run[0][1])).decode("utf-8")
+
+    def _drop_progress_statuses(self) -> None:
+        kept = deque(frame for frame in self.frames if frame[0] is None or not _is_progress_status(frame[1]))
+        self.dropped += len(self.frames) - len(kept)
+        self._replace(kept)
+
+    def _disconnect(self) -> None:
+        logger.warning(
+            f"Disconnecting slow client of agent run {self.agent_run_id}: {self.buffered_bytes} bytes buffered "
+            f"(limit {self.max_bytes}), resume after {self.last_sent_index}"
+        )
+        self._replace(deque())
+        self.disconnected = True
+        _totals["disconnects"] += 1
+        self.finish(json.dumps({
+            "type": "status",
+            "status": "reconnect",
+            "resume_id": self.last_sent_index,
+            "message": "Client too slow; reconnect with Last-Event-ID set to resume_id",
+        }))
+
+    def _replace(self, frames: Deque[Frame]) -> None:
+        self.frames = frames
+        self.buffered_bytes = sum(len(raw) for _, raw in frames)
+
+    def close(self) -> None:
+        """Record this client's totals once its stream has ended."""
+        _totals["coalesced_frames"] += self.coalesced
+        _totals["dropped_frames"] += self.dropped
+        _live_buffers.discard(self)
+        if self.coalesced or self.dropped or self.disconnected:
+            logger.info(
+                f"Stream for agent run {self.agent_run_id} shed load: peak {self.peak_bytes} bytes, "
+                f"{self.coalesced} frames coalesced, {self.dropped} dropped, disconnected={self.disconnected}"
+            )
+
+
+def stats() -> Dict[str, Any]:
+    """Buffered bytes across this process's SSE clients and load-shedding totals."""
+    buffers = list(_live_buffers)
+    return {
+        "clients": len(buffers),
+        "buffered_bytes": sum(b.buffered_bytes for b in buffers),
+        "max_client_buffered_bytes": max((b.buffered_bytes for b in buffers), default=0),
+        **_totals,
+    }
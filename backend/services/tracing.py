@@ -0,0 +1,287 @@
+"""
+Buffered tracing facade over Langfuse.
+
+Trace calls on the agent hot path (tool spans, per-chunk events, generation
+updates) only append a small record to an in-memory buffer. A background
+exporter thread replays the records against the Langfuse client in batches, so
+request and worker event loops never build SDK payloads or wait on a flush.
+
+Runs are sampled head-first by trace id (deterministic, so the API and the
+worker agree on the same run). Records of unsampled runs are held per run and
+dropped when the run finishes, unless the run logs an ERROR-level observation,
+in which case everything held so far is exported and the run is kept.
+
+The exporter keeps the Langfuse clients of a trace until it is finished.
+Traces nobody finishes (the default traces ThreadManager and ResponseProcessor
+create when no trace is passed in) are evicted once idle for
+LANGFUSE_LIVE_TRACE_TTL_SECONDS, or oldest first beyond
+LANGFUSE_MAX_LIVE_TRACES; later records for them are skipped.
+
+Usage:
+    from services.tracing import tracer
+
+    trace = tracer.trace(name="agent_run", id=agent_run_id, session_id=thread_id)
+    trace.event(name="tool_started", level="DEFAULT", status_message="...")
+    span = trace.span(name="execute_tool.web_search")
+    span.end(status_message="tool_executed")
+    trace.finish()   # run is over; release its handles
+"""
+
+import atexit
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from services.langfuse import enabled as langfuse_enabled, langfuse
+from utils.config import config
+from utils.logger import logger
+
+# (operation, target handle id, new handle id, keyword arguments)
+_Record = Tuple[str, Optional[str], Optional[str], Dict[str, Any]]
+
+# Records held for an unsampled run in case it errors later
+MAX_HELD_RECORDS_PER_RUN = 500
+
+
+class _RunState:
+    """Sampling decision and held records for one trace."""
+
+    __slots__ = ("tracer", "trace_id", "exporting", "create_record", "held")
+
+    def __init__(self, tracer: "Tracer", trace_id: str, sampled: bool, create_record: _Record):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.exporting = sampled
+        self.create_record = create_record
+        self.held: Deque[_Record] = deque(maxlen=MAX_HELD_RECORDS_PER_RUN)
+        if sampled:
+            tracer._enqueue(create_record)
+
+    def record(self, op: str, target: Optional[str], new_id: Optional[str], kwargs: Dict[str, Any]) -> None:
+        if not self.exporting and kwargs.get("level") == "ERROR":
+            # Always keep errored runs: promote everything held so far
+            self.exporting = True
+            self.tracer._enqueue(self.create_record)
+            for held in self.held:
+                self.tracer._enqueue(held)
+            self.held.clear()
+            self.tracer.promoted_runs += 1
+        if self.exporting:
+            self.tracer._enqueue((op, target, new_id, kwargs))
+        else:
+            self.held.append((op, target, new_id, kwargs))
+
+    def finish(self) -> None:
+        if self.exporting:
+            self.tracer._enqueue(("finish", self.trace_id, None, {}))
+        self.held.clear()
+
+
+class ObservationHandle:
+    """Stand-in for Langfuse's stateful span/generation clients.
+
+    A handle without run state is the no-op fast path used when tracing is
+    disabled; every method returns immediately.
+    """
+
+    __slots__ = ("_run", "id")
+
+    def __init__(self, run: Optional[_RunState] = None, id: Optional[str] = None):
+        self._run = run
+        self.id = id
+
+    def _child(self, op: str, kwargs: Dict[str, Any]) -> "ObservationHandle":
+        if self._run is None:
+            return self
+        child_id = kwargs.get("id") or str(uuid.uuid4())
+        kwargs["id"] = child_id
+        self._run.record(op, self.id, child_id, kwargs)
+        return ObservationHandle(self._run, child_id)
+
+    def span(self, **kwargs) -> "ObservationHandle":
+        return self._child("span", kwargs)
+
+    def generation(self, **kwargs) -> "ObservationHandle":
+        return self._child("generation", kwargs)
+
+    def event(self, **kwargs) -> None:
+        if self._run is not None:
+            self._run.record("event", self.id, None, kwargs)
+
+    def update(self, **kwargs) -> None:
+        if self._run is not None:
+            self._run.record("update", self.id, None, kwargs)
+
+    def end(self, **kwargs) -> None:
+        if self._run is not None:
+            self._run.record("end", self.id, None, kwargs)
+
+
+class TraceHandle(ObservationHandle):
+    """Stand-in for Langfuse's StatefulTraceClient."""
+
+    __slots__ = ()
+
+    def finish(self) -> None:
+        """Mark the run as over. Unsampled, error-free runs are discarded here."""
+        if self._run is not None:
+            self._run.finish()
+
+
+NOOP_TRACE = TraceHandle()
+
+
+def _head_sampled(trace_id: str, sample_percent: int) -> bool:
+    if sample_percent >= 100:
+        return True
+    if sample_percent <= 0:
+        return False
+    digest = hashlib.blake2b(trace_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % 10_000 < sample_percent * 100
+
+
+class Tracer:
+    """Creates trace handles and ships their records to Langfuse in the background."""
+
+    def __init__(self, client: Any, enabled: bool):
+        self._client = client
+        self.enabled = enabled
+        self._buffer: Deque[_Record] = deque()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        # Exporter-thread state: live Langfuse clients by handle id, handle ids per trace
+        self._live: Dict[str, Any] = {}
+        self._members: Dict[str, List[str]] = {}
+        self._owner: Dict[str, str] = {}
+        # Live trace ids by last activity, least recent first
+        self._last_active: "OrderedDict[str, float]" = OrderedDict()
+        self.dropped = 0
+        self.exported = 0
+        self.promoted_runs = 0
+        self.evicted_traces = 0
+
+    def trace(self, **kwargs) -> TraceHandle:
+        """Start a trace; accepts the same arguments as Langfuse.trace()."""
+        if not self.enabled:
+            return NOOP_TRACE
+        trace_id = kwargs.get("id") or str(uuid.uuid4())
+        kwargs["id"] = trace_id
+        sampled = _head_sampled(trace_id, config.LANGFUSE_SAMPLE_PERCENT)
+        run = _RunState(self, trace_id, sampled, ("trace", None, trace_id, kwargs))
+        return TraceHandle(run, trace_id)
+
+    def _enqueue(self, record: _Record) -> None:
+        if len(self._buffer) >= config.LANGFUSE_BUFFER_SIZE:
+            self.dropped += 1
+            return
+        self._buffer.append(record)
+        self._ensure_started()
+        if len(self._buffer) >= config.LANGFUSE_BATCH_SIZE:
+            self._wakeup.set()
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None and not self._stopping.is_set():
+                self._thread = threading.Thread(target=self._run_exporter, name="trace-exporter", daemon=True)
+                self._thread.start()
+
+    def _run_exporter(self) -> None:
+        interval = config.LANGFUSE_EXPORT_INTERVAL_MS / 1000
+        while not self._stopping.is_set():
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            self._drain()
+        self._drain()
+        try:
+            self._client.flush()
+        except Exception as e:
+            logger.warning(f"Error flushing Langfuse on shutdown: {e}")
+
+    def _drain(self) -> None:
+        batch_size = config.LANGFUSE_BATCH_SIZE
+        while self._buffer:
+            batch = []
+            while self._buffer and len(batch) < batch_size:
+                batch.append(self._buffer.popleft())
+            self._export(batch)
+        self._evict_idle()
+
+    def _release(self, trace_id: str) -> None:
+        for member in self._members.pop(trace_id, []):
+            self._live.pop(member, None)
+            self._owner.pop(member, None)
+        self._live.pop(trace_id, None)
+        self._owner.pop(trace_id, None)
+        self._last_active.pop(trace_id, None)
+
+    def _touch(self, trace_id: Optional[str]) -> None:
+        if trace_id in self._last_active:
+            self._last_active[trace_id] = time.monotonic()
+            self._last_active.move_to_end(trace_id)
+
+    def _evict_idle(self) -> None:
+        """Release traces that were never finished: idle past the TTL, or the oldest beyond the cap."""
+        idle_before = time.monotonic() - config.LANGFUSE_LIVE_TRACE_TTL_SECONDS
+        while self._last_active:
+            trace_id, last_active = next(iter(self._last_active.items()))
+            if last_active >= idle_before and len(self._last_active) <= config.LANGFUSE_MAX_LIVE_TRACES:
+                break
+            self._release(trace_id)
+            self.evicted_traces += 1
+
+    def _export(self, batch: List[_Record]) -> None:
+        for op, target, new_id, kwargs in batch:
+            try:
+                if op == "trace":
+                    self._live[new_id] = self._client.trace(**kwargs)
+                    self._members.setdefault(new_id, [])
+                    self._owner[new_id] = new_id
+                    self._last_active[new_id] = time.monotonic()
+                elif op == "finish":
+                    self._release(target)
+                else:
+                    parent = self._live.get(target)
+                    if parent is None:
+                        continue
+                    trace_id = self._owner.get(target, target)
+                    self._touch(trace_id)
+                    result = getattr(parent, op)(**kwargs)
+                    if op in ("span", "generation"):
+                        self._live[new_id] = result
+                        self._owner[new_id] = trace_id
+                        self._members.setdefault(trace_id, []).append(new_id)
+                self.exported += 1
+            except Exception as e:
+                logger.debug(f"Failed to export trace record {op}: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "buffered": len(self._buffer),
+            "dropped": self.dropped,
+            "exported": self.exported,
+            "promoted_runs": self.promoted_runs,
+            "live_handles": len(self._live),
+            "live_traces": len(self._last_active),
+            "evicted_traces": self.evicted_traces,
+        }
+
+    def shutdown(self, timeout: float = 0) -> None:
+        """Stop the exporter; it drains and flushes on its own thread.
+
+        Waits at most `timeout` seconds, so callers on an event loop can pass 0.
+        """
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None and timeout > 0:
+            self._thread.join(timeout)
+
+
+tracer = Tracer(langfuse, langfuse_enabled)
+atexit.register(lambda: tracer.shutdown(timeout=config.LANGFUSE_SHUTDOWN_TIMEOUT_SECONDS))
@@ -0,0 +1,11 @@
+BEGIN;
+
+-- Keyset pagination of thread messages orders by (created_at, message_id)
+-- within a thread; this index serves every page with a single range scan
+CREATE INDEX IF NOT EXISTS idx_messages_thread_created_message
+    ON messages(thread_id, created_at, message_id);
+
+-- Covered by the composite index above
+DROP INDEX IF EXISTS idx_messages_thread_id;
+
+COMMIT;
@@ -0,0 +1,11 @@
+BEGIN;
+
+-- The thread list pages an account's threads on (created_at, thread_id),
+-- newest first; the index is scanned backwards from the cursor
+CREATE INDEX IF NOT EXISTS idx_threads_account_created_thread
+    ON threads(account_id, created_at, thread_id);
+
+-- Covered by the composite index above
+DROP INDEX IF EXISTS idx_threads_account_id;
+
+COMMIT;
@@ -0,0 +1,79 @@
+BEGIN;
+
+-- Denormalized tool index of each agent's current version, so the agent list
+-- can filter and sort by tools in the database
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS tool_names TEXT[] NOT NULL DEFAULT '{}';
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS has_mcp_tools BOOLEAN NOT NULL DEFAULT FALSE;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS has_agentpress_tools BOOLEAN NOT NULL DEFAULT FALSE;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS tools_count INTEGER NOT NULL DEFAULT 0;
+
+-- tool_names holds 'mcp:<name>' for configured MCPs and 'agentpress:<tool>'
+-- for enabled AgentPress tools; tools_count is the number of both
+CREATE OR REPLACE FUNCTION agent_tool_index(p_config JSONB)
+RETURNS TABLE (tool_names TEXT[], has_mcp_tools BOOLEAN, has_agentpress_tools BOOLEAN, tools_count INTEGER)
+LANGUAGE sql IMMUTABLE AS $$
+    WITH mcp AS (
+        SELECT m ->> 'name' AS name
+        FROM jsonb_array_elements(
+            CASE WHEN jsonb_typeof(p_config #> '{tools,mcp}') = 'array' THEN p_config #> '{tools,mcp}' ELSE '[]'::jsonb END
+        ) AS m
+    ),
+    agentpress AS (
+        SELECT t.key AS name
+        FROM jsonb_each(
+            CASE WHEN jsonb_typeof(p_config #> '{tools,agentpress}') = 'object' THEN p_config #> '{tools,agentpress}' ELSE '{}'::jsonb END
+        ) AS t
+        -- Versions store either {"enabled": true, ...} or a bare boolean per tool
+        WHERE t.value = 'true'::jsonb
+           OR (jsonb_typeof(t.value) = 'object' AND t.value -> 'enabled' = 'true'::jsonb)
+    )
+    SELECT
+        ARRAY(
+            SELECT 'mcp:' || name FROM mcp WHERE name IS NOT NULL
+            UNION
+            SELECT 'agentpress:' || name FROM agentpress
+        ),
+        EXISTS (SELECT 1 FROM mcp),
+        EXISTS (SELECT 1 FROM agentpress),
+        ((SELECT count(*) FROM mcp) + (SELECT count(*) FROM agentpress))::integer
+$$;
+
+-- Versions are immutable, so the index only changes when an agent's current
+-- version does: on version creation, activation and rollback
+CREATE OR REPLACE FUNCTION sync_agent_tool_index()
+RETURNS TRIGGER
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    idx RECORD;
+BEGIN
+    SELECT * INTO idx FROM agent_tool_index(
+        (SELECT config FROM agent_versions WHERE version_id = NEW.current_version_id)
+    );
+    NEW.tool_names := idx.tool_names;
+    NEW.has_mcp_tools := idx.has_mcp_tools;
+    NEW.has_agentpress_tools := idx.has_agentpress_tools;
+    NEW.tools_count := idx.tools_count;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_sync_agent_tool_index ON agents;
+CREATE TRIGGER trigger_sync_agent_tool_index
+    BEFORE INSERT OR UPDATE OF current_version_id ON agents
+    FOR EACH ROW
+    EXECUTE FUNCTION sync_agent_tool_index();
+
+-- Backfill; touching current_version_id runs the trigger. updated_at is left
+-- alone so the list's updated_at ordering does not change
+ALTER TABLE agents DISABLE TRIGGER trigger_agents_updated_at;
+UPDATE agents SET current_version_id = current_version_id WHERE current_version_id IS NOT NULL;
+ALTER TABLE agents ENABLE TRIGGER trigger_agents_updated_at;
+
+CREATE INDEX IF NOT EXISTS idx_agents_tool_names ON agents USING GIN (tool_names);
+CREATE INDEX IF NOT EXISTS idx_agents_account_tools_count ON agents(account_id, tools_count);
+CREATE INDEX IF NOT EXISTS idx_agents_account_has_mcp_tools ON agents(account_id, has_mcp_tools);
+CREATE INDEX IF NOT EXISTS idx_agents_account_has_agentpress_tools ON agents(account_id, has_agentpress_tools);
+
+COMMIT;
@@ -0,0 +1,29 @@
+BEGIN;
+
+-- The API caches thread access decisions for a short time; tell it when the
+-- data those decisions depend on changes so it can drop them
+CREATE OR REPLACE FUNCTION notify_access_changed()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('access_changed', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS access_changed_account_user ON basejump.account_user;
+CREATE TRIGGER access_changed_account_user
+    AFTER INSERT OR UPDATE OR DELETE ON basejump.account_user
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_access_changed();
+
+DROP TRIGGER IF EXISTS access_changed_projects ON projects;
+CREATE TRIGGER access_changed_projects
+    AFTER UPDATE OF account_id, is_public ON projects
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_access_changed();
+
+DROP TRIGGER IF EXISTS access_changed_threads ON threads;
+CREATE TRIGGER access_changed_threads
+    AFTER UPDATE OF account_id, project_id ON threads
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_access_changed();
+
+COMMIT;
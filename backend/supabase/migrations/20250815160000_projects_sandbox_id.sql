@@ -0,0 +1,9 @@
+BEGIN;
+
+-- Sandbox file endpoints look projects up by sandbox id; a generated column
+-- keeps the id out of the JSONB so the lookup can use a plain B-tree
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS sandbox_id TEXT GENERATED ALWAYS AS (sandbox ->> 'id') STORED;
+
+CREATE INDEX IF NOT EXISTS idx_projects_sandbox_id ON projects(sandbox_id) WHERE sandbox_id IS NOT NULL;
+
+COMMIT;
@@ -0,0 +1,102 @@
+BEGIN;
+
+-- The Suna default agent runs with SunaConfig.DEFAULT_TOOLS, not the
+-- AgentPress tools stored in its version (see extract_agent_config), so its
+-- tool index is built from a copy of those defaults kept here. The backend
+-- replaces the copy through set_suna_default_tools when the Suna config changes.
+CREATE TABLE IF NOT EXISTS suna_default_tools (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    agentpress JSONB NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+ALTER TABLE suna_default_tools ENABLE ROW LEVEL SECURITY;
+
+INSERT INTO suna_default_tools (agentpress) VALUES ('{
+    "sb_shell_tool": true,
+    "browser_tool": true,
+    "sb_deploy_tool": true,
+    "sb_expose_tool": true,
+    "web_search_tool": true,
+    "sb_vision_tool": true,
+    "sb_image_edit_tool": true,
+    "data_providers_tool": true,
+    "sb_sheets_tool": true,
+    "sb_files_tool": true
+}'::jsonb)
+ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION agent_index_config(p_version_id UUID, p_metadata JSONB)
+RETURNS JSONB
+LANGUAGE sql STABLE AS $$
+    SELECT CASE
+        WHEN COALESCE((p_metadata ->> 'is_suna_default')::boolean, FALSE) THEN
+            jsonb_set(
+                COALESCE(v.config, '{}'::jsonb),
+                '{tools}',
+                COALESCE(v.config -> 'tools', '{}'::jsonb)
+                    || jsonb_build_object('agentpress', (SELECT agentpress FROM suna_default_tools))
+            )
+        ELSE v.config
+    END
+    FROM (SELECT (SELECT config FROM agent_versions WHERE version_id = p_version_id) AS config) AS v
+$$;
+
+CREATE OR REPLACE FUNCTION sync_agent_tool_index()
+RETURNS TRIGGER
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    idx RECORD;
+BEGIN
+    SELECT * INTO idx FROM agent_tool_index(agent_index_config(NEW.current_version_id, NEW.metadata));
+    NEW.tool_names := idx.tool_names;
+    NEW.has_mcp_tools := idx.has_mcp_tools;
+    NEW.has_agentpress_tools := idx.has_agentpress_tools;
+    NEW.tools_count := idx.tools_count;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- metadata decides whether the agent is the Suna default
+DROP TRIGGER IF EXISTS trigger_sync_agent_tool_index ON agents;
+CREATE TRIGGER trigger_sync_agent_tool_index
+    BEFORE INSERT OR UPDATE OF current_version_id, metadata ON agents
+    FOR EACH ROW
+    EXECUTE FUNCTION sync_agent_tool_index();
+
+-- Store new Suna defaults and reindex the Suna agents; a no-op if unchanged
+CREATE OR REPLACE FUNCTION set_suna_default_tools(p_agentpress JSONB)
+RETURNS INTEGER
+SECURITY DEFINER
+SET search_path = public
+LANGUAGE plpgsql AS $$
+DECLARE
+    reindexed INTEGER;
+BEGIN
+    UPDATE suna_default_tools SET agentpress = p_agentpress, updated_at = NOW()
+    WHERE id AND agentpress IS DISTINCT FROM p_agentpress;
+    IF NOT FOUND THEN
+        RETURN 0;
+    END IF;
+
+    ALTER TABLE agents DISABLE TRIGGER trigger_agents_updated_at;
+    UPDATE agents SET current_version_id = current_version_id
+    WHERE COALESCE((metadata ->> 'is_suna_default')::boolean, FALSE);
+    GET DIAGNOSTICS reindexed = ROW_COUNT;
+    ALTER TABLE agents ENABLE TRIGGER trigger_agents_updated_at;
+    RETURN reindexed;
+END;
+$$;
+
+REVOKE ALL ON FUNCTION set_suna_default_tools(JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION set_suna_default_tools(JSONB) TO service_role;
+
+-- Backfill the Suna agents with the defaults
+ALTER TABLE agents DISABLE TRIGGER trigger_agents_updated_at;
+UPDATE agents SET current_version_id = current_version_id
+WHERE COALESCE((metadata ->> 'is_suna_default')::boolean, FALSE);
+ALTER TABLE agents ENABLE TRIGGER trigger_agents_updated_at;
+
+COMMIT;
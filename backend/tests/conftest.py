@@ -0,0 +1,37 @@
+"""
+Shared test setup.
+
+Run from the backend directory: `python -m pytest`. Modules read their
+configuration at import time, so required settings get placeholder values
+here; nothing in the unit tests talks to the real services.
+"""
+
+import os
+
+import fakeredis
+import pytest
+
+for name in (
+    "SUPABASE_URL",
+    "SUPABASE_ANON_KEY",
+    "SUPABASE_SERVICE_ROLE_KEY",
+    "REDIS_HOST",
+    "DAYTONA_API_KEY",
+    "DAYTONA_SERVER_URL",
+    "DAYTONA_TARGET",
+    "TAVILY_API_KEY",
+    "RAPID_API_KEY",
+    "FIRECRAWL_API_KEY",
+):
+    os.environ.setdefault(name, "test")
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """Point services.redis at an in-memory Redis that runs Lua scripts."""
+    from services import redis
+
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(redis, "client", client)
+    monkeypatch.setattr(redis, "_initialized", True)
+    return client
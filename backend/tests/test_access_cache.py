@@ -0,0 +1,44 @@
+import pytest
+
+from utils import access_cache
+
+
+def _counting_check():
+    calls = []
+
+    async def check():
+        calls.append(1)
+    return check, calls
+
+
+@pytest.mark.asyncio
+async def test_grants_are_not_shared_without_the_listener(fake_redis, monkeypatch):
+    monkeypatch.setattr(access_cache, "_listening", False)
+    check, calls = _counting_check()
+    for _ in range(2):
+        await access_cache.cached_access("thread", "thread-1", "user-1", check)
+    assert len(calls) == 2
+    assert await fake_redis.keys("access:*") == []
+
+
+@pytest.mark.asyncio
+async def test_listened_grants_are_shared_until_invalidated(fake_redis, monkeypatch):
+    monkeypatch.setattr(access_cache, "_listening", True)
+    check, calls = _counting_check()
+    await access_cache.cached_access("thread", "thread-1", "user-1", check)
+    await access_cache.cached_access("thread", "thread-1", "user-1", check)
+    assert len(calls) == 1
+
+    await access_cache.invalidate_all()
+    await access_cache.cached_access("thread", "thread-1", "user-1", check)
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_grants_are_memoized_within_a_request(fake_redis, monkeypatch):
+    monkeypatch.setattr(access_cache, "_listening", False)
+    check, calls = _counting_check()
+    with access_cache.request_scope():
+        await access_cache.cached_access("sandbox", "sandbox-1", "user-1", check)
+        await access_cache.cached_access("sandbox", "sandbox-1", "user-1", check)
+    assert len(calls) == 1
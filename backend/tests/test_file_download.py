@@ -0,0 +1,144 @@
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from sandbox import file_download
+from sandbox.file_download import RangeNotSatisfiable, etag_matches, file_etag, open_file_stream, parse_range
+from utils.config import config
+
+SIZE = 1000
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-199", (100, 199)),
+    ("bytes=900-", (900, 999)),          # open-ended
+    ("bytes=0-", (0, 999)),
+    ("bytes=990-5000", (990, 999)),      # end clamped to the file
+    ("bytes=999-999", (999, 999)),
+    ("bytes=-100", (900, 999)),          # suffix: last 100 bytes
+    ("bytes=-5000", (0, 999)),           # suffix longer than the file
+    ("bytes= 10-20", (10, 20)),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, SIZE) == expected
+
+
+@pytest.mark.parametrize("header", [
+    None,
+    "",
+    "items=0-10",        # unknown unit
+    "bytes=0-10,20-30",  # multi-range: whole file
+    "bytes=abc-10",
+    "bytes=20-10",       # inverted: ignored
+    "bytes=-",
+])
+def test_parse_range_sends_whole_file(header):
+    assert parse_range(header, SIZE) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=1000-2000", "bytes=5000-6000", "bytes=-0"])
+def test_parse_range_not_satisfiable(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, SIZE)
+
+
+@pytest.mark.parametrize("header", ["bytes=0-", "bytes=-5"])
+def test_parse_range_of_empty_file(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, 0)
+
+
+def test_file_etag_is_strong_and_tracks_changes():
+    etag = file_etag("/workspace/a.txt", 10, "2025-08-01T12:00:00Z")
+    assert etag.startswith('"') and etag.endswith('"') and not etag.startswith("W/")
+    assert etag == file_etag("/workspace/a.txt", 10, "2025-08-01T12:00:00Z")
+    assert etag != file_etag("/workspace/a.txt", 11, "2025-08-01T12:00:00Z")
+    assert etag != file_etag("/workspace/a.txt", 10, "2025-08-01T12:00:01Z")
+    assert etag != file_etag("/workspace/b.txt", 10, "2025-08-01T12:00:00Z")
+
+
+ETAG = '"abc123"'
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ("", False),
+    ('"abc123"', True),
+    ('W/"abc123"', True),               # weak comparison
+    ('"other"', False),
+    ('"other", "abc123"', True),        # list
+    ('"other",W/"abc123"', True),
+    ('"one", "two"', False),
+    ("*", True),
+    (" * ", True),
+    ("abc123", False),                  # unquoted is not the same tag
+])
+def test_etag_matches(header, expected):
+    assert etag_matches(header, ETAG) is expected
+
+
+CONTENT = bytes(range(256)) * 4
+
+
+class StubToolboxApi:
+    def _download_file_serialize(self, sandbox_id, path, **_):
+        return "GET", f"http://toolbox/{sandbox_id}/files/download?path={path}", {"Authorization": "Bearer test"}
+
+
+@pytest.fixture
+def toolbox(monkeypatch):
+    """A toolbox that serves CONTENT, honouring Range unless told not to."""
+    state = {"honour_range": True, "ranges": []}
+
+    def handler(request):
+        header = request.headers.get("range")
+        state["ranges"].append(header)
+        if header and state["honour_range"]:
+            start, end = (int(value) for value in header[len("bytes="):].split("-"))
+            return httpx.Response(206, content=CONTENT[start:end + 1])
+        return httpx.Response(200, content=CONTENT)
+
+    monkeypatch.setattr(config, "SANDBOX_DOWNLOAD_CHUNK_BYTES", 100)
+    monkeypatch.setattr(file_download, "_http_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return state
+
+
+def _sandbox(fs):
+    return SimpleNamespace(id="sandbox-1", fs=fs)
+
+
+async def _read(chunks):
+    return b"".join([chunk async for chunk in chunks])
+
+
+@pytest.mark.asyncio
+async def test_stream_forwards_the_range(toolbox):
+    sandbox = _sandbox(SimpleNamespace(_toolbox_api=StubToolboxApi()))
+    assert await _read(await open_file_stream(sandbox, "/workspace/a.bin", len(CONTENT), (250, 649))) == CONTENT[250:650]
+    assert toolbox["ranges"] == ["bytes=250-649"]
+
+
+@pytest.mark.asyncio
+async def test_stream_trims_a_full_body_to_the_range(toolbox):
+    toolbox["honour_range"] = False
+    sandbox = _sandbox(SimpleNamespace(_toolbox_api=StubToolboxApi()))
+    assert await _read(await open_file_stream(sandbox, "/workspace/a.bin", len(CONTENT), (250, 649))) == CONTENT[250:650]
+
+
+@pytest.mark.asyncio
+async def test_stream_stops_at_the_announced_size(toolbox):
+    sandbox = _sandbox(SimpleNamespace(_toolbox_api=StubToolboxApi()))
+    assert await _read(await open_file_stream(sandbox, "/workspace/a.bin", 300)) == CONTENT[:300]
+
+
+@pytest.mark.asyncio
+async def test_stream_falls_back_to_whole_file_downloads(toolbox):
+    async def download_file(path):
+        return CONTENT
+
+    sandbox = _sandbox(SimpleNamespace(download_file=download_file))
+    assert await _read(await open_file_stream(sandbox, "/workspace/a.bin", len(CONTENT), (250, 649))) == CONTENT[250:650]
+    assert await _read(await open_file_stream(sandbox, "/workspace/a.bin", 300)) == CONTENT[:300]
+    assert toolbox["ranges"] == []
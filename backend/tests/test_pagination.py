@@ -0,0 +1,103 @@
+import re
+import uuid
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from utils.pagination import MIN_UUID, _quote, apply_keyset, decode_cursor, encode_cursor, rewind_cursor
+
+
+class RecordingQuery:
+    """Records the PostgREST builder calls apply_keyset makes."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+        return call
+
+
+ROW = {"created_at": "2025-08-01T12:00:00.123456+00:00", "message_id": "3f0c6a2e-8d1b-4c55-9a43-2b7f1e0d9c11"}
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(ROW, "created_at", "message_id")
+    assert decode_cursor(cursor) == (ROW["created_at"], ROW["message_id"])
+
+
+def test_cursor_is_url_safe_and_unpadded():
+    cursor = encode_cursor({"k": "??>>~~", "id": "a/b+c"}, "k", "id")
+    assert not set(cursor) & set("+/=")
+    assert decode_cursor(cursor) == ("??>>~~", "a/b+c")
+
+
+def test_cursor_round_trips_numeric_sort_values_and_ids():
+    cursor = encode_cursor({"position": 42, "id": 7}, "position", "id")
+    assert decode_cursor(cursor) == (42, "7")
+
+
+@pytest.mark.parametrize("cursor", [None, ""])
+def test_no_cursor(cursor):
+    assert decode_cursor(cursor) is None
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "e30", "WzFd"])  # garbage, {}, [1]
+def test_malformed_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as excinfo:
+        decode_cursor(cursor)
+    assert excinfo.value.status_code == 400
+
+
+def test_quote_escapes_quotes_and_backslashes():
+    assert _quote("2025-08-01T12:00:00+00:00") == '"2025-08-01T12:00:00+00:00"'
+    assert _quote('a"b\\c') == '"a\\"b\\\\c"'
+
+
+def test_apply_keyset_without_cursor_only_orders():
+    query = apply_keyset(RecordingQuery(), "created_at", "message_id", None, newer=False)
+    assert query.calls == [
+        ("order", ("created_at",), {"desc": True}),
+        ("order", ("message_id",), {"desc": True}),
+    ]
+
+
+@pytest.mark.parametrize("newer, bound, op", [(True, "gte", "gt"), (False, "lte", "lt")])
+def test_apply_keyset_starts_after_cursor(newer, bound, op):
+    query = apply_keyset(RecordingQuery(), "created_at", "message_id", (ROW["created_at"], ROW["message_id"]), newer=newer)
+    ts, row_id = f'"{ROW["created_at"]}"', f'"{ROW["message_id"]}"'
+    assert query.calls == [
+        (bound, ("created_at", ROW["created_at"]), {}),
+        ("or_", (f"created_at.{op}.{ts},and(created_at.eq.{ts},message_id.{op}.{row_id})",), {}),
+        ("order", ("created_at",), {"desc": not newer}),
+        ("order", ("message_id",), {"desc": not newer}),
+    ]
+
+
+def test_rewind_cursor_moves_back_and_covers_the_whole_instant():
+    assert rewind_cursor((ROW["created_at"], ROW["message_id"]), 5) == ("2025-08-01T11:59:55.123456+00:00", MIN_UUID)
+    assert rewind_cursor(("2025-08-01T00:00:02+00:00", "x"), 5) == ("2025-07-31T23:59:57+00:00", MIN_UUID)
+    assert MIN_UUID < ROW["message_id"]
+
+
+def test_rewound_filter_values_fit_timestamp_and_uuid_columns():
+    # Every value compared against message_id must cast to uuid, or Postgres rejects the query
+    cursor = rewind_cursor((ROW["created_at"], ROW["message_id"]), 5)
+    query = apply_keyset(RecordingQuery(), "created_at", "message_id", cursor, newer=True)
+    (or_filter,) = next(args for name, args, _ in query.calls if name == "or_")
+    comparisons = re.findall(r'(\w+)\.(?:gt|eq)\."((?:[^"\\]|\\.)*)"', or_filter)
+    assert len(comparisons) == 3
+    for column, value in comparisons:
+        if column == "message_id":
+            uuid.UUID(value)
+        else:
+            datetime.fromisoformat(value)
+    assert f'message_id.gt."{MIN_UUID}"' in or_filter
+
+
+def test_rewind_cursor_rejects_non_timestamps():
+    with pytest.raises(HTTPException):
+        rewind_cursor(("yesterday", "x"), 5)
@@ -0,0 +1,46 @@
+import pytest
+
+from services.run_admission import RunAdmission
+from utils.config import config
+
+
+@pytest.fixture
+def admission(monkeypatch):
+    monkeypatch.setattr(config, "WORKER_MAX_CONCURRENT_RUNS", 2)
+    monkeypatch.setattr(config, "WORKER_MAX_RSS_MB", 0)
+    admission = RunAdmission()
+    yield admission
+    if admission._lag_monitor is not None:
+        admission._lag_monitor.cancel()
+
+
+@pytest.mark.asyncio
+async def test_try_admit_returns_none_instead_of_waiting(admission):
+    assert admission.try_admit("run-1") is not None
+    assert admission.try_admit("run-2") is not None
+    assert admission.try_admit("run-3") is None
+
+
+@pytest.mark.asyncio
+async def test_try_admit_keeps_reserved_slots_free(admission):
+    assert admission.try_admit("background-1", reserved_slots=1) is not None
+    assert admission.try_admit("background-2", reserved_slots=1) is None
+    assert admission.try_admit("interactive-1") is not None
+
+
+@pytest.mark.asyncio
+async def test_rekeyed_slot_is_released_under_its_run(admission):
+    slot = admission.try_admit("dispatch:pending")
+    admission.rekey(slot, "run-1", 2.5)
+    assert admission.get("dispatch:pending") is None
+    assert admission.get("run-1") is slot and slot.queued_seconds == 2.5
+    await admission.release(slot)
+    assert admission.stats()["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_unreserved_slot_is_not_counted_as_admitted(admission):
+    slot = admission.try_admit("dispatch:pending")
+    await admission.unreserve(slot)
+    assert admission.stats()["active"] == 0
+    assert admission.admitted == 0
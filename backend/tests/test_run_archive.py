@@ -0,0 +1,91 @@
+import pytest
+
+from services import run_archive
+from services.run_stream import response_list_key
+from utils.config import config
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "RUN_ARCHIVE_BUCKET", None)
+    monkeypatch.setattr(config, "RUN_ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "RUN_ARCHIVE_TAIL_RESPONSES", 3)
+    return tmp_path
+
+
+async def _store_responses(fake_redis, agent_run_id, count):
+    responses = [f'{{"type": "status", "n": {i}}}' for i in range(count)]
+    await fake_redis.rpush(response_list_key(agent_run_id), *responses)
+    return responses
+
+
+@pytest.mark.asyncio
+async def test_archive_keeps_tail_and_indices(fake_redis, archive_dir):
+    responses = await _store_responses(fake_redis, "run-1", 10)
+    assert await run_archive.archive_run("run-1")
+
+    assert await fake_redis.lrange(response_list_key("run-1"), 0, -1) == responses[-3:]
+    meta = await fake_redis.hgetall(run_archive.archive_key("run-1"))
+    assert meta["count"] == "10" and meta["tail_offset"] == "7"
+    assert await fake_redis.ttl(response_list_key("run-1")) > 0
+    assert (archive_dir / run_archive.archive_path("run-1")).exists()
+
+    # Indices stay stable across the archive and the tail
+    assert await run_archive.read_responses("run-1", 0) == (0, responses)
+    assert await run_archive.read_responses("run-1", 5) == (5, responses[5:])
+    assert await run_archive.read_responses("run-1", 8) == (8, responses[8:])
+    assert await run_archive.read_responses("run-1", 10) == (10, [])
+
+
+@pytest.mark.asyncio
+async def test_short_streams_stay_in_redis(fake_redis, archive_dir):
+    responses = await _store_responses(fake_redis, "run-1", 3)
+    assert not await run_archive.archive_run("run-1")
+    assert await run_archive.read_responses("run-1", 1) == (1, responses[1:])
+    assert not await fake_redis.exists(run_archive.archive_key("run-1"))
+
+
+@pytest.mark.asyncio
+async def test_compaction_is_skipped_if_the_list_grew(fake_redis, archive_dir):
+    await _store_responses(fake_redis, "run-1", 10)
+    compacted = await fake_redis.eval(
+        run_archive._COMPACT_SCRIPT, 2, response_list_key("run-1"), run_archive.archive_key("run-1"),
+        9, 3, "run-1.jsonl.gz", 6, 100, 60,
+    )
+    assert compacted == 0
+    assert await fake_redis.llen(response_list_key("run-1")) == 10
+    assert not await fake_redis.exists(run_archive.archive_key("run-1"))
+
+
+@pytest.mark.asyncio
+async def test_cold_read_after_redis_keys_expired(fake_redis, archive_dir):
+    responses = await _store_responses(fake_redis, "run-1", 10)
+    await run_archive.archive_run("run-1")
+    await fake_redis.delete(response_list_key("run-1"), run_archive.archive_key("run-1"))
+
+    assert await run_archive.read_responses("run-1", 4) == (4, [])
+    assert await run_archive.read_responses("run-1", 4, allow_cold=True) == (4, responses[4:])
+
+
+@pytest.mark.asyncio
+async def test_missing_archive_serves_the_tail_at_its_own_index(fake_redis, archive_dir):
+    responses = await _store_responses(fake_redis, "run-1", 10)
+    await run_archive.archive_run("run-1")
+    (archive_dir / run_archive.archive_path("run-1")).unlink()
+
+    assert await run_archive.read_responses("run-1", 0) == (7, responses[7:])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("enabled, directory", [(False, "dir"), (True, None)])
+async def test_nothing_is_archived_without_a_shared_store(fake_redis, monkeypatch, tmp_path, enabled, directory):
+    monkeypatch.setattr(config, "RUN_ARCHIVE_ENABLED", enabled)
+    monkeypatch.setattr(config, "RUN_ARCHIVE_BUCKET", None)
+    monkeypatch.setattr(config, "RUN_ARCHIVE_DIR", str(tmp_path / directory) if directory else None)
+    monkeypatch.setattr(config, "RUN_ARCHIVE_TAIL_RESPONSES", 3)
+    responses = await _store_responses(fake_redis, "run-1", 10)
+
+    assert not run_archive.enabled()
+    assert not await run_archive.archive_run("run-1")
+    assert await fake_redis.lrange(response_list_key("run-1"), 0, -1) == responses
+    assert not any(tmp_path.iterdir())
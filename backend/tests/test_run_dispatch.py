@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+from services import run_dispatch
+
+
+async def _enqueue(account_id, agent_run_id, lane=run_dispatch.INTERACTIVE, weight=1):
+    return await run_dispatch.enqueue(lane, account_id, {"agent_run_id": agent_run_id}, weight=weight)
+
+
+async def _drain():
+    order = []
+    while (job := await run_dispatch.pop_next()) is not None:
+        order.append(job.run_kwargs["agent_run_id"])
+        await run_dispatch.ack(job.lane, job.job_id)
+    return order
+
+
+@pytest.mark.asyncio
+async def test_busy_account_does_not_starve_others(fake_redis):
+    for i in range(3):
+        await _enqueue("busy", f"busy-{i}")
+    await _enqueue("quiet", "quiet-0")
+    order = await _drain()
+    # quiet-0 ties with busy-0 for the first slot, ahead of the rest of busy's backlog
+    assert order.index("quiet-0") <= 1
+    assert [run for run in order if run.startswith("busy")] == ["busy-0", "busy-1", "busy-2"]
+
+
+@pytest.mark.asyncio
+async def test_weight_shortens_an_accounts_finish_tags(fake_redis):
+    for i in range(4):
+        await _enqueue("heavy", f"heavy-{i}", weight=4)
+    await _enqueue("light", "light-0")
+    await _enqueue("light", "light-1")
+    order = await _drain()
+    assert order.index("heavy-3") < order.index("light-1")
+
+
+@pytest.mark.asyncio
+async def test_interactive_lane_goes_first(fake_redis):
+    await _enqueue("a", "background-0", lane=run_dispatch.BACKGROUND)
+    await _enqueue("a", "interactive-0")
+    assert await _drain() == ["interactive-0", "background-0"]
+
+
+@pytest.mark.asyncio
+async def test_unknown_lane_is_rejected(fake_redis):
+    with pytest.raises(ValueError):
+        await _enqueue("a", "run", lane="bulk")
+
+
+@pytest.mark.asyncio
+async def test_taken_run_is_processing_until_acked(fake_redis):
+    await _enqueue("a", "run-1")
+    job = await run_dispatch.pop(run_dispatch.INTERACTIVE)
+    assert job.run_kwargs == {"agent_run_id": "run-1"}
+    assert job.wait_ms >= 0
+    stats = (await run_dispatch.lane_stats())[run_dispatch.INTERACTIVE]
+    assert stats["depth"] == 0 and stats["processing"] == 1 and stats["dispatched"] == 1
+
+    await run_dispatch.ack(job.lane, job.job_id)
+    assert (await run_dispatch.lane_stats())[run_dispatch.INTERACTIVE]["processing"] == 0
+    keys = run_dispatch._lane_keys(run_dispatch.INTERACTIVE)
+    assert not await fake_redis.hexists(keys[1], job.job_id)
+    assert not await fake_redis.hexists(keys[4], job.job_id)
+    assert await run_dispatch.pop(run_dispatch.INTERACTIVE) is None
+
+
+@pytest.mark.asyncio
+async def test_unacked_run_is_requeued_at_the_front_then_dropped(fake_redis):
+    await _enqueue("a", "lost")
+    lost = await run_dispatch.pop(run_dispatch.INTERACTIVE)
+    await _enqueue("b", "queued")
+
+    # A negative timeout puts the cutoff after every pop, even one in the same millisecond
+    for attempt in range(1, run_dispatch.MAX_DISPATCH_ATTEMPTS):
+        assert await run_dispatch.requeue_expired(timeout_seconds=-1) == {run_dispatch.INTERACTIVE: 1}
+        again = await run_dispatch.pop(run_dispatch.INTERACTIVE)
+        assert again.job_id == lost.job_id
+
+    # The last attempt drops the run instead of requeuing it
+    assert await run_dispatch.requeue_expired(timeout_seconds=-1) == {}
+    keys = run_dispatch._lane_keys(run_dispatch.INTERACTIVE)
+    assert not await fake_redis.hexists(keys[1], lost.job_id)
+    assert not await fake_redis.hexists(keys[7], lost.job_id)
+    assert await _drain() == ["queued"]
+
+
+@pytest.mark.asyncio
+async def test_requeue_leaves_recent_runs_alone(fake_redis):
+    await _enqueue("a", "run-1")
+    job = await run_dispatch.pop(run_dispatch.INTERACTIVE)
+    assert await run_dispatch.requeue_expired(timeout_seconds=600) == {}
+    payload = await fake_redis.hget(run_dispatch._lane_keys(run_dispatch.INTERACTIVE)[1], job.job_id)
+    assert json.loads(payload) == {"agent_run_id": "run-1"}
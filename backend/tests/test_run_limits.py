@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+import pytest
+
+from services import run_limits
+
+
+@pytest.mark.asyncio
+async def test_reserve_takes_slots_up_to_the_limit(fake_redis):
+    assert await run_limits.reserve("acc", "run-1", "thread-1", 2) == (True, [])
+    assert await run_limits.reserve("acc", "run-2", "", 2) == (True, ["thread-1"])
+    reserved, thread_ids = await run_limits.reserve("acc", "run-3", "thread-3", 2)
+    assert not reserved
+    assert sorted(thread_ids) == ["", "thread-1"]
+    assert await fake_redis.zcard(run_limits.account_runs_key("acc")) == 2
+    assert await fake_redis.sismember(run_limits.TRACKED_ACCOUNTS_KEY, "acc")
+
+
+@pytest.mark.asyncio
+async def test_concurrent_reserves_never_exceed_the_limit(fake_redis):
+    results = await asyncio.gather(*(run_limits.reserve("acc", f"run-{i}", f"t-{i}", 3) for i in range(10)))
+    assert sum(reserved for reserved, _ in results) == 3
+    assert await fake_redis.zcard(run_limits.account_runs_key("acc")) == 3
+
+
+@pytest.mark.asyncio
+async def test_release_frees_the_slot(fake_redis):
+    await run_limits.reserve("acc", "run-1", "thread-1", 1)
+    assert not (await run_limits.reserve("acc", "run-2", "thread-2", 1))[0]
+    await run_limits.release("acc", "run-1")
+    assert await run_limits.reserve("acc", "run-2", "thread-2", 1) == (True, [])
+
+
+@pytest.mark.asyncio
+async def test_runs_outside_the_window_do_not_count(fake_redis):
+    old = time.time() - run_limits.RUN_LIMIT_WINDOW_SECONDS - 10
+    await fake_redis.zadd(run_limits.account_runs_key("acc"), {"stale": old})
+    await fake_redis.hset(run_limits.account_threads_key("acc"), "stale", "thread-stale")
+    assert await run_limits.reserve("acc", "run-1", "thread-1", 1) == (True, [])
+    assert not await fake_redis.hexists(run_limits.account_threads_key("acc"), "stale")
+
+
+@pytest.mark.asyncio
+async def test_started_run_keeps_its_reserved_slot_and_finishing_frees_it(fake_redis):
+    await run_limits.reserve("acc", "run-1", "", 1)
+    await run_limits.run_started("acc", "proj", "run-1", "thread-1")
+    assert await run_limits.running_thread_ids("acc") == ["thread-1"]
+    assert await run_limits.project_running_run("proj") == "run-1"
+
+    await run_limits.run_finished("run-1")
+    assert await run_limits.running_thread_ids("acc") == []
+    assert await run_limits.project_running_run("proj") is None
+    assert not await fake_redis.exists(run_limits.run_owner_key("run-1"))
+
+
+@pytest.mark.asyncio
+async def test_abandoned_provisioning_is_returned_once(fake_redis):
+    await run_limits.provisioning_started("run-1")
+    await fake_redis.zadd(run_limits.PROVISIONING_KEY, {"run-old": time.time() - 1000})
+    assert await run_limits.abandoned_provisioning(900) == ["run-old"]
+    assert await run_limits.abandoned_provisioning(900) == []
+    await run_limits.provisioning_finished("run-1")
+    assert not await fake_redis.exists(run_limits.PROVISIONING_KEY)
@@ -0,0 +1,49 @@
+import pytest
+
+from services import run_registry
+
+
+@pytest.mark.asyncio
+async def test_claim_and_release(fake_redis):
+    await run_registry.claim_run("run-1", "inst-a")
+    await run_registry.claim_run("run-2", "inst-a")
+    assert await fake_redis.get(run_registry.active_run_key("inst-a", "run-1")) == "running"
+    assert await fake_redis.ttl(run_registry.active_run_key("inst-a", "run-1")) > 0
+    assert sorted(await run_registry.runs_for_instance("inst-a")) == ["run-1", "run-2"]
+    assert await run_registry.instances_for_run("run-1") == ["inst-a"]
+    assert await fake_redis.smembers(run_registry.INSTANCES_KEY) == {"inst-a"}
+
+    await run_registry.release_run("run-1", "inst-a")
+    assert not await fake_redis.exists(run_registry.active_run_key("inst-a", "run-1"))
+    assert await run_registry.runs_for_instance("inst-a") == ["run-2"]
+    assert await run_registry.instances_for_run("run-1") == []
+
+
+@pytest.mark.asyncio
+async def test_reconcile_drops_runs_whose_liveness_key_expired(fake_redis):
+    await run_registry.claim_run("alive", "inst-a")
+    await run_registry.claim_run("dead", "inst-a")
+    await run_registry.claim_run("dead-too", "inst-b")
+    await fake_redis.delete(run_registry.active_run_key("inst-a", "dead"))
+    await fake_redis.delete(run_registry.active_run_key("inst-b", "dead-too"))
+
+    assert await run_registry.reconcile_all() == 2
+    assert await run_registry.runs_for_instance("inst-a") == ["alive"]
+    assert await run_registry.instances_for_run("dead") == []
+    # inst-b has nothing left and is forgotten; inst-a still has a run
+    assert await fake_redis.smembers(run_registry.INSTANCES_KEY) == {"inst-a"}
+
+
+@pytest.mark.asyncio
+async def test_instance_with_runs_is_not_forgotten(fake_redis):
+    await fake_redis.sadd(run_registry.INSTANCES_KEY, "inst-a")
+    await fake_redis.sadd(run_registry.instance_runs_key("inst-a"), "run-1")
+    result = await fake_redis.eval(
+        run_registry._FORGET_INSTANCE_SCRIPT, 2, run_registry.instance_runs_key("inst-a"), run_registry.INSTANCES_KEY, "inst-a",
+    )
+    assert result == 0
+    assert await fake_redis.sismember(run_registry.INSTANCES_KEY, "inst-a")
+
+    await fake_redis.delete(run_registry.instance_runs_key("inst-a"))
+    assert await run_registry.reconcile_instance("inst-a") == 0
+    assert not await fake_redis.exists(run_registry.INSTANCES_KEY)
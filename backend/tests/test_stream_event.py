@@ -0,0 +1,34 @@
+import pytest
+
+from agentpress.stream_event import StreamEvent
+
+
+@pytest.mark.parametrize("mutate", [
+    lambda event: event.__setitem__("type", "status"),
+    lambda event: event.__delitem__("type"),
+    lambda event: event.update(type="status"),
+    lambda event: event.pop("type"),
+    lambda event: event.popitem(),
+    lambda event: event.setdefault("sequence", 1),
+    lambda event: event.clear(),
+])
+def test_mutation_drops_the_cached_encoding(mutate):
+    event = StreamEvent(type="assistant", content={"text": "hi"})
+    before = event.encode(2)
+    mutate(event)
+    assert event.encode(2) != before
+
+
+def test_in_place_union_drops_the_cached_encoding():
+    event = StreamEvent(type="assistant", content={"text": "hi"})
+    before = event.encode(2)
+    event |= {"type": "status"}
+    assert isinstance(event, StreamEvent)
+    assert event.encode(2) != before
+
+
+def test_encoding_is_cached_until_mutated():
+    event = StreamEvent(type="assistant", content={"text": "hi"})
+    assert event.encode(2) is event.encode(2)
+    event.get("type")
+    assert event.encode(2) is event.encode(2)
@@ -4,10 +4,10 @@ from datetime import datetime, timezone
 from typing import Dict, Any, Tuple
 
 from services.supabase import DBConnection
-from services import redis
+from services import run_dispatch, run_limits, run_registry
 from utils.logger import logger, structlog
 from utils.config import config
-from run_agent_background import run_agent_background
+from run_agent_background import dispatch_agent_run
 from .trigger_service import TriggerEvent, TriggerResult
 from .utils import format_workflow_for_llm
 
@@ -226,10 +226,9 @@ class AgentExecutor:
             
             agent_data = agent_result.data[0]
             
-            from agent.versioning.version_service import get_version_service
-            version_service = await get_version_service()
-            
-            active_version = await version_service.get_active_version(agent_id, "system")
+            from agent.versioning import version_cache
+            version_id = await version_cache.get_current_version_id(agent_id)
+            active_version = await version_cache.get_version(version_id, agent_id) if version_id else None
             if not active_version:
                 return {
                     'agent_id': agent_id,
@@ -318,10 +317,12 @@ class AgentExecutor:
         }).execute()
         
         agent_run_id = agent_run.data[0]['id']
+        await run_limits.run_started(account_id, project_id, agent_run_id, thread_id)
         
         await self._register_agent_run(agent_run_id)
         
-        run_agent_background.send(
+        await dispatch_agent_run(
+            run_dispatch.BACKGROUND, account_id,
             agent_run_id=agent_run_id,
             thread_id=thread_id,
             instance_id="trigger_executor",
@@ -342,8 +343,7 @@ class AgentExecutor:
     
     async def _register_agent_run(self, agent_run_id: str) -> None:
         try:
-            instance_key = f"active_run:trigger_executor:{agent_run_id}"
-            await redis.set(instance_key, "running", ex=redis.REDIS_KEY_TTL)
+            await run_registry.claim_run(agent_run_id, "trigger_executor")
         except Exception as e:
             logger.warning(f"Failed to register agent run in Redis: {e}")
 
@@ -420,10 +420,9 @@ class WorkflowExecutor:
             agent_data = agent_result.data[0]
             account_id = agent_data['account_id']
             
-            from agent.versioning.version_service import get_version_service
-            version_service = await get_version_service()
-            
-            active_version = await version_service.get_active_version(agent_id, "system")
+            from agent.versioning import version_cache
+            version_id = await version_cache.get_current_version_id(agent_id)
+            active_version = await version_cache.get_version(version_id, agent_id) if version_id else None
             if not active_version:
                 raise ValueError(f"No active version found for agent {agent_id}")
             
@@ -587,10 +586,12 @@ class WorkflowExecutor:
         }).execute()
         
         agent_run_id = agent_run.data[0]['id']
+        await run_limits.run_started(account_id, project_id, agent_run_id, thread_id)
         
         await self._register_workflow_run(agent_run_id)
         
-        run_agent_background.send(
+        await dispatch_agent_run(
+            run_dispatch.BACKGROUND, account_id,
             agent_run_id=agent_run_id,
             thread_id=thread_id,
             instance_id=getattr(config, 'INSTANCE_ID', 'default'),
@@ -611,9 +612,7 @@ class WorkflowExecutor:
     
     async def _register_workflow_run(self, agent_run_id: str) -> None:
         try:
-            instance_id = getattr(config, 'INSTANCE_ID', 'default')
-            instance_key = f"active_run:{instance_id}:{agent_run_id}"
-            await redis.set(instance_key, "running", ex=redis.REDIS_KEY_TTL)
+            await run_registry.claim_run(agent_run_id, getattr(config, 'INSTANCE_ID', 'default'))
         except Exception as e:
             logger.warning(f"Failed to register workflow run in Redis: {e}")
 
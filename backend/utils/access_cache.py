@@ -0,0 +1,174 @@
+"""
+Request-scoped entity memo and short-lived access decisions.
+
+A single request often repeats the same authorization lookups: start_agent
+loads the thread, verify_thread_access loads it again, and the agent row is
+fetched once to check ownership and again by the version access check. Two
+layers remove the repeats:
+
+- RequestScope, set for each HTTP request by the middleware in api.py,
+  memoizes entity rows (threads, agents, sandbox projects) and access
+  decisions for the request's lifetime. Outside a request nothing is
+  memoized.
+- Granted access decisions ("thread", "sandbox") are also kept in Redis under
+  `access:{kind}:{resource_id}:{user_id}` for ACCESS_CACHE_TTL_SECONDS, so
+  repeat requests skip the database entirely. Denials are never cached.
+
+Each cached grant records the value of `access_epoch` when it was checked
+and only counts while the epoch is unchanged. The API bumps the epoch when
+Postgres notifies `access_changed` (account membership, project visibility
+or thread ownership changed; see the access_change_notify migration).
+Memberships and visibility are changed outside this API, so that
+notification is the only way to hear of a revocation: grants are only
+shared through Redis while the DATABASE_URL listener is running. Without it
+every request checks access again.
+
+Usage:
+    with request_scope():                         # once per request
+        thread = await access_cache.get_thread(client, thread_id)
+        await access_cache.cached_access("thread", thread_id, user_id, check)
+"""
+
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from services import postgres, redis
+from services.postgres import pg_pool
+from utils.config import config
+from utils.logger import logger
+
+ACCESS_EPOCH_KEY = "access_epoch"
+ACCESS_CHANGED_CHANNEL = "access_changed"
+
+# Set once access changes are being heard; until then grants are not shared across requests
+_listening = False
+
+
+class RequestScope:
+    """Rows and access decisions already fetched during one request."""
+
+    def __init__(self):
+        self.rows: Dict[Tuple[str, str], Any] = {}
+        self.granted: Set[Tuple[str, str, str]] = set()
+
+
+_scope: ContextVar[Optional[RequestScope]] = ContextVar("access_request_scope", default=None)
+
+
+@contextmanager
+def request_scope():
+    token = _scope.set(RequestScope())
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def _access_key(kind: str, resource_id: str, user_id: str) -> str:
+    return f"access:{kind}:{resource_id}:{user_id}"
+
+
+async def _memoized(kind: str, key: str, load: Callable[[], Awaitable[Any]]) -> Any:
+    scope = _scope.get()
+    if scope is not None and (kind, key) in scope.rows:
+        return scope.rows[(kind, key)]
+    row = await load()
+    if scope is not None:
+        scope.rows[(kind, key)] = row
+    return row
+
+
+async def get_thread(client, thread_id: str) -> Optional[Dict[str, Any]]:
+    """The threads row, fetched at most once per request."""
+    return await _memoized("thread", thread_id, lambda: postgres.get_thread(client, thread_id))
+
+
+async def get_agent(client, agent_id: str) -> Optional[Dict[str, Any]]:
+    """The agents row, fetched at most once per request. No access check."""
+    async def load():
+        result = await client.table('agents').select('*').eq('agent_id', agent_id).execute()
+        return result.data[0] if result.data else None
+    return await _memoized("agent", agent_id, load)
+
+
+async def get_sandbox_project(client, sandbox_id: str) -> Optional[Dict[str, Any]]:
+    """The projects row owning sandbox_id (indexed sandbox_id column), fetched at most once per request."""
+    async def load():
+        result = await client.table('projects').select('*').eq('sandbox_id', sandbox_id).limit(1).execute()
+        return result.data[0] if result.data else None
+    return await _memoized("sandbox_project", sandbox_id, load)
+
+
+async def cached_access(kind: str, resource_id: str, user_id: str, check: Callable[[], Awaitable[Any]]) -> None:
+    """
+    Run check (which raises when access is denied) unless a grant is cached.
+
+    A grant is remembered for the request and, while access changes are
+    being heard, in Redis; the epoch is read before check runs, so a change
+    notified meanwhile invalidates the grant.
+    """
+    scope = _scope.get()
+    decision = (kind, resource_id, user_id)
+    if scope is not None and decision in scope.granted:
+        return
+
+    epoch = None
+    if _listening:
+        try:
+            cached, epoch = await (await redis.get_client()).mget(_access_key(kind, resource_id, user_id), ACCESS_EPOCH_KEY)
+            epoch = epoch or "0"
+            if cached is not None and cached == epoch:
+                if scope is not None:
+                    scope.granted.add(decision)
+                return
+        except Exception as e:
+            logger.warning(f"Failed to read cached {kind} access for {resource_id}: {e}")
+
+    await check()
+
+    if scope is not None:
+        scope.granted.add(decision)
+    if epoch is not None:
+        try:
+            await redis.set(_access_key(kind, resource_id, user_id), epoch, ex=config.ACCESS_CACHE_TTL_SECONDS)
+        except Exception as e:
+            logger.warning(f"Failed to cache {kind} access for {resource_id}: {e}")
+
+
+async def invalidate_all() -> None:
+    """Invalidate every cached access grant."""
+    try:
+        await (await redis.get_client()).incr(ACCESS_EPOCH_KEY)
+    except Exception as e:
+        logger.warning(f"Failed to invalidate cached access decisions: {e}")
+
+
+# Invalidations in flight, referenced until done so they are not garbage collected
+_invalidation_tasks: Set[asyncio.Task] = set()
+
+
+async def start_invalidation_listener() -> None:
+    """Invalidate cached grants whenever Postgres notifies an access change (needs DATABASE_URL)."""
+    global _listening
+
+    def on_change(table: Optional[str]):
+        global _listening
+        _listening = True
+        if table is None:
+            logger.info("Access change listener reconnected, invalidating cached access decisions")
+        else:
+            logger.debug(f"Access-relevant change in {table}, invalidating cached access decisions")
+        task = asyncio.create_task(invalidate_all())
+        _invalidation_tasks.add(task)
+        task.add_done_callback(_invalidation_tasks.discard)
+
+    try:
+        if await pg_pool.listen(ACCESS_CHANGED_CHANNEL, on_change):
+            _listening = True
+        else:
+            logger.info("No Postgres listener; access decisions are not cached across requests")
+    except Exception as e:
+        # The listener keeps reconnecting; grants are cached once on_change reports it is back
+        logger.warning(f"Failed to listen for access changes: {e}")
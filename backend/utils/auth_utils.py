@@ -8,6 +8,7 @@ from utils.config import config
 import os
 from services.supabase import DBConnection
 from services import redis
+from utils import access_cache
 
 async def _get_user_id_from_account_cached(account_id: str) -> Optional[str]:
     """
@@ -305,32 +306,8 @@ async def verify_thread_access(client, thread_id: str, user_id: str):
         HTTPException: If the user doesn't have access to the thread
     """
     try:
-        # Query the thread to get account information
-        thread_result = await client.table('threads').select('*').eq('thread_id', thread_id).execute()
-
-        if not thread_result.data or len(thread_result.data) == 0:
-            raise HTTPException(status_code=404, detail="Thread not found")
-        
-        thread_data = thread_result.data[0]
-
-        if thread_data['account_id'] == user_id:
-            return True
-        
-        # Check if project is public
-        project_id = thread_data.get('project_id')
-        if project_id:
-            project_result = await client.table('projects').select('is_public').eq('project_id', project_id).execute()
-            if project_result.data and len(project_result.data) > 0:
-                if project_result.data[0].get('is_public'):
-                    return True
-            
-        account_id = thread_data.get('account_id')
-        # When using service role, we need to manually check account membership instead of using current_user_account_role
-        if account_id:
-            account_user_result = await client.schema('basejump').from_('account_user').select('account_role').eq('user_id', user_id).eq('account_id', account_id).execute()
-            if account_user_result.data and len(account_user_result.data) > 0:
-                return True
-        raise HTTPException(status_code=403, detail="Not authorized to access this thread")
+        await access_cache.cached_access("thread", thread_id, user_id, lambda: _check_thread_access(client, thread_id, user_id))
+        return True
     except HTTPException:
         # Re-raise HTTP exceptions as they are
         raise
@@ -347,6 +324,32 @@ async def verify_thread_access(client, thread_id: str, user_id: str):
                 detail=f"Error verifying thread access: {str(e)}"
             )
 
+async def _check_thread_access(client, thread_id: str, user_id: str):
+    # Query the thread to get account information
+    thread_data = await access_cache.get_thread(client, thread_id)
+
+    if not thread_data:
+        raise HTTPException(status_code=404, detail="Thread not found")
+
+    if thread_data['account_id'] == user_id:
+        return True
+        
+    # Check if project is public
+    project_id = thread_data.get('project_id')
+    if project_id:
+        project_result = await client.table('projects').select('is_public').eq('project_id', project_id).execute()
+        if project_result.data and len(project_result.data) > 0:
+            if project_result.data[0].get('is_public'):
+                return True
+        
+    account_id = thread_data.get('account_id')
+    # When using service role, we need to manually check account membership instead of using current_user_account_role
+    if account_id:
+        account_user_result = await client.schema('basejump').from_('account_user').select('account_role').eq('user_id', user_id).eq('account_id', account_id).execute()
+        if account_user_result.data and len(account_user_result.data) > 0:
+            return True
+    raise HTTPException(status_code=403, detail="Not authorized to access this thread")
+
 async def get_optional_user_id(request: Request) -> Optional[str]:
     """
     Extract the user ID from the JWT in the Authorization header if present,
@@ -421,12 +424,12 @@ async def verify_agent_access(client, agent_id: str, user_id: str) -> dict:
         HTTPException: If the user doesn't have access to the agent or agent doesn't exist
     """
     try:
-        agent_result = await client.table('agents').select('*').eq('agent_id', agent_id).eq('account_id', user_id).execute()
+        agent_data = await access_cache.get_agent(client, agent_id)
         
-        if not agent_result.data:
+        if not agent_data or agent_data.get('account_id') != user_id:
             raise HTTPException(status_code=404, detail="Agent not found or access denied")
         
-        return agent_result.data[0]
+        return agent_data
         
     except HTTPException:
         raise
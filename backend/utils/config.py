@@ -210,6 +210,13 @@ class Configuration:
     OR_SITE_URL: Optional[str] = "https://kortix.ai"
     OR_APP_NAME: Optional[str] = "Kortix AI"    
     
+    # Pooled HTTP transport for LLM provider calls
+    LLM_HTTP_POOL_ENABLED: bool = True
+    LLM_HTTP2_ENABLED: bool = True
+    LLM_HTTP_MAX_CONNECTIONS_PER_PROVIDER: int = 64
+    LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 32
+    LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS: int = 60
+    
     # AWS Bedrock credentials
     AWS_ACCESS_KEY_ID: Optional[str] = None
     AWS_SECRET_ACCESS_KEY: Optional[str] = None
@@ -222,6 +229,19 @@ class Configuration:
     SUPABASE_URL: str
     SUPABASE_ANON_KEY: str
     SUPABASE_SERVICE_ROLE_KEY: str
+    # Optional direct Postgres connection (asyncpg pool) for the hottest
+    # statements; everything goes through PostgREST when unset. Set the
+    # statement cache to 0 behind a transaction-mode pooler (port 6543).
+    # See services/postgres.py
+    DATABASE_URL: Optional[str] = None
+    DB_POOL_MIN_SIZE: int = 1
+    DB_POOL_MAX_SIZE: int = 10
+    DB_POOL_ACQUIRE_TIMEOUT_SECONDS: int = 2
+    DB_POOL_STATEMENT_CACHE_SIZE: int = 100
+    # Granted thread access decisions are cached this long, or until Postgres
+    # notifies an access change; only while that listener runs (DATABASE_URL).
+    # See utils/access_cache.py
+    ACCESS_CACHE_TTL_SECONDS: int = 60
     
     # Redis configuration
     REDIS_HOST: str
@@ -233,6 +253,8 @@ class Configuration:
     DAYTONA_API_KEY: str
     DAYTONA_SERVER_URL: str
     DAYTONA_TARGET: str
+    SANDBOX_HANDLE_CACHE_TTL_SECONDS: int = 30  # reuse started sandbox handles; see sandbox/sandbox.py
+    SANDBOX_DOWNLOAD_CHUNK_BYTES: int = 64 * 1024  # streamed file downloads; see sandbox/file_download.py
     
     # Search and other API keys
     TAVILY_API_KEY: str
@@ -260,6 +282,58 @@ class Configuration:
     LANGFUSE_PUBLIC_KEY: Optional[str] = None
     LANGFUSE_SECRET_KEY: Optional[str] = None
     LANGFUSE_HOST: str = "https://cloud.langfuse.com"
+    LANGFUSE_SAMPLE_PERCENT: int = 100
+    LANGFUSE_BUFFER_SIZE: int = 10000
+    LANGFUSE_BATCH_SIZE: int = 200
+    LANGFUSE_EXPORT_INTERVAL_MS: int = 1000
+    LANGFUSE_SHUTDOWN_TIMEOUT_SECONDS: int = 5
+    LANGFUSE_LIVE_TRACE_TTL_SECONDS: int = 3600
+    LANGFUSE_MAX_LIVE_TRACES: int = 5000
+
+    # Agent run response stream publishing
+    RUN_STREAM_MAX_PENDING: int = 512
+    RUN_STREAM_MAX_BATCH: int = 64
+    RUN_STREAM_WIRE_VERSION: int = 1  # format events are stored in; see agentpress/stream_event.py
+    # Per-client SSE buffer limit and what to do when a client falls behind it:
+    # "coalesce", "drop_status" or "disconnect"; see services/stream_buffer.py
+    RUN_STREAM_CLIENT_BUFFER_BYTES: int = 1024 * 1024
+    RUN_STREAM_SLOW_CLIENT_POLICY: str = "coalesce"
+    RUN_REGISTRY_RECONCILE_INTERVAL_SECONDS: int = 300
+    RUN_LIMITS_RECONCILE_INTERVAL_SECONDS: int = 120  # running-run counters vs. agent_runs; see services/run_limits.py
+    RUN_PROVISIONING_TIMEOUT_SECONDS: int = 900  # runs not dispatched after workspace provisioning are failed
+    RUN_LOCK_TTL_SECONDS: int = 120  # refreshed while the run is alive
+    RUN_CHECKPOINT_SWEEP_INTERVAL_SECONDS: int = 60
+    RUN_DISPATCH_CLAIM_TIMEOUT_SECONDS: int = 600  # taken but unclaimed runs are requeued after this; see services/run_dispatch.py
+
+    # Completed run responses are compacted to a gzip blob in RUN_ARCHIVE_BUCKET
+    # (Supabase storage) or RUN_ARCHIVE_DIR, keeping only a short tail in Redis.
+    # Off unless one is set; RUN_ARCHIVE_DIR must be shared by the API and the worker
+    RUN_ARCHIVE_ENABLED: bool = True
+    RUN_ARCHIVE_BUCKET: Optional[str] = None
+    RUN_ARCHIVE_DIR: Optional[str] = None
+    RUN_ARCHIVE_TAIL_RESPONSES: int = 50
+    RUN_ARCHIVE_TTL_SECONDS: int = 3600 * 24
+
+    # Agent versions are immutable and cached by version id; the agent ->
+    # current version pointer is cached briefly and invalidated when it moves
+    AGENT_VERSION_CACHE_TTL_SECONDS: int = 3600 * 24 * 7
+    AGENT_VERSION_POINTER_TTL_SECONDS: int = 300
+
+    # Thread messages polled with `since` re-read this far before the cursor, so
+    # rows whose insert committed after a newer one are not skipped
+    THREAD_MESSAGES_SINCE_OVERLAP_SECONDS: int = 5
+
+    # Parallel attachment uploads per initiate request
+    INITIATE_UPLOAD_CONCURRENCY: int = 4
+
+    # Worker run execution: with async runs enabled, each worker process runs
+    # admitted agent runs as tasks on its event loop instead of one per thread
+    WORKER_ASYNC_RUNS_ENABLED: bool = False
+    WORKER_MAX_CONCURRENT_RUNS: int = 16
+    WORKER_MAX_RSS_MB: int = 0  # 0 disables the memory admission check
+    WORKER_YIELD_EVERY_RESPONSES: int = 20
+    WORKER_DRAIN_TIMEOUT_SECONDS: int = 60
+    WORKER_INTERACTIVE_RESERVED_RUNS: int = 4  # slots background runs may not take
 
     # Admin API key for server-side operations
     KORTIX_ADMIN_API_KEY: Optional[str] = None
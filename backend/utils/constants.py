@@ -8,6 +8,13 @@ MODELS = {
             "input_cost_per_million_tokens": 3.00,
             "output_cost_per_million_tokens": 15.00
         },
+        "capabilities": {
+            "context_window": 200_000,
+            "max_output_tokens": 64_000,
+            "default_max_tokens": 8_192,
+            "supports_prompt_caching": True,
+            "tokenizer": "anthropic"
+        },
         "tier_availability": ["free", "paid"]
     },
     # "openrouter/deepseek/deepseek-chat": {
@@ -48,6 +55,13 @@ MODELS = {
             "input_cost_per_million_tokens": 1.00,
             "output_cost_per_million_tokens": 3.00
         },
+        "capabilities": {
+            "context_window": 131_072,
+            "max_output_tokens": 16_384,
+            "default_max_tokens": 8_192,
+            "supports_prompt_caching": False,
+            "tokenizer": "other"
+        },
         "tier_availability": ["free", "paid"]
     },
     "xai/grok-4": {
@@ -56,6 +70,13 @@ MODELS = {
             "input_cost_per_million_tokens": 5.00,
             "output_cost_per_million_tokens": 15.00
         },
+        "capabilities": {
+            "context_window": 256_000,
+            "max_output_tokens": 32_768,
+            "default_max_tokens": None,
+            "supports_prompt_caching": False,
+            "tokenizer": "other"
+        },
         "tier_availability": ["paid"]
     },
     
@@ -66,6 +87,13 @@ MODELS = {
             "input_cost_per_million_tokens": 1.25,
             "output_cost_per_million_tokens": 10.00
         },
+        "capabilities": {
+            "context_window": 1_048_576,
+            "max_output_tokens": 65_536,
+            "default_max_tokens": 64_000,
+            "supports_prompt_caching": False,
+            "tokenizer": "gemini"
+        },
         "tier_availability": ["paid"]
     },
     # "openai/gpt-4o": {
@@ -90,6 +118,13 @@ MODELS = {
             "input_cost_per_million_tokens": 1.25,
             "output_cost_per_million_tokens": 10.00
         },
+        "capabilities": {
+            "context_window": 400_000,
+            "max_output_tokens": 128_000,
+            "default_max_tokens": None,
+            "supports_prompt_caching": False,
+            "tokenizer": "o200k"
+        },
         "tier_availability": ["paid"]
     },
     "openai/gpt-5-mini": {
@@ -98,6 +133,13 @@ MODELS = {
             "input_cost_per_million_tokens": 0.25,
             "output_cost_per_million_tokens": 2.00
         },
+        "capabilities": {
+            "context_window": 400_000,
+            "max_output_tokens": 128_000,
+            "default_max_tokens": None,
+            "supports_prompt_caching": False,
+            "tokenizer": "o200k"
+        },
         "tier_availability": ["paid"]
     },
     # "openai/gpt-4.1-mini": {
@@ -114,6 +156,13 @@ MODELS = {
             "input_cost_per_million_tokens": 3.00,
             "output_cost_per_million_tokens": 15.00
         },
+        "capabilities": {
+            "context_window": 200_000,
+            "max_output_tokens": 64_000,
+            "default_max_tokens": 8_192,
+            "supports_prompt_caching": True,
+            "tokenizer": "anthropic"
+        },
         "tier_availability": ["paid"]
     },
     "anthropic/claude-3-5-sonnet-latest": {
@@ -122,11 +171,33 @@ MODELS = {
             "input_cost_per_million_tokens": 3.00,
             "output_cost_per_million_tokens": 15.00
         },
+        "capabilities": {
+            "context_window": 200_000,
+            "max_output_tokens": 8_192,
+            "default_max_tokens": 8_192,
+            "supports_prompt_caching": True,
+            "tokenizer": "anthropic"
+        },
         "tier_availability": ["paid"]
     },   
 }
 
 # Derived structures (auto-generated from MODELS)
+def _legacy_model_names(model_name):
+    """Return alternate provider spellings that should resolve to model_name."""
+    if model_name.startswith("openrouter/deepseek/") or model_name.startswith("openrouter/qwen/"):
+        return [model_name.replace("openrouter/", "")]
+    elif model_name.startswith("gemini/"):
+        return [model_name.replace("gemini/", "")]
+    elif model_name.startswith("anthropic/"):
+        # Add anthropic/claude-sonnet-4 alias for claude-sonnet-4-20250514
+        if "claude-sonnet-4-20250514" in model_name:
+            return ["anthropic/claude-sonnet-4"]
+    elif model_name.startswith("xai/"):
+        # OpenRouter x-ai models
+        return [model_name.replace("xai/", "openrouter/x-ai/")]
+    return []
+
 def _generate_model_structures():
     """Generate all model structures from the master MODELS dictionary."""
     
@@ -155,23 +226,8 @@ def _generate_model_structures():
         pricing[model_name] = config["pricing"]
         
         # Also add pricing for legacy model name variations
-        if model_name.startswith("openrouter/deepseek/"):
-            legacy_name = model_name.replace("openrouter/", "")
-            pricing[legacy_name] = config["pricing"]
-        elif model_name.startswith("openrouter/qwen/"):
-            legacy_name = model_name.replace("openrouter/", "")
-            pricing[legacy_name] = config["pricing"]
-        elif model_name.startswith("gemini/"):
-            legacy_name = model_name.replace("gemini/", "")
+        for legacy_name in _legacy_model_names(model_name):
             pricing[legacy_name] = config["pricing"]
-        elif model_name.startswith("anthropic/"):
-            # Add anthropic/claude-sonnet-4 alias for claude-sonnet-4-20250514
-            if "claude-sonnet-4-20250514" in model_name:
-                pricing["anthropic/claude-sonnet-4"] = config["pricing"]
-        elif model_name.startswith("xai/"):
-            # Add pricing for OpenRouter x-ai models
-            openrouter_name = model_name.replace("xai/", "openrouter/x-ai/")
-            pricing[openrouter_name] = config["pricing"]
     
     return free_models, paid_models, aliases, pricing
 
@@ -0,0 +1,193 @@
+"""
+Model capability registry.
+
+Resolves any model name we may see at runtime (canonical ids, aliases, legacy
+provider spellings, OpenRouter fallbacks) to the capabilities declared in
+utils.constants.MODELS, and derives the context budget the context manager,
+the agent runner and billing plan against.
+
+Usage:
+    from utils.model_registry import get_model_capabilities, plan_context_budget
+
+    caps = get_model_capabilities("claude-sonnet-4")
+    budget = plan_context_budget("claude-sonnet-4")
+    if token_count > budget.max_input_tokens:
+        ...
+"""
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+from utils.constants import MODELS, MODEL_NAME_ALIASES, _legacy_model_names
+from utils.logger import logger
+
+# Used when neither MODELS nor litellm know anything about a model
+DEFAULT_CONTEXT_WINDOW = 128_000
+DEFAULT_MAX_OUTPUT_TOKENS = 8_192
+
+# Fraction of the context window held back to absorb tokenizer estimation error.
+# litellm counts with tiktoken, which is exact for OpenAI models and only an
+# approximation for everyone else.
+TOKENIZER_SAFETY_MARGINS = {
+    "o200k": 0.05,
+    "cl100k": 0.05,
+    "anthropic": 0.15,
+    "gemini": 0.15,
+    "other": 0.15,
+}
+
+
+# Per-call completion limits for unregistered models, matched by substring
+FAMILY_DEFAULT_MAX_TOKENS = (
+    ("sonnet", 8192),
+    ("gpt-4", 4096),
+    ("gemini-2.5-pro", 64000),
+    ("kimi-k2", 8192),
+)
+
+
+@dataclass(frozen=True)
+class ModelCapabilities:
+    model: str
+    context_window: int
+    max_output_tokens: int
+    default_max_tokens: Optional[int]
+    supports_prompt_caching: bool
+    tokenizer: str
+    input_cost_per_million_tokens: Optional[float] = None
+    output_cost_per_million_tokens: Optional[float] = None
+    known: bool = True
+
+    @property
+    def pricing(self) -> Optional[Tuple[float, float]]:
+        if self.input_cost_per_million_tokens is None or self.output_cost_per_million_tokens is None:
+            return None
+        return self.input_cost_per_million_tokens, self.output_cost_per_million_tokens
+
+
+@dataclass(frozen=True)
+class ContextBudget:
+    model: str
+    context_window: int
+    reserved_output_tokens: int
+    safety_margin_tokens: int
+
+    @property
+    def max_input_tokens(self) -> int:
+        """Prompt tokens that fit alongside the reserved completion."""
+        return max(self.context_window - self.reserved_output_tokens - self.safety_margin_tokens, 1)
+
+
+def _build_lookup() -> Dict[str, str]:
+    lookup = {}
+    for model_name in MODELS:
+        lookup[model_name] = model_name
+        for legacy_name in _legacy_model_names(model_name):
+            lookup[legacy_name] = model_name
+    lookup.update(MODEL_NAME_ALIASES)
+    return lookup
+
+
+_NAME_LOOKUP = _build_lookup()
+
+
+def resolve_model_name(model_name: str) -> Optional[str]:
+    """Return the canonical MODELS key for model_name, or None if it is not registered."""
+    if not model_name:
+        return None
+    if model_name in _NAME_LOOKUP:
+        return _NAME_LOOKUP[model_name]
+    # OpenRouter fallbacks keep the upstream provider path (openrouter/anthropic/...)
+    if model_name.startswith("openrouter/"):
+        return _NAME_LOOKUP.get(model_name[len("openrouter/"):])
+    return None
+
+
+def _guess_tokenizer(model_name: str) -> str:
+    name = model_name.lower()
+    if "gpt-4o" in name or "gpt-5" in name or "o1" in name or "gpt-4.1" in name:
+        return "o200k"
+    if "gpt" in name:
+        return "cl100k"
+    if "claude" in name or "anthropic" in name:
+        return "anthropic"
+    if "gemini" in name:
+        return "gemini"
+    return "other"
+
+
+def _from_config(model_name: str) -> ModelCapabilities:
+    entry = MODELS[model_name]
+    caps = entry["capabilities"]
+    pricing = entry.get("pricing") or {}
+    return ModelCapabilities(
+        model=model_name,
+        context_window=caps["context_window"],
+        max_output_tokens=caps["max_output_tokens"],
+        default_max_tokens=caps.get("default_max_tokens"),
+        supports_prompt_caching=caps.get("supports_prompt_caching", False),
+        tokenizer=caps.get("tokenizer", "other"),
+        input_cost_per_million_tokens=pricing.get("input_cost_per_million_tokens"),
+        output_cost_per_million_tokens=pricing.get("output_cost_per_million_tokens"),
+    )
+
+
+def _from_litellm(model_name: str) -> ModelCapabilities:
+    """Build capabilities for an unregistered model from litellm's model map."""
+    context_window = DEFAULT_CONTEXT_WINDOW
+    max_output_tokens = DEFAULT_MAX_OUTPUT_TOKENS
+    input_cost = output_cost = None
+    try:
+        import litellm
+        info = litellm.get_model_info(model_name)
+        context_window = info.get("max_input_tokens") or info.get("max_tokens") or context_window
+        max_output_tokens = info.get("max_output_tokens") or max_output_tokens
+        if info.get("input_cost_per_token") is not None and info.get("output_cost_per_token") is not None:
+            input_cost = info["input_cost_per_token"] * 1_000_000
+            output_cost = info["output_cost_per_token"] * 1_000_000
+    except Exception:
+        logger.debug(f"No capability data for model {model_name}, using defaults")
+
+    name = model_name.lower()
+    default_max_tokens = next((limit for family, limit in FAMILY_DEFAULT_MAX_TOKENS if family in name), None)
+    return ModelCapabilities(
+        model=model_name,
+        context_window=context_window,
+        max_output_tokens=max(max_output_tokens, default_max_tokens or 0),
+        default_max_tokens=default_max_tokens,
+        supports_prompt_caching="claude" in name or "anthropic" in name,
+        tokenizer=_guess_tokenizer(model_name),
+        input_cost_per_million_tokens=input_cost,
+        output_cost_per_million_tokens=output_cost,
+        known=False,
+    )
+
+
+@lru_cache(maxsize=256)
+def get_model_capabilities(model_name: str) -> ModelCapabilities:
+    """Get capabilities for any model name, falling back to litellm metadata for unregistered models."""
+    canonical = resolve_model_name(model_name)
+    if canonical:
+        return _from_config(canonical)
+    return _from_litellm(model_name)
+
+
+def plan_context_budget(model_name: str, max_output_tokens: Optional[int] = None) -> ContextBudget:
+    """Plan how many prompt tokens a call to model_name can carry.
+
+    Args:
+        model_name: Model the request will be sent to
+        max_output_tokens: Completion limit the caller will request; defaults to the
+            model's default_max_tokens, or its full output limit if it has none
+    """
+    caps = get_model_capabilities(model_name)
+    reserved = max_output_tokens or caps.default_max_tokens or caps.max_output_tokens
+    reserved = min(reserved, caps.max_output_tokens)
+    margin = TOKENIZER_SAFETY_MARGINS.get(caps.tokenizer, TOKENIZER_SAFETY_MARGINS["other"])
+    return ContextBudget(
+        model=model_name,
+        context_window=caps.context_window,
+        reserved_output_tokens=reserved,
+        safety_margin_tokens=int(caps.context_window * margin),
+    )
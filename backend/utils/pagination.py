@@ -0,0 +1,83 @@
+"""
+Keyset (cursor) pagination helpers for PostgREST queries.
+
+Pages are addressed by the sort key of a boundary row instead of an offset, so
+fetching page N costs the same as fetching page 1 as long as an index covers
+(filter columns, sort column, tie-breaker). Cursors are opaque to clients:
+url-safe base64 of the boundary row's sort value and unique id.
+
+Usage:
+    query = client.table('messages').select(columns).eq('thread_id', thread_id)
+    query = apply_keyset(query, 'created_at', 'message_id', decode_cursor(before), newer=False)
+    rows = (await query.limit(limit + 1).execute()).data
+    next_cursor = encode_cursor(rows[limit - 1], 'created_at', 'message_id') if len(rows) > limit else None
+
+Rows are ordered by a timestamp taken when they are inserted, not when they
+commit, so a walk towards newer rows can pass a row that becomes visible later
+with an older key. Pollers that must not miss rows start from `rewind_cursor`
+and merge the overlap by id.
+"""
+
+import base64
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+
+def encode_cursor(row: Dict[str, Any], sort_column: str, id_column: str) -> str:
+    raw = json.dumps([row[sort_column], row[id_column]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[Any, str]]:
+    """Return (sort value, id) of a cursor, None for no cursor. Raises a 400 for malformed cursors."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return sort_value, str(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+
+# Smallest uuid; a valid value for uuid id columns that sorts before every real id
+MIN_UUID = "00000000-0000-0000-0000-000000000000"
+
+
+def rewind_cursor(cursor: Tuple[Any, str], seconds: float) -> Tuple[str, str]:
+    """A cursor `seconds` before cursor's timestamp sort value, covering every row at that instant (uuid ids)."""
+    sort_value, _ = cursor
+    try:
+        rewound = datetime.fromisoformat(str(sort_value)) - timedelta(seconds=seconds)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    return rewound.isoformat(), MIN_UUID
+
+
+def _quote(value: Any) -> str:
+    # PostgREST logic trees need values with reserved characters (timestamps
+    # contain ':' and '+') in double quotes
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def apply_keyset(query, sort_column: str, id_column: str, cursor: Optional[Tuple[Any, str]], newer: bool):
+    """
+    Order query by (sort_column, id_column) and start it after cursor.
+
+    newer=True walks towards larger keys (ascending), newer=False towards
+    smaller keys (descending). A None cursor starts at the first row.
+    """
+    if cursor is not None:
+        sort_value, row_id = cursor
+        op = "gt" if newer else "lt"
+        # The plain bound lets the index scan start at the cursor; the OR alone
+        # would be applied as a filter over every row before it
+        query = query.gte(sort_column, sort_value) if newer else query.lte(sort_column, sort_value)
+        query = query.or_(
+            f"{sort_column}.{op}.{_quote(sort_value)},"
+            f"and({sort_column}.eq.{_quote(sort_value)},{id_column}.{op}.{_quote(row_id)})"
+        )
+    return query.order(sort_column, desc=not newer).order(id_column, desc=not newer)
@@ -557,7 +557,9 @@ class ThreadsClient:
             The streaming URL
         """
 
-        url = f"{self.base_url}/agent-run/{agent_run_id}/stream"
+        # Version 0 streams events in the version they are stored in, without
+        # transcoding; the parsers here read both versions
+        url = f"{self.base_url}/agent-run/{agent_run_id}/stream?wire_version=0"
         return url
 
 
@@ -18,7 +18,12 @@ class Colors:
 
 
 def try_parse_json(json_str: str) -> Optional[Any]:
-    """Utility function to safely parse JSON strings."""
+    """Utility function to safely parse JSON strings.
+
+    Values that are already decoded (wire version 2 events) are returned as is.
+    """
+    if isinstance(json_str, (dict, list)):
+        return json_str
     try:
         return json.loads(json_str)
     except (json.JSONDecodeError, TypeError):